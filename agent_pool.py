@@ -0,0 +1,216 @@
+# -----------------------------------------------------------------------
+# pool ของ SupervisorAgent ที่สร้างไว้แล้ว (warm) ใช้ร่วมกันระหว่าง Streamlit rerun และระหว่าง session
+# key ของ pool คือ (fingerprint ของ dataset, โมเดล, temperature) การเปลี่ยน session ที่ใช้ dataset เดิม
+# จึงไม่ต้องสร้าง LLM client, agent ย่อย และ preprocess ข้อมูลใหม่
+#   - agent หนึ่งตัวถูกยืม (lease) ได้ครั้งละหนึ่ง session เท่านั้น (memory และ session_id เป็นของ session นั้น)
+#   - lease ที่ไม่ถูกใช้งานนานเกิน AGENT_LEASE_SECONDS (เช่น ผู้ใช้ปิด browser) ถือว่าคืนแล้ว
+#   - agent ที่มี job กำลังทำงานอยู่ (pin) จะไม่ถูกยืมโดย session อื่นหรือถูก evict แม้ session จะคืน agent ไปแล้ว
+#   - memory ของการสนทนาถูกเก็บแยกตาม session และถูกผูกกลับเมื่อ session ยืม agent อีกครั้ง
+#   - agent ที่ว่างอยู่ถูก evict ตามการใช้งานล่าสุด (LRU) เมื่อจำนวนเกิน AGENT_POOL_SIZE
+#     หรือขนาดของ dataset ที่ agent ใน pool ใช้อยู่รวมกันเกิน AGENT_POOL_MAX_MB
+# -----------------------------------------------------------------------
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from datahandle import DataHandler
+
+# ค่าเริ่มต้นของ agent pool (ปรับได้ผ่าน environment variables)
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", 8))                   # จำนวน agent สูงสุดใน pool
+AGENT_POOL_MAX_MB = float(os.getenv("AGENT_POOL_MAX_MB", 2048))          # ขนาดรวมสูงสุดของ dataset ที่ agent ใน pool ใช้อยู่
+AGENT_LEASE_SECONDS = float(os.getenv("AGENT_LEASE_SECONDS", 1800))      # เวลาที่ lease ไม่ถูกใช้งานก่อนถือว่าคืนแล้ว
+AGENT_MEMORY_SESSIONS = int(os.getenv("AGENT_MEMORY_SESSIONS", 64))      # จำนวน memory ของการสนทนาที่เก็บไว้ (LRU)
+
+PoolKey = Tuple[str, str, float]
+
+
+class _PooledAgent:
+    def __init__(self, key: PoolKey, agent: Any, factory: Callable[[], Any], weight: int):
+        self.key = key
+        self.agent = agent
+        self.factory = factory
+        self.weight = weight
+        self.lease: Optional[str] = None
+        self.last_used = time.time()
+        self.jobs = 0
+
+    def idle(self, now: float) -> bool:
+        if self.jobs:
+            return False
+        return self.lease is None or now - self.last_used >= AGENT_LEASE_SECONDS
+
+
+def _dataset_weight(agent: Any) -> int:
+    # ขนาดโดยประมาณ (bytes) ของ DataFrame ที่ agent ใช้ (ไม่นับขนาดของ string แต่ละค่าเพื่อให้คำนวณได้เร็ว)
+    try:
+        return int(agent.pandas_agent.handler.get_data(agent.dataset_key).memory_usage(index=True).sum())
+    except Exception:
+        return 0
+
+
+class AgentPool:
+    """
+    คลาสสำหรับจัดการ pool ของ SupervisorAgent ที่พร้อมใช้งาน
+    """
+
+    def __init__(self, size: int = AGENT_POOL_SIZE, max_mb: float = AGENT_POOL_MAX_MB):
+        self.size = size
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries: List[_PooledAgent] = []
+        self._memories: "OrderedDict[str, Any]" = OrderedDict()
+        # key และ factory ของ agent ทุกตัวที่ pool สร้าง (ใช้สร้างใหม่เมื่อ agent ที่ session ถืออยู่ถูก evict ไปแล้ว)
+        self._origins: "weakref.WeakKeyDictionary[Any, Tuple[PoolKey, Callable[[], Any]]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _find(self, agent: Any) -> Optional[_PooledAgent]:
+        return next((entry for entry in self._entries if entry.agent is agent), None)
+
+    def _bind(self, entry: _PooledAgent, session_id: str) -> Any:
+        # ผูก agent กับ session และนำ memory ของการสนทนาของ session นั้นกลับมาใช้ (ถ้ามี)
+        entry.lease = session_id
+        entry.last_used = time.time()
+        if entry.agent.session_id != session_id or session_id not in self._memories:
+            memory = entry.agent.bind_session(session_id, self._memories.get(session_id))
+            self._memories[session_id] = memory
+        self._memories.move_to_end(session_id)
+        while len(self._memories) > AGENT_MEMORY_SESSIONS:
+            self._memories.popitem(last=False)
+        return entry.agent
+
+    def acquire(self, key: PoolKey, session_id: str, factory: Callable[[], Any]) -> Any:
+        """
+        ยืม agent สำหรับ session (หากไม่มี agent ที่ว่างสำหรับ key นี้ จะสร้างใหม่ด้วย factory)
+        Parameters:
+            key: (fingerprint ของ dataset, ชื่อโมเดล, temperature)
+            session_id (str): รหัสของ session ที่ยืม agent
+            factory: ฟังก์ชันสำหรับสร้าง SupervisorAgent ใหม่
+        Returns:
+            instance ของ SupervisorAgent ที่ผูกกับ session แล้ว
+        """
+        now = time.time()
+        with self._lock:
+            # session หนึ่งยืม agent ได้ครั้งละหนึ่งตัว
+            for entry in self._entries:
+                if entry.lease == session_id and entry.key != key:
+                    entry.lease = None
+            # agent ที่มี job ทำงานอยู่ใช้ได้เฉพาะ session ที่ agent ผูกอยู่ (เช่น ผู้ใช้กลับมาที่ session เดิมระหว่างที่ job ทำงาน)
+            candidates = [entry for entry in self._entries if entry.key == key
+                          and (entry.lease == session_id or entry.idle(now)
+                               or (entry.jobs and entry.agent.session_id == session_id))]
+            if candidates:
+                # ใช้ agent ที่ session นี้ยืมอยู่แล้วก่อน แล้วจึงใช้ agent ที่ว่างอยู่ซึ่งเคยผูกกับ session นี้
+                entry = min(candidates, key=lambda e: (e.lease != session_id, e.agent.session_id != session_id))
+                self.hits += 1
+                logging.info(f"Agent pool hit for {key[0][:12]} ({key[1]}, {key[2]}) -> session {session_id[:8]}")
+                return self._bind(entry, session_id)
+            self.misses += 1
+
+        # สร้าง agent ใหม่นอก lock (ใช้เวลานาน) แล้วจึงเพิ่มเข้า pool
+        started = time.perf_counter()
+        agent = factory()
+        logging.info(f"Agent pool miss for {key[0][:12]} ({key[1]}, {key[2]}): built in "
+                     f"{time.perf_counter() - started:.2f}s")
+        entry = _PooledAgent(key, agent, factory, _dataset_weight(agent))
+        with self._lock:
+            self._origins[agent] = (key, factory)
+            self._entries.append(entry)
+            bound = self._bind(entry, session_id)
+            self._evict()
+        return bound
+
+    def renew(self, agent: Any, session_id: str) -> Optional[Any]:
+        """
+        ต่ออายุ lease ของ agent ก่อนใช้งาน หาก lease หมดอายุและ agent ถูกยืมโดย session อื่นไปแล้ว
+        (หรือถูก evict) จะยืม agent ที่มี key เดียวกันให้แทน
+        Returns:
+            agent ที่ session ใช้ได้ หรือ None หาก agent ไม่ได้ถูกสร้างโดย pool นี้
+        """
+        with self._lock:
+            entry = self._find(agent)
+            if entry is not None and entry.lease in (session_id, None) and entry.agent.session_id == session_id:
+                entry.lease = session_id
+                entry.last_used = time.time()
+                return agent
+            origin = self._origins.get(agent)
+            if origin is None:
+                return None
+        return self.acquire(origin[0], session_id, origin[1])
+
+    def pin(self, agent: Any) -> None:
+        """
+        ระบุว่า agent มี job กำลังทำงานอยู่ (เรียกเมื่อส่ง job) agent จะไม่ว่างจนกว่าจะเรียก unpin()
+        แม้ session จะเปลี่ยนไปใช้ session อื่นหรือ lease หมดอายุระหว่างที่ job ทำงาน
+        """
+        with self._lock:
+            entry = self._find(agent)
+            if entry is not None:
+                entry.jobs += 1
+                entry.last_used = time.time()
+
+    def unpin(self, agent: Any) -> None:
+        """
+        ระบุว่า job ของ agent ทำงานเสร็จแล้ว (เรียกใน finally ของ job)
+        """
+        with self._lock:
+            entry = self._find(agent)
+            if entry is not None and entry.jobs:
+                entry.jobs -= 1
+                entry.last_used = time.time()
+                self._evict()
+
+    def release(self, session_id: str) -> None:
+        """
+        คืน agent ที่ session ยืมอยู่กลับเข้า pool (agent ยังอยู่ใน pool สำหรับ session อื่นที่ใช้ dataset เดียวกัน)
+        """
+        with self._lock:
+            for entry in self._entries:
+                if entry.lease == session_id:
+                    entry.lease = None
+            self._evict()
+
+    def discard_session(self, session_id: str) -> None:
+        """
+        คืน agent และลบ memory ของการสนทนาของ session (เมื่อ session ถูกลบ)
+        """
+        with self._lock:
+            self._memories.pop(session_id, None)
+            self.release(session_id)
+
+    def _evict(self) -> None:
+        # evict agent ที่ว่างอยู่ซึ่งใช้งานล่าสุดนานที่สุดก่อน จนกว่าจำนวนและขนาดจะอยู่ในขอบเขต
+        now = time.time()
+        while True:
+            weight = sum({entry.key[0]: entry.weight for entry in self._entries}.values())
+            if len(self._entries) <= self.size and weight <= self.max_bytes:
+                return
+            idle = [entry for entry in self._entries if entry.idle(now)]
+            if not idle:
+                return
+            victim = min(idle, key=lambda entry: entry.last_used)
+            self._entries.remove(victim)
+            logging.info(f"Agent pool evicted agent for {victim.key[0][:12]} ({victim.key[1]}, {victim.key[2]})")
+            # ลบ dataset ออกจาก memory หากไม่มี agent อื่นใน pool ใช้ dataset นี้แล้ว
+            # (DataHandler เก็บ DataFrame ตาม fingerprint ของไฟล์ ซึ่งเป็นส่วนแรกของ key ของ pool)
+            fingerprint = victim.key[0]
+            if not any(entry.key[0] == fingerprint for entry in self._entries):
+                DataHandler().unload(fingerprint)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            now = time.time()
+            return {
+                "agents": len(self._entries),
+                "leased": sum(1 for entry in self._entries if not entry.idle(now)),
+                "hits": self.hits,
+                "misses": self.misses,
+                "dataset_bytes": sum({entry.key[0]: entry.weight for entry in self._entries}.values()),
+            }
+
+
+AGENT_POOL = AgentPool()
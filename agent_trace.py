@@ -0,0 +1,130 @@
+# -----------------------------------------------------------------------
+# การเก็บ trace ของ agent แบบมีโครงสร้างผ่าน callback
+# บันทึก thought, action, input ของ tool, observation และ final answer เป็นรายการ event
+# ระหว่างที่ agent ทำงาน แทนการจับ verbose stdout แล้วใช้ regex แยกข้อความภายหลัง
+# -----------------------------------------------------------------------
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.callbacks import BaseCallbackHandler
+from pydantic import BaseModel
+
+from metrics import current_stage
+
+# เปิดการแสดง verbose log ของ agent บน stdout (ใช้สำหรับดีบักเท่านั้น ปิดไว้ใน production)
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() == "true"
+# จำนวนตัวอักษรสูงสุดของ observation ที่เก็บใน trace
+TRACE_MAX_CHARS = int(os.getenv("TRACE_MAX_CHARS", 2000))
+
+
+class TraceEvent(BaseModel):
+    """
+    โมเดลสำหรับเก็บ event หนึ่งรายการใน trace ของ agent
+    Attributes:
+        type (str): ประเภทของ event ("thought", "action", "observation", "final_answer", "error")
+        agent (str): agent ที่สร้าง event (เช่น "supervisor", "pandas_agent", "analysis_agent")
+        content (str): เนื้อหาของ event
+        tool (Optional[str]): ชื่อ tool (สำหรับ action และ observation)
+        tool_input (Optional[str]): input ที่ส่งให้ tool (สำหรับ action)
+        elapsed (float): เวลา (วินาที) นับจากเริ่มการประมวลผล
+    """
+    type: str
+    agent: str
+    content: str = ""
+    tool: Optional[str] = None
+    tool_input: Optional[str] = None
+    elapsed: float = 0.0
+
+
+def _truncate(text: str, limit: int = TRACE_MAX_CHARS) -> str:
+    return text if len(text) <= limit else text[:limit] + f"... [{len(text) - limit:,} more characters]"
+
+
+def _extract_thought(log: str) -> str:
+    # ดึงเฉพาะส่วน thought ของ ReAct log (ก่อน "Action:" หรือ "Final Answer:")
+    # log ของ agent แบบ OpenAI functions ไม่มี thought (มีเพียง "Invoking: ..." หรือตัวคำตอบเอง)
+    if not re.search(r"Action:|Final Answer:", log):
+        return ""
+    thought = re.split(r"\n?\s*(?:Action:|Final Answer:)", log, maxsplit=1)[0]
+    return re.sub(r"^\s*Thought:\s*", "", thought).strip()
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    callback สำหรับบันทึก trace ของ agent เป็นรายการ TraceEvent ระหว่างการประมวลผล
+    """
+
+    # รัน callback ใน task ที่เรียกโดยตรงเมื่อใช้กับ async agent (ไม่ส่งไป thread pool)
+    # เพื่อให้อ่าน stage ปัจจุบันจาก ContextVar ได้ถูกต้องและลำดับของ event ไม่สลับกัน
+    run_inline = True
+
+    def __init__(self, started: Optional[float] = None):
+        """
+        ตัวสร้างสำหรับ TraceCallbackHandler
+        Parameters:
+            started (float): เวลาเริ่มต้น (time.perf_counter) ที่ใช้คำนวณ elapsed ของ event (ค่าเริ่มต้นคือเวลาปัจจุบัน)
+        """
+        self.events: List[TraceEvent] = []
+        self.started = time.perf_counter() if started is None else started
+        self._tools: Dict[UUID, str] = {}
+
+    def record(self, type: str, content: str = "", **kwargs: Any) -> None:
+        """
+        เพิ่ม event ลงใน trace (ใช้ได้ทั้งจาก callback และจากโค้ดที่เรียก tool โดยตรง)
+        """
+        self.events.append(TraceEvent(
+            type=type,
+            agent=current_stage(),
+            content=content,
+            elapsed=round(time.perf_counter() - self.started, 3),
+            **kwargs,
+        ))
+
+    def on_agent_action(self, action: AgentAction, *, run_id: UUID, **kwargs: Any) -> None:
+        thought = _extract_thought(action.log or "")
+        if thought:
+            self.record("thought", thought)
+        tool_input = action.tool_input if isinstance(action.tool_input, str) else str(action.tool_input)
+        self.record("action", tool=action.tool, tool_input=tool_input)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tools[run_id] = (serialized or {}).get("name") or kwargs.get("name") or ""
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        content = getattr(output, "content", output)
+        self.record("observation", _truncate(str(content)), tool=self._tools.pop(run_id, None))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.record("error", str(error), tool=self._tools.pop(run_id, None))
+
+    def on_agent_finish(self, finish: AgentFinish, *, run_id: UUID, **kwargs: Any) -> None:
+        thought = _extract_thought(finish.log or "")
+        if thought:
+            self.record("thought", thought)
+        output = finish.return_values.get("output", "")
+        self.record("final_answer", output if isinstance(output, str) else str(output))
+
+
+def format_trace(events: List[Dict[str, Any]]) -> str:
+    """
+    แปลงรายการ event ของ trace (ในรูปแบบ dict) ให้เป็นข้อความ markdown สำหรับแสดงผลบนหน้าจอ
+    """
+    lines = []
+    for event in events:
+        prefix = f"`{event.get('agent', '')}` " if event.get("agent") not in (None, "", "supervisor") else ""
+        event_type = event.get("type")
+        if event_type == "thought":
+            lines.append(f"{prefix}**Thought:** {event.get('content', '')}")
+        elif event_type == "action":
+            lines.append(f"{prefix}**Action:** {event.get('tool')}  \n**Action Input:** {event.get('tool_input')}")
+        elif event_type == "observation":
+            lines.append(f"{prefix}**Observation:** {event.get('content', '')}")
+        elif event_type == "final_answer":
+            lines.append(f"{prefix}**Final Answer:** {event.get('content', '')}")
+        elif event_type == "error":
+            lines.append(f"{prefix}**Error:** {event.get('content', '')}")
+    return "\n\n".join(lines)
@@ -12,6 +12,8 @@ from pydantic import BaseModel, Field
 import json  
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from prompt import get_analysis_prompt
+from agent_trace import AGENT_VERBOSE
+from llm_factory import create_chat_llm
 # โหลด environment variables จากไฟล์ .env 
 load_dotenv()
 
@@ -73,7 +75,7 @@ class AnalyseAgent:
         if not self.api_key:
             raise ValueError("API key is missing. Ensure 'PANDAS_API_KEY' is set in your environment.")
         # สร้างและคืนค่า instance ของ ChatOpenAI ด้วยพารามิเตอร์ที่จำเป็น
-        return ChatOpenAI(
+        return create_chat_llm(
             base_url=self.base_url,
             model=self.model_name,
             api_key=self.api_key,
@@ -97,7 +99,7 @@ class AnalyseAgent:
             df=df,
             prompt=prompt,
             agent_type=AgentType.OPENAI_FUNCTIONS,
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             handle_parsing_errors=True,
             max_iterations=5,
             early_stopping_method="generate",
@@ -109,7 +111,7 @@ class AnalyseAgent:
             allow_dangerous_code=True
             )
 
-    def run(self, query: str, dataset_key: str) -> dict:
+    def run(self, query: str, dataset_key: str, callbacks=None) -> dict:
         try:
             agent = self.create_agent(dataset_key)
             df = self.handler.get_data(dataset_key)
@@ -136,7 +138,7 @@ class AnalyseAgent:
             Focus on providing quantitative insights directly from the data.
             """.strip()
             
-            response = agent.invoke({"input": enhanced_query})
+            response = agent.invoke({"input": enhanced_query}, config={"callbacks": callbacks})
             
             output_text = response.get('output', '').strip()
             if not output_text:
@@ -172,8 +174,8 @@ class AnalyseAgent:
 
 
 
-    def run_and_return_code(self, query: str, dataset_key: str) -> dict:
-        result = self.run(query, dataset_key)
+    def run_and_return_code(self, query: str, dataset_key: str, callbacks=None) -> dict:
+        result = self.run(query, dataset_key, callbacks=callbacks)
         if result.get("status") == "success":
             data = result.get("data", {})
             return {
@@ -1,6 +1,5 @@
 import ast
 import logging                   
-import re                        
 import traceback                 
 from deep_translator import GoogleTranslator  
 from dotenv import load_dotenv   
@@ -9,9 +8,15 @@ import os
 from datetime import datetime    
 import pytz                      
 import json                      
-import uuid                      
-import shutil                    
-from supervisor import SupervisorAgent, PLOT_DIR  
+import time
+from supervisor import SupervisorAgent, PLOT_DIR, PLOT_STORE
+from chat_render import CHAT_WINDOW_SIZE, message_id, new_message_id, prepared_message
+from jobs import get_job_manager, JOB_POLL_SECONDS, FAILED, INTERRUPTED
+from session_store import create_session_manager, SESSION_PAGE_SIZE
+from janitor import start_janitor
+from blob_store import BlobStore, BLOB_STORE_DIR
+from agent_pool import AGENT_POOL
+from data_preview import preview_page, summary_header, PREVIEW_PAGE_SIZE
 from datahandle import DataHandler   
 import matplotlib.pyplot as plt  
 import numpy as np               
@@ -23,6 +28,7 @@ load_dotenv()
 APP_NAME = "(DEMO) Data Analysis Assistant 📊"  # ชื่อของแอปพลิเคชัน
 BASE_SESSION_DIR = "sessions"            # โฟลเดอร์หลักสำหรับเก็บข้อมูล session ของผู้ใช้
 TEMP_UPLOAD_DIR = "temp_uploads"         # โฟลเดอร์ชั่วคราวสำหรับเก็บไฟล์ที่อัปโหลดเข้ามา
+BLOB_STORE = BlobStore(BLOB_STORE_DIR)   # ที่เก็บไฟล์ชุดข้อมูลที่อัปโหลด (เก็บไฟล์ที่เนื้อหาเหมือนกันเพียงครั้งเดียว)
 THAI_TZ = pytz.timezone('Asia/Bangkok')
 
 # ตั้งค่าหน้าเว็บของ Streamlit
@@ -245,144 +251,42 @@ def get_model_base_url(model):
     else: 
         return "https://api.opentyphoon.ai/v1"
 
-# =======================================================================
-# คลาส Session สำหรับเก็บข้อมูลการสนทนาและการจัดการ session
-# =======================================================================
-class Session:
-    def __init__(self, session_id=None):
-        # กำหนด session_id ถ้าไม่ระบุจะสร้างใหม่โดยใช้ uuid
-        self.session_id = session_id or str(uuid.uuid4())
-        # เก็บเวลาที่ session ถูกสร้างในรูปแบบ UTC
-        self.created_at = datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
-        # รายการข้อความใน session (ทั้งจากผู้ใช้และผู้ช่วย)
-        self.messages = []
-        # เก็บไฟล์ที่ถูกอัปโหลด (ถ้ามี)
-        self.uploaded_file = None
-        # เก็บเส้นทางของไฟล์ที่ถูกอัปโหลด
-        self.file_path = None
-        # เก็บเวลาที่มีการใช้งาน session ครั้งสุดท้าย
-        self.last_activity = self.created_at
-        
-    def to_dict(self):
-        """
-        แปลงข้อมูลของ session เป็น dict สำหรับการบันทึกลงไฟล์ JSON
-        """
-        return {
-            'session_id': self.session_id,
-            'created_at': self.created_at,
-            'messages': self.messages,
-            'file_path': self.file_path,
-            'last_activity': self.last_activity
-        }
-    
-    @classmethod
-    def from_dict(cls, data):
-        """
-        สร้าง instance ของ Session จาก dict ที่ได้บันทึกไว้
-        """
-        session = cls(session_id=data['session_id'])
-        session.created_at = data['created_at']
-        session.messages = data['messages']
-        session.file_path = data['file_path']
-        session.last_activity = data.get('last_activity', datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S'))
-        return session
-
-    def update_activity(self):
-        """
-        อัปเดตเวลาที่มีการใช้งาน session
-        """
-        self.last_activity = datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
-
-# =======================================================================
-# คลาส SessionManager สำหรับจัดการ session ทั้งหมด (สร้าง, โหลด, ลบ, รายการ)
-# =======================================================================
-class SessionManager:
-    def __init__(self, base_dir=BASE_SESSION_DIR):
-        # กำหนดโฟลเดอร์หลักสำหรับเก็บ session
-        self.base_dir = base_dir
-        # ตรวจสอบให้แน่ใจว่าโฟลเดอร์หลักมีอยู่ ถ้าไม่มีให้สร้างใหม่
-        self.ensure_base_dir()
-        
-    def ensure_base_dir(self):
-        os.makedirs(self.base_dir, exist_ok=True)
-        
-    def get_session_dir(self, session_id):
-        # คืนค่าเส้นทางของ session ตาม session_id
-        return os.path.join(self.base_dir, session_id)
-    
-    def create_session(self):
-        # สร้าง session ใหม่และบันทึกลงในระบบ
-        session = Session()
-        session_dir = self.get_session_dir(session.session_id)
-        os.makedirs(session_dir, exist_ok=True)
-        self.save_session(session)
-        return session
-    
-    def save_session(self, session):
-        # บันทึกข้อมูล session ลงในไฟล์ session.json ภายในโฟลเดอร์ของ session
-        session_dir = self.get_session_dir(session.session_id)
-        os.makedirs(session_dir, exist_ok=True)
-        session_file = os.path.join(session_dir, 'session.json')
-        with open(session_file, 'w') as f:
-            json.dump(session.to_dict(), f)
-    
-    def load_session(self, session_id):
-        # โหลด session จากไฟล์ session.json ตาม session_id ที่ระบุ
-        session_dir = self.get_session_dir(session_id)
-        session_file = os.path.join(session_dir, 'session.json')
-        if os.path.exists(session_file):
-            with open(session_file, 'r') as f:
-                try:
-                    data = json.load(f)
-                    return Session.from_dict(data)
-                except json.JSONDecodeError:
-                    return None
-        return None
-    
-    def delete_session(self, session_id):
-        # ลบโฟลเดอร์ของ session ที่ระบุ (ลบไฟล์ทั้งหมดภายใน session นั้น)
-        session_dir = self.get_session_dir(session_id)
-        if os.path.exists(session_dir):
-            shutil.rmtree(session_dir)
-    
-    def list_sessions(self):
-        # คืนค่าเป็นรายการ session ทั้งหมดที่มีอยู่ โดยเรียงลำดับตามเวลาที่มีการใช้งานล่าสุด (ล่าสุดมาก่อน)
-        if not os.path.exists(self.base_dir):
-            return []
-        sessions = []
-        for session_id in os.listdir(self.base_dir):
-            session = self.load_session(session_id)
-            if session:
-                sessions.append(session)
-        return sorted(sessions, key=lambda x: x.last_activity, reverse=True)
-
 # =======================================================================
 # ฟังก์ชันสำหรับจัดการไฟล์ที่ผู้ใช้อัปโหลด (บันทึกและลบไฟล์ที่เกี่ยวข้องกับ session)
 # =======================================================================
 def save_uploaded_file(uploaded_file, session_id):
     """
-    บันทึกไฟล์ที่ผู้ใช้อัปโหลดลงในโฟลเดอร์ของ session
+    บันทึกไฟล์ที่ผู้ใช้อัปโหลดลงใน BLOB_STORE (เขียนทีละ chunk พร้อมคำนวณ sha256)
+    ไฟล์ที่มีเนื้อหาเหมือนกับไฟล์ที่เคยอัปโหลดแล้วจะไม่ถูกเก็บซ้ำ และ session จะอ้างอิงไฟล์เดิม
     Parameters:
         uploaded_file: ไฟล์ที่อัปโหลด (Streamlit UploadedFile)
         session_id: ID ของ session ปัจจุบัน
     Returns:
-        เส้นทางของไฟล์ที่ถูกบันทึก หากไม่มีไฟล์ให้คืนค่า None
+        tuple ของเส้นทางของไฟล์และ sha256 ของเนื้อหา หากไม่มีไฟล์หรือบันทึกไม่สำเร็จให้คืนค่า (None, None)
     """
     if uploaded_file is not None:
-        session_dir = os.path.join(BASE_SESSION_DIR, session_id)
-        os.makedirs(session_dir, exist_ok=True)
-        
-        file_path = os.path.join(session_dir, uploaded_file.name)
         try:
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            logging.info(f"File saved successfully at {file_path}")
-            return file_path
+            uploaded_file.seek(0)
+            _, ext = os.path.splitext(uploaded_file.name)
+            digest, _ = BLOB_STORE.put_stream(uploaded_file, ext, session_id=session_id)
+            # ใช้นามสกุลที่บันทึกไว้ใน index (ไฟล์เนื้อหาเดียวกันที่เคยอัปโหลดด้วยนามสกุลอื่นจะใช้ไฟล์เดิม)
+            file_path = BLOB_STORE.file_path(digest)
+            logging.info(f"File {uploaded_file.name} saved successfully at {file_path}")
+            return file_path, digest
         except Exception as e:
             logging.error(f"Error saving file: {e}")
             st.error(f"Error saving file: {e}")
-            return None
-    return None
+            return None, None
+    return None, None
+
+
+def release_session_files(session_id):
+    """
+    ปล่อยการอ้างอิงกราฟและไฟล์ชุดข้อมูลของ session ที่ถูกลบ เพื่อให้ไฟล์ที่ไม่มีใครใช้ถูกลบออกจาก store
+    """
+    PLOT_STORE.release_session(session_id)
+    BLOB_STORE.release_session(session_id)
+    AGENT_POOL.discard_session(session_id)
 
 
 def delete_session_file(session_id):
@@ -402,15 +306,20 @@ def delete_session_file(session_id):
 # ใช้ DataHandler ในการโหลดและ preprocess ข้อมูล
 # =======================================================================
 
-@st.cache_data
-def load_data(file_path, session_id):
+def load_data(file_path, dataset_key):
+    """
+    โหลดและ preprocess ข้อมูลของ session ใน DataHandler (instance เดียวของ process)
+    หาก dataset ถูกโหลดจากไฟล์เดียวกันไว้แล้วจะคืนค่าทันที และไฟล์ที่เคย parse แล้วจะถูกอ่านจาก cache DataFrame
+    (ไม่ใช้ st.cache_data เพราะจะ pickle DataHandler และ DataFrame ทั้งหมดทุกครั้งที่ถูกเรียก)
+    """
     if not file_path:
         st.error("No file path provided.")
         return None
 
     data_handler = DataHandler({})
-    file_key = os.path.splitext(os.path.basename(file_path))[0]
-    data_handler.dataset_paths[file_key] = file_path
+    if data_handler.is_loaded(dataset_key, file_path):
+        return data_handler
+    data_handler.dataset_paths[dataset_key] = file_path
     try:
         data_handler.load_data()
         data_handler.preprocess_data()
@@ -419,11 +328,70 @@ def load_data(file_path, session_id):
         logging.error(f"Error loading file: {e}")
         return None
     return data_handler
+def render_data_preview(data_handler, dataset_key):
+    """
+    แสดงตัวอย่างข้อมูลทีละหน้า โดยการเรียงลำดับ การกรอง และการแบ่งหน้าทำบน server
+    และส่งไปยัง browser เฉพาะแถวของหน้าที่แสดงอยู่ (ไม่ส่ง DataFrame ทั้งหมดทุกครั้งที่ rerun)
+    """
+    # ดึง DataFrame จาก DataHandler โดยใช้ dataset key
+    df = data_handler.get_data(dataset_key)
+    # สรุปข้อมูลจาก profile ที่ถูก cache ไว้ใน DataHandler
+    st.caption(summary_header(data_handler.get_profile(dataset_key)))
+
+    columns = list(df.columns)
+    col_sort, col_order, col_filter, col_text = st.columns([2, 1, 2, 2])
+    with col_sort:
+        sort_by = st.selectbox("Sort by", ["(original order)"] + columns, key="preview_sort")
+    with col_order:
+        ascending = st.radio("Order", ["↑", "↓"], horizontal=True, key="preview_order") == "↑"
+    with col_filter:
+        filter_column = st.selectbox("Filter column", ["(none)"] + columns, key="preview_filter_column")
+    with col_text:
+        filter_text = st.text_input("Filter", key="preview_filter_text",
+                                    help="Text to search for, or for numeric columns: 10..20, >100, <=5",
+                                    disabled=filter_column == "(none)")
+    filters = {filter_column: filter_text} if filter_column != "(none)" and filter_text else {}
+    sort_column = None if sort_by == "(original order)" else sort_by
+
+    # กลับไปหน้าแรกเมื่อเปลี่ยน dataset, การเรียงลำดับ หรือเงื่อนไขการกรอง
+    view = (dataset_key, sort_column, ascending, tuple(filters.items()))
+    if st.session_state.get('preview_view') != view:
+        st.session_state['preview_view'] = view
+        st.session_state['preview_page'] = 0
+
+    dataset_id = data_handler.get_fingerprint(dataset_key) or f"{dataset_key}:{id(df)}"
+    page = st.session_state.get('preview_page', 0)
+    page_df, total = preview_page(df, dataset_id, page=page, page_size=PREVIEW_PAGE_SIZE,
+                                  sort_by=sort_column, ascending=ascending, filters=filters)
+    page_count = max((total + PREVIEW_PAGE_SIZE - 1) // PREVIEW_PAGE_SIZE, 1)
+    page = min(page, page_count - 1)
+    st.dataframe(page_df)
+
+    col_prev, col_info, col_next = st.columns([1, 4, 1])
+    with col_prev:
+        if st.button("◀", key="preview_prev", disabled=page == 0):
+            st.session_state['preview_page'] = page - 1
+            st.rerun()
+    with col_info:
+        first = page * PREVIEW_PAGE_SIZE + 1 if total else 0
+        filtered = f" (filtered from {len(df):,})" if filters else ""
+        st.caption(f"Rows {first:,}–{page * PREVIEW_PAGE_SIZE + len(page_df):,} of {total:,}{filtered} · "
+                   f"page {page + 1}/{page_count}")
+    with col_next:
+        if st.button("▶", key="preview_next", disabled=page >= page_count - 1):
+            st.session_state['preview_page'] = page + 1
+            st.rerun()
+
 # =======================================================================
 # Initializations: กำหนดค่าเริ่มต้นใน session state ของ Streamlit
 # =======================================================================
 if 'session_manager' not in st.session_state:
-    st.session_state['session_manager'] = SessionManager()
+    # เมื่อ session ถูกลบ ให้ปล่อยการอ้างอิงกราฟและไฟล์ชุดข้อมูลของ session นั้น
+    st.session_state['session_manager'] = create_session_manager(BASE_SESSION_DIR, on_delete=release_session_files)
+# janitor ทำงานใน background thread (หนึ่งตัวต่อ process) เพื่อลบไฟล์ของ session ที่ไม่ได้ใช้งาน กราฟ และไฟล์ชั่วคราว
+JANITOR = start_janitor(st.session_state['session_manager'], PLOT_STORE, blob_store=BLOB_STORE, temp_dir=TEMP_UPLOAD_DIR)
+# คำถามของผู้ใช้ทำงานเป็น background job บน event loop กลาง (หนึ่ง JobManager ต่อ process ใช้ร่วมกันทุกผู้ใช้)
+JOB_MANAGER = get_job_manager(BASE_SESSION_DIR)
 if 'current_session' not in st.session_state:
     st.session_state['current_session'] = None
 if 'data_handler' not in st.session_state:
@@ -434,6 +402,18 @@ if 'messages' not in st.session_state:
     st.session_state['messages'] = []
 if 'initial_message_sent' not in st.session_state:
     st.session_state['initial_message_sent'] = False 
+# job ที่หน้าจอกำลังรอผลอยู่ (เมื่อ job เสร็จ session ปัจจุบันจะถูกโหลดใหม่เพื่อแสดงคำตอบ)
+if 'active_job' not in st.session_state:
+    st.session_state['active_job'] = None
+# ข้อความแจ้งเตือนของ job ที่ไม่สำเร็จ (แสดงครั้งเดียวหลัง job เสร็จ)
+if 'job_notice' not in st.session_state:
+    st.session_state['job_notice'] = None
+# จำนวนข้อความล่าสุดที่แสดงในแชท (เพิ่มขึ้นเมื่อผู้ใช้กด "Load earlier messages")
+if 'chat_window' not in st.session_state:
+    st.session_state['chat_window'] = CHAT_WINDOW_SIZE
+# หน้าปัจจุบันของรายการ session ใน sidebar
+if 'session_page' not in st.session_state:
+    st.session_state['session_page'] = 0
 
 # =======================================================================
 # ฟังก์ชันสำหรับจัดการ session (เริ่ม session ใหม่, เปลี่ยน session, ลบ session, ล้างประวัติการสนทนา)
@@ -446,6 +426,7 @@ def start_new_session():
     """
     session = st.session_state['session_manager'].create_session()
     st.session_state['current_session'] = session
+    st.session_state['chat_window'] = CHAT_WINDOW_SIZE
     st.success(f"Started new session: {session.session_id[:8]}")
     return session
 
@@ -459,33 +440,29 @@ def switch_session(session_id: str, selected_model: str, temperature: float):
         if not session:
             raise ValueError(f"Session with ID {session_id} not found.")
 
-        # ตั้งค่า session ปัจจุบัน
+        # คืน agent ของ session เดิมเข้า pool แล้วตั้งค่า session ปัจจุบัน
+        if st.session_state['current_session']:
+            AGENT_POOL.release(st.session_state['current_session'].session_id)
         st.session_state['current_session'] = session
+        st.session_state['chat_window'] = CHAT_WINDOW_SIZE
         
         # ตรวจสอบว่ามีไฟล์ใน session หรือไม่
         if session.file_path and os.path.exists(session.file_path):
             # โหลดข้อมูลจากไฟล์ของ session นั้น
-            st.session_state['data_handler'] = load_data(session.file_path, session.session_id)
-            
             # กำหนด dataset key จากชื่อไฟล์ที่อัปโหลด
-            dataset_key = os.path.splitext(os.path.basename(session.file_path))[0]
+            # DataFrame ถูกเก็บใน DataHandler ตาม fingerprint ของไฟล์ (ชื่อไฟล์ใช้แสดงผลเท่านั้น)
+            dataset_key = session.dataset_key()
+            st.session_state['data_handler'] = load_data(session.file_path, session.data_key())
             
-            # สร้าง instance ของ SupervisorAgent
-            st.session_state['supervisor_agent'] = SupervisorAgent(
-                temperature=temperature,
-                base_url=get_model_base_url(selected_model),
-                model_name=selected_model,
-                dataset_paths={dataset_key: session.file_path},
-                dataset_key=dataset_key,
-                session_id=session.session_id,
-                supervisor_api_key=get_supervisor_api_key(selected_model),
-                agent_api_key=get_agent_api_key(selected_model),
-                explanner_api_key=get_explanne_tool_api_key(selected_model),
-            )
+            # ยืม SupervisorAgent ที่พร้อมใช้งานจาก AGENT_POOL (สร้างใหม่เฉพาะเมื่อไม่มี agent ของ dataset และโมเดลนี้)
+            st.session_state['supervisor_agent'] = acquire_supervisor_agent(session, selected_model, temperature)
 
             logging.info(f"Switched to session {session_id} with dataset {dataset_key}")
         else:
-            # หากไม่มีไฟล์ ให้รีเซ็ต data handler และ agent
+            # หากไม่มีไฟล์ (หรือไฟล์ถูกลบโดย janitor เพราะไม่ได้ใช้งานนาน) ให้รีเซ็ต data handler และ agent
+            if session.file_path:
+                session.file_path = session.file_hash = session.file_name = None
+                st.session_state['session_manager'].save_session(session)
             st.session_state['data_handler'] = DataHandler({})
             st.session_state['supervisor_agent'] = None
             st.warning("⚠️ This session has no dataset. Please upload a file to continue.")
@@ -496,6 +473,33 @@ def switch_session(session_id: str, selected_model: str, temperature: float):
         st.error(f"Error switching session: {str(e)}")
 
 
+def acquire_supervisor_agent(session, selected_model: str, temperature: float):
+    """
+    ยืม SupervisorAgent สำหรับ session จาก AGENT_POOL โดยใช้ key (fingerprint ของ dataset, โมเดล, temperature)
+    agent อ่าน DataFrame จาก DataHandler ด้วย fingerprint เดียวกัน ส่วนชื่อไฟล์ใช้ใน prompt
+    Returns:
+        instance ของ SupervisorAgent ที่ผูกกับ session แล้ว
+    """
+    file_path = session.file_path
+    fingerprint = session.data_key()
+
+    def build():
+        return SupervisorAgent(
+            temperature=temperature,
+            base_url=get_model_base_url(selected_model),
+            model_name=selected_model,
+            dataset_paths={fingerprint: file_path},
+            dataset_key=fingerprint,
+            dataset_name=session.dataset_key(),
+            session_id=session.session_id,
+            supervisor_api_key=get_supervisor_api_key(selected_model),
+            agent_api_key=get_agent_api_key(selected_model),
+            explanner_api_key=get_explanne_tool_api_key(selected_model),
+        )
+
+    return AGENT_POOL.acquire((fingerprint, selected_model, temperature), session.session_id, build)
+
+
 def delete_current_session():
     """
     ลบ session ปัจจุบัน พร้อมล้างข้อมูลที่เกี่ยวข้องใน session state
@@ -513,12 +517,213 @@ def clear_chat_history():
     ล้างประวัติการสนทนาใน session ปัจจุบันและบันทึกการเปลี่ยนแปลง
     """
     if st.session_state['current_session']:
+        st.session_state['session_manager'].clear_messages(st.session_state['current_session'].session_id)
         st.session_state['current_session'].messages = []
-        st.session_state['session_manager'].save_session(st.session_state['current_session'])
+        st.session_state['current_session'].message_count = 0
+        PLOT_STORE.release_session(st.session_state['current_session'].session_id)
         if st.session_state['supervisor_agent']:
             st.session_state['supervisor_agent'].clear_memory()
         st.success("Chat history cleared")
 
+# =======================================================================
+# ฟังก์ชันสำหรับบันทึกคำตอบและแสดงความคืบหน้าของ background job
+# =======================================================================
+def store_assistant_response(session_manager, session_id, response):
+    """
+    บันทึกคำตอบจาก SupervisorAgent ลงในที่เก็บ session และเพิ่มการอ้างอิงกราฟใน PLOT_STORE
+    (ถูกเรียกจาก worker ของ JobManager เมื่อ job ได้คำตอบ จึงไม่ใช้ st.* และโหลด session จากที่เก็บใหม่)
+    Parameters:
+        session_manager: ที่เก็บ session
+        session_id: รหัสของ session ที่ต้องการบันทึกคำตอบ
+        response: instance ของ SupervisorResponse
+    """
+    session = session_manager.load_session(session_id)
+    if session is None:
+        # session ถูกลบระหว่างที่ job กำลังทำงาน
+        logging.error(f"Session {session_id} not found, response discarded")
+        return
+    message = {
+        "id": new_message_id(),
+        "role": "assistant",
+        "content": response.model_dump(),
+        "timestamp": datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
+    }
+    # เพิ่มการอ้างอิงกราฟที่ข้อความนี้ใช้ใน PLOT_STORE
+    PLOT_STORE.add_refs(
+        session_id,
+        [plot.digest for plot in response.plot_data.get("plots", []) if plot.digest]
+    )
+    
+    # เพิ่มข้อความลงใน session และบันทึกต่อท้าย log ของ session
+    session_manager.append_message(session, message)
+    
+    # Log the response for debugging
+    logging.info(f"Response from SupervisorAgent: {response.model_dump()}")
+
+def finish_job(job, session_id):
+    """
+    โหลด session ปัจจุบันใหม่จากที่เก็บเมื่อ job เสร็จ (คำตอบถูกบันทึกโดย worker แล้ว)
+    และเก็บข้อความแจ้งเตือนหาก job ไม่สำเร็จ
+    """
+    st.session_state['active_job'] = None
+    current_session = st.session_state['current_session']
+    if current_session and current_session.session_id == session_id:
+        session = st.session_state['session_manager'].load_session(session_id)
+        if session:
+            st.session_state['current_session'] = session
+    if job is not None and job.status in (FAILED, INTERRUPTED) and job.error:
+        st.session_state['job_notice'] = job.error
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(job_id, session_id):
+    """
+    แสดงความคืบหน้าของ job (ขั้นตอน, tool ที่ทำงาน, thought และคำตอบที่กำลังถูกสร้าง)
+    fragment นี้ถูกรันใหม่ทุก JOB_POLL_SECONDS โดยไม่รันทั้ง script และไม่ block thread ระหว่างรอ
+    เมื่อ job เสร็จจะรันทั้ง script ใหม่เพื่อแสดงคำตอบที่ถูกบันทึกแล้ว
+    Parameters:
+        job_id: รหัสของ job
+        session_id: รหัสของ session ของ job
+    """
+    job = JOB_MANAGER.get(job_id)
+    if job is None or not job.active():
+        finish_job(job, session_id)
+        st.rerun()
+    stage = f" · {job.stage}" if job.stage else ""
+    with st.status(f"🤖 Assistant is typing... ({job.status}{stage})", expanded=True):
+        col_elapsed, col_cancel = st.columns([4, 1])
+        with col_elapsed:
+            st.caption(f"⏱️ {time.time() - job.created_at:.0f}s")
+        with col_cancel:
+            if st.button("⏹️ Cancel", key=f"cancel_{job_id}"):
+                JOB_MANAGER.cancel(job_id)
+        if job.progress:
+            st.markdown("  \n".join(job.progress))
+        view = JOB_MANAGER.view(job_id)
+        if view is not None and view.thought:
+            st.caption(view.thought)
+        if job.answer:
+            st.markdown(f"🤖 Assistant: {job.answer}")
+
+# =======================================================================
+# ฟังก์ชันสำหรับแสดงข้อความในแชท
+# =======================================================================
+def visible_messages(session):
+    """
+    คืนค่ารายการ (รหัสของข้อความ, ข้อความ) ของข้อความล่าสุดที่อยู่ในหน้าต่างของแชท
+    (โหลดจากที่เก็บ session เฉพาะข้อความในหน้าต่าง หากยังไม่ได้โหลดประวัติทั้งหมดของ session)
+    """
+    start = max(session.message_count - st.session_state['chat_window'], 0)
+    if session.messages_loaded():
+        messages = session.messages[start:]
+    else:
+        messages = st.session_state['session_manager'].load_messages(
+            session.session_id, limit=session.message_count - start, offset=start)
+    return [(message_id(message, session.session_id, index), message)
+            for index, message in enumerate(messages, start=start)]
+
+def render_plot(plot, key):
+    """
+    แสดงภาพย่อของกราฟ และโหลดไฟล์ความละเอียดเต็มเมื่อผู้ใช้เปิด "Full resolution" เท่านั้น
+    Parameters:
+        plot: dict ที่มี digest และ filename ของกราฟ
+        key: key ของ widget (ไม่ซ้ำกันต่อกราฟ)
+    """
+    plot_path = os.path.join(PLOT_DIR, plot["filename"])
+    if not os.path.exists(plot_path):
+        # กราฟอาจถูกลบโดย garbage collection ของ PLOT_STORE แล้ว
+        st.info("🗑️ This plot has expired and is no longer available.")
+        return
+    # กราฟรุ่นเก่าที่ไม่มี digest จะแสดงไฟล์เดิม
+    thumbnail_path = PLOT_STORE.thumbnail(plot["digest"]) if plot["digest"] else None
+    if thumbnail_path is None or thumbnail_path == plot_path:
+        st.image(plot_path, width=800)
+        return
+    if st.toggle("🔍 Full resolution", key=f"full_{key}"):
+        st.image(plot_path, width=800)
+    else:
+        st.image(thumbnail_path, width=800)
+
+def render_message(key, message):
+    """
+    แสดงข้อความหนึ่งข้อความในแชท (ข้อมูลของคำตอบถูกเตรียมไว้ใน cache ตามรหัสของข้อความ)
+    Parameters:
+        key: รหัสของข้อความ
+        message: ข้อความที่บันทึกใน session
+    """
+    if message["role"] == "user":
+        st.markdown(f"""
+        <div class="user-message">
+            <div style="display: flex; justify-content: space-between;">
+                <div>{message["content"]}</div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        return
+
+    prepared = prepared_message(key, message, translate_func)
+    # แสดงผลจาก pandas_agent
+    pandas_response = prepared["pandas"]
+    if pandas_response:
+        if pandas_response["plots"]:
+            for index, plot in enumerate(pandas_response["plots"]):
+                with st.container():
+                    st.markdown("🐼 Assistant (Pandas Agent):")
+                    render_plot(plot, f"{key}_{index}")
+                    with st.expander("Show plot details"):
+                        st.code(pandas_response["output"])
+        elif pandas_response["has_output"]:
+            st.markdown("🐼 Assistant (Pandas Agent):")
+            st.code(pandas_response["output"])
+        if pandas_response["code"]:
+            with st.expander("Show Code from Pandas Agent"):
+                st.code(pandas_response["code"], language="python")
+        if pandas_response["explanation"]:
+            st.write("🐼 Assistant (Pandas Agent):")
+            st.write(pandas_response["explanation"])
+
+    # ส่วนแสดงผลสำหรับ analysis_agent
+    analysis_response = prepared["analysis"]
+    if analysis_response:
+        # แสดงส่วนหัวของ Assistant
+        st.markdown("""
+        <div class="assistant-message">
+            <div style="display: flex; justify-content: space-between;">
+                <div>🧑🏻‍🏫 Assistant (Analysis Agent):</div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # แสดงผลการวิเคราะห์
+        with st.expander("🔍 Analysis Details", expanded=True):
+            # 1. แสดงคำอธิบาย
+            if analysis_response["explanation"] is not None:
+                st.markdown(f"**คำอธิบาย:** {analysis_response['explanation']}")
+
+            # 2. แสดงโค้ด (ถ้ามี)
+            if analysis_response["code"]:
+                with st.expander("🔍 แสดงโค้ดที่ใช้ในการวิเคราะห์"):
+                    st.code(analysis_response["code"], language="python")
+
+            # 3. แสดงผลลัพธ์การรัน (ถ้ามี)
+            if analysis_response["execution_result"]:
+                with st.expander("📊 ผลลัพธ์การวิเคราะห์"):
+                    st.write(analysis_response["execution_result"])
+
+            # 4. แสดง response (ถ้ามี)
+            if analysis_response["response"]:
+                st.markdown("**ผลการวิเคราะห์:**")
+                st.write(analysis_response["response"])
+
+    # แสดงข้อความตอบกลับหลัก
+    if prepared["response"] or not (pandas_response or analysis_response):
+        st.markdown(f"""
+        <div class="assistant-message">
+            <div style="display: flex; justify-content: space-between;">
+                <div>🤖 Assistant: {prepared["response"]}</div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
 # =======================================================================
 # ฟังก์ชันสำหรับจัดการการส่งข้อความจากผู้ใช้
 # =======================================================================
@@ -527,8 +732,7 @@ def handle_submit(user_input):
     จัดการการส่งข้อความจากผู้ใช้:
       - ตรวจสอบว่ามี session ปัจจุบันหรือไม่
       - เพิ่มข้อความของผู้ใช้เข้าไปในประวัติการสนทนา
-      - เรียกใช้งาน SupervisorAgent เพื่อรับคำตอบ
-      - เพิ่มคำตอบจากผู้ช่วยลงในประวัติและบันทึก session
+      - ส่งคำถามไปยัง SupervisorAgent เป็น background job (คำตอบจะถูกบันทึกลง session โดย worker)
       - รันสคริปต์ใหม่เพื่ออัปเดตหน้าจอ
     Parameters:
         user_input: ข้อความที่ผู้ใช้ป้อนเข้ามา
@@ -536,40 +740,37 @@ def handle_submit(user_input):
     if not st.session_state['current_session']:
         st.warning("Please start or select a session first")
         return
-        
+    if JOB_MANAGER.active_job(st.session_state['current_session'].session_id):
+        st.warning("Please wait for the current request to finish")
+        return
+
     if user_input.strip() and st.session_state['supervisor_agent']:
         current_session = st.session_state['current_session']
         current_session.update_activity()
         
         # เพิ่มข้อความจากผู้ใช้ลงใน session
         message = {
+            "id": new_message_id(),
             "role": "user",
             "content": user_input,
             "timestamp": datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
         }
-        current_session.messages.append(message)
+        st.session_state['session_manager'].append_message(current_session, message)
         st.session_state['messages'].append(message)
         
         try:
-            with st.spinner("🤖 Assistant is typing..."):
-                # ส่งข้อความไปยัง SupervisorAgent และรับคำตอบ
-                response = st.session_state['supervisor_agent'].run(user_input)
-                
-                # เพิ่มข้อความจากผู้ช่วยลงใน session
-                message = {
-                    "role": "assistant",
-                    "content": response.model_dump(),
-                    "timestamp": datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
-                }
-                current_session.messages.append(message)
-                st.session_state['messages'].append(message)
-                
-                # บันทึก session ปัจจุบัน
-                st.session_state['session_manager'].save_session(current_session)
-                
-                # Log the response for debugging
-                logging.info(f"Response from SupervisorAgent: {response.model_dump()}")
-                
+            # ต่ออายุการยืม agent (หาก lease หมดอายุและ agent ถูกใช้โดย session อื่นแล้ว จะได้ agent ตัวใหม่)
+            supervisor_agent = AGENT_POOL.renew(st.session_state['supervisor_agent'], current_session.session_id) \
+                or st.session_state['supervisor_agent']
+            st.session_state['supervisor_agent'] = supervisor_agent
+            # ส่งข้อความไปยัง SupervisorAgent เป็น background job (คำตอบจะถูกบันทึกลง session เมื่อ job เสร็จ)
+            # เก็บ job_id ทันที เพื่อให้ job ที่เสร็จก่อนรอบถัดไปของ UI ยังถูกส่งต่อไปยัง finish_job()
+            session_manager = st.session_state['session_manager']
+            st.session_state['active_job'] = JOB_MANAGER.submit(
+                current_session.session_id, supervisor_agent, user_input,
+                on_result=lambda session_id, response: store_assistant_response(session_manager, session_id, response),
+            )
+            
         except Exception as e:
             st.error(f"Error: {str(e)}")
             logging.error(f"Error in handle_submit: {str(e)}")
@@ -584,30 +785,35 @@ def handle_submit(user_input):
 def main():
     # แสดงชื่อแอปพลิเคชันบนหน้าเว็บ
     st.title(APP_NAME)
+    # job ที่รออยู่เสร็จระหว่างรอบของ fragment (เช่น ผู้ใช้กดปุ่มอื่น) ให้โหลดคำตอบจากที่เก็บ session
+    job_id = st.session_state['active_job']
+    if job_id:
+        job = JOB_MANAGER.get(job_id)
+        if job is None or not job.active():
+            finish_job(job, job.session_id if job else None)
+    # แสดงข้อความแจ้งเตือนของ job ที่ไม่สำเร็จ (ถ้ามี)
+    if st.session_state['job_notice']:
+        st.error(f"Error: {st.session_state['job_notice']}")
+        st.session_state['job_notice'] = None
     
     # แสดงส่วน Console logs ภายใน expander (สำหรับ debug)
     with st.expander("Thought logs.", expanded=False):
         if st.session_state['current_session']:
-            for message in st.session_state['current_session'].messages:
-                # หากเป็นข้อความจาก assistant ที่มีข้อมูล raw_response ให้จัดรูปแบบและแสดง
-                if message["role"] == "assistant" and "raw_response" in message["content"]:
-                    raw_response = message["content"]["raw_response"]
-                    if (raw_response):
-                        formatted_text = re.sub(r"(Thought:|Final Answer:|Action:|Action Input:|Observation:|Action Output:)", r"\n\1", raw_response)
-                        formatted_text = re.sub(r"<br>\s*<br>", "<br>", formatted_text)
-                        st.markdown(formatted_text, unsafe_allow_html=True)
-                    else:
-                        st.write("No console logs available.")
+            # แสดงขั้นตอนการทำงานของ agent เฉพาะข้อความที่อยู่ในหน้าต่างของแชท (จัดรูปแบบไว้แล้วใน cache)
+            for key, message in visible_messages(st.session_state['current_session']):
+                if message["role"] != "assistant" or not isinstance(message["content"], dict):
+                    continue
+                thought = prepared_message(key, message, translate_func)["thought"]
+                if thought:
+                    st.markdown(thought["markdown"], unsafe_allow_html=thought["html"])
         else:
             st.write("📜 All logs.")
     # เพิ่มส่วนแสดงตารางข้อมูล (Data Preview) ด้านล่าง Console logs
     if st.session_state.get('current_session') and st.session_state['current_session'].file_path:
-        dataset_key = os.path.splitext(os.path.basename(st.session_state['current_session'].file_path))[0]
+        dataset_key = st.session_state['current_session'].data_key()
         try:
-            # ดึง DataFrame จาก DataHandler โดยใช้ dataset key
-            df = st.session_state['data_handler'].get_data(dataset_key)
             st.subheader("Data Preview")
-            st.dataframe(df)
+            render_data_preview(st.session_state['data_handler'], dataset_key)
         except Exception as e:
             st.error(f"Error loading data table: {e}")
     
@@ -649,10 +855,26 @@ def main():
             value=0.3
         )
         
-        # แสดงรายการ session ทั้งหมดที่มีอยู่ในระบบ
-        sessions = st.session_state['session_manager'].list_sessions()
+        # แสดงรายการ session ที่มีอยู่ในระบบทีละหน้า (เรียงตามการใช้งานล่าสุด)
+        session_manager = st.session_state['session_manager']
+        total_sessions = session_manager.count_sessions()
+        page_count = max((total_sessions + SESSION_PAGE_SIZE - 1) // SESSION_PAGE_SIZE, 1)
+        page = min(st.session_state['session_page'], page_count - 1)
+        sessions = session_manager.list_sessions(limit=SESSION_PAGE_SIZE, offset=page * SESSION_PAGE_SIZE)
         if sessions:
             st.subheader("Your Sessions")
+            if page_count > 1:
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                with col_prev:
+                    if st.button("◀", key="session_page_prev", disabled=page == 0):
+                        st.session_state['session_page'] = page - 1
+                        st.rerun()
+                with col_page:
+                    st.caption(f"Page {page + 1}/{page_count} ({total_sessions} sessions)")
+                with col_next:
+                    if st.button("▶", key="session_page_next", disabled=page >= page_count - 1):
+                        st.session_state['session_page'] = page + 1
+                        st.rerun()
             for session in sessions:
                 with st.container():
                     col1, col2, col3 = st.columns([2, 1, 1])
@@ -669,6 +891,13 @@ def main():
                                 delete_current_session()
                             else:
                                 st.session_state['session_manager'].delete_session(session.session_id)
+
+        # แสดงผลการลบข้อมูลเก่าครั้งล่าสุดของ janitor
+        if JANITOR is not None and JANITOR.last_report is not None:
+            report = JANITOR.last_report
+            st.caption(f"🧹 Last cleanup {report.started_at}: reclaimed {report.bytes_freed() / (1024 * 1024):.1f} MB "
+                       f"({report.sessions_evicted} idle sessions, {report.plots_removed} plots, "
+                       f"{report.temp_files_removed} temp files, {report.artifact_files_removed} output/profile files)")
         
         # ส่วนจัดการไฟล์สำหรับ session ปัจจุบัน
         if st.session_state['current_session']:
@@ -696,27 +925,19 @@ def main():
                 )
 
                 if uploaded_file:
-                    file_path = save_uploaded_file(uploaded_file, current_session.session_id)
+                    file_path, file_hash = save_uploaded_file(uploaded_file, current_session.session_id)
                     st.session_state['initial_message_sent'] = False
                     if file_path:
                         try:
-                            data_handler = load_data(file_path, current_session.session_id)
+                            data_handler = load_data(file_path, file_hash)
                             st.session_state['data_handler'] = data_handler
                             current_session.file_path = file_path
+                            current_session.file_hash = file_hash
+                            current_session.file_name = uploaded_file.name
                             
-                            # Initialize SupervisorAgent ด้วยข้อมูลไฟล์ที่อัปโหลด
-                            dataset_key = os.path.splitext(uploaded_file.name)[0]
-                            st.session_state['supervisor_agent'] = SupervisorAgent(
-                                temperature=temperature,
-                                base_url=get_model_base_url(selected_model),
-                                model_name=selected_model,
-                                dataset_paths={dataset_key: file_path},
-                                dataset_key=dataset_key,
-                                session_id=current_session.session_id, 
-                                supervisor_api_key=get_supervisor_api_key(selected_model),
-                                agent_api_key=get_agent_api_key(selected_model),
-                                explanner_api_key=get_explanne_tool_api_key(selected_model),
-                            )
+                            # ยืม SupervisorAgent สำหรับไฟล์ที่อัปโหลด (ไฟล์ที่มีเนื้อหาเหมือนกันใช้ agent ใน pool ร่วมกันได้)
+                            st.session_state['supervisor_agent'] = acquire_supervisor_agent(
+                                current_session, selected_model, temperature)
 
                             st.session_state['session_manager'].save_session(current_session)
                             st.success(f"Successfully loaded {uploaded_file.name}")
@@ -727,115 +948,34 @@ def main():
                         except Exception as e:
                             st.error(f"Error loading file: {str(e)}")
             else:
-                st.info(f"Current file: {os.path.basename(current_session.file_path)}")
+                st.info(f"Current file: {current_session.file_name or os.path.basename(current_session.file_path)}")
 
     # =======================================================================
     # ส่วนของหน้าจอ Chat Interface (การแสดงผลข้อความและ input สำหรับแชท)
     
-    # แสดงข้อความแชททั้งหมดใน session
+    # แสดงข้อความแชทล่าสุดของ session (ข้อความเก่ากว่าหน้าต่างจะแสดงเมื่อผู้ใช้กด "Load earlier messages")
     if st.session_state['current_session']:
-        for message in st.session_state['current_session'].messages:
+        current_session = st.session_state['current_session']
+        hidden = max(current_session.message_count - st.session_state['chat_window'], 0)
+        if hidden:
+            if st.button(f"⬆️ Load earlier messages ({hidden} more)", key="load_earlier"):
+                st.session_state['chat_window'] += CHAT_WINDOW_SIZE
+                st.rerun()
+        for key, message in visible_messages(current_session):
             with st.container():
-                if message["role"] == "user":
-                    st.markdown(f"""
-                    <div class="user-message">
-                        <div style="display: flex; justify-content: space-between;">
-                            <div>{message["content"]}</div>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    if "sub_response" in message["content"]:
-                        sub_resp = message["content"]["sub_response"]
-                        # แสดงผลจาก pandas_agent (เดิม)
-                        if "pandas_agent" in sub_resp:
-                            pandas_response = sub_resp["pandas_agent"]
-                            if pandas_response.get("execution_result"):
-                                if "plots" in pandas_response["execution_result"] and pandas_response["execution_result"]["plots"]:
-                                    for plot in pandas_response["execution_result"]["plots"]:
-                                        with st.container():
-                                            st.markdown("🐼 Assistant (Pandas Agent):")
-                                            st.image(os.path.join("static", "plots", plot["filename"]), width=800)
-                                            with st.expander("Show plot details"):
-                                                st.markdown('</div>', unsafe_allow_html=True)
-                                                st.code(pandas_response["execution_result"]["output"])    
-                                elif "output" in pandas_response["execution_result"]:
-                                    st.markdown("🐼 Assistant (Pandas Agent):")
-                                    st.code(pandas_response["execution_result"]["output"])
-                            if pandas_response.get("code"):
-                                with st.expander("Show Code from Pandas Agent"):
-                                    st.code(pandas_response["code"], language="python")
-                            if pandas_response.get("explanation"):
-                                st.write("🐼 Assistant (Pandas Agent):")
-                                explan = pandas_response["explanation"].get("explanation", "")
-                                try:
-                                    st.write(translate_func(target_lang='th', text=explan))
-                                except Exception:
-                                    st.write(explan)
-                    
-                        # ส่วนแสดงผลสำหรับ analysis_agent
-                        elif "analysis_agent" in sub_resp:
-                            analysis_response = sub_resp["analysis_agent"]
-                            
-                            # แสดงส่วนหัวของ Assistant
-                            st.markdown("""
-                            <div class="assistant-message">
-                                <div style="display: flex; justify-content: space-between;">
-                                    <div>🧑🏻‍🏫 Assistant (Analysis Agent):</div>
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # แสดงผลการวิเคราะห์
-                            with st.expander("🔍 Analysis Details", expanded=True):
-                                # 1. แสดงคำอธิบาย
-                                if "explanation" in analysis_response:
-                                    explanation = analysis_response["explanation"]
-                                    if isinstance(explanation, dict):
-                                        # st.markdown(f"**คำอธิบาย:** {explanation.get('text', '')}")
-                                        st.markdown(f"**คำอธิบาย:** {translate_func(target_lang='th', text=explanation.get('text', ''))}")
-                                    else:
-                                        st.markdown(f"**คำอธิบาย:** {explanation}")
-                                
-                                # 2. แสดงโค้ด (ถ้ามี)
-                                if analysis_response.get("code"):
-                                    with st.expander("🔍 แสดงโค้ดที่ใช้ในการวิเคราะห์"):
-                                        st.code(analysis_response["code"], language="python")
-                                
-                                # 3. แสดงผลลัพธ์การรัน (ถ้ามี)
-                                if analysis_response.get("execution_result"):
-                                    with st.expander("📊 ผลลัพธ์การวิเคราะห์"):
-                                        st.write(analysis_response["execution_result"])
-                                
-                                # 4. แสดง response (ถ้ามี)
-                                if analysis_response.get("response"):
-                                    st.markdown("**ผลการวิเคราะห์:**")
-                                    st.write(analysis_response["response"])
-
-
-                        # แสดงข้อความตอบกลับหลัก (ถ้ามี)
-                        if message["content"].get("response", ""):
-                            st.markdown(f"""
-                            <div class="assistant-message">
-                                <div style="display: flex; justify-content: space-between;">
-                                    <div>🤖 Assistant: {message["content"].get("response", "")}</div>
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"""
-                        <div class="assistant-message">
-                            <div style="display: flex; justify-content: space-between;">
-                                <div>🤖 Assistant: {message["content"].get("response", "")}</div>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-
-        # ช่องสำหรับรับข้อความจากผู้ใช้ (chat input)
+                render_message(key, message)
+
+        # แสดงความคืบหน้าของ job ที่ยังไม่เสร็จของ session นี้ (รวมถึง job ที่ส่งไว้ก่อนการรีเฟรช browser)
+        active_job = JOB_MANAGER.active_job(st.session_state['current_session'].session_id)
+        if active_job:
+            st.session_state['active_job'] = active_job.job_id
+            render_job_progress(active_job.job_id, active_job.session_id)
+
+        # ช่องสำหรับรับข้อความจากผู้ใช้ (chat input) ปิดไว้ระหว่างที่ job ของ session ยังไม่เสร็จ
         user_input = st.chat_input(
             key='user_input',
-            placeholder="Type your message and press Enter"
+            placeholder="Type your message and press Enter",
+            disabled=active_job is not None
         )
         if user_input:
             handle_submit(user_input)
@@ -0,0 +1,244 @@
+# -----------------------------------------------------------------------
+# ที่เก็บไฟล์ชุดข้อมูลที่อัปโหลดแบบ content-addressed (ใช้ร่วมกันทุก session)
+# ไฟล์ถูกเขียนลงดิสก์ทีละ chunk พร้อมคำนวณ sha256 ไปด้วย จึงไม่ต้องอ่านไฟล์ซ้ำเพื่อหา hash
+# ไฟล์ที่มีเนื้อหาเหมือนกันจะถูกเก็บเพียงครั้งเดียว และ session อ้างอิงไฟล์ด้วย hash (file_hash)
+# hash นี้คือ fingerprint ของชุดข้อมูลที่ DataHandler ใช้เป็น key ของ cache DataFrame ที่ parse แล้ว
+# -----------------------------------------------------------------------
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# ค่าเริ่มต้นของที่เก็บไฟล์ (ปรับได้ผ่าน environment variables)
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blobs")                             # โฟลเดอร์หลักของที่เก็บไฟล์
+BLOB_CHUNK_BYTES = int(os.getenv("BLOB_CHUNK_BYTES", 1024 * 1024))                # ขนาดของ chunk ที่เขียนลงดิสก์แต่ละครั้ง
+BLOB_ORPHAN_GRACE_SECONDS = float(os.getenv("BLOB_ORPHAN_GRACE_SECONDS", 3600))   # เวลาผ่อนผันก่อนลบไฟล์ที่ไม่มี session อ้างอิง
+
+INDEX_FILENAME = "index.json"
+
+_BLOB_NAME = re.compile(r"^([0-9a-f]{64})\.\w+$")
+
+
+def dataset_fingerprint(path: str) -> Optional[str]:
+    """
+    คืนค่า fingerprint ของไฟล์ชุดข้อมูลสำหรับใช้เป็น key ของ cache
+    - ไฟล์ใน BlobStore: sha256 ของเนื้อหา (ได้จากชื่อไฟล์โดยไม่ต้องอ่านไฟล์)
+    - ไฟล์อื่น (เช่น ไฟล์ที่อัปโหลดก่อนมี BlobStore): เส้นทาง, ขนาด และเวลาแก้ไขล่าสุดของไฟล์
+    Returns:
+        fingerprint (str) หรือ None หากไม่พบไฟล์
+    """
+    match = _BLOB_NAME.match(os.path.basename(path))
+    if match:
+        return match.group(1)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class BlobStore:
+    """
+    คลาสสำหรับจัดเก็บไฟล์ชุดข้อมูลแบบ content-addressed
+    - put_stream() เขียนไฟล์ทีละ chunk และคำนวณ sha256 ระหว่างเขียน
+    - เก็บการอ้างอิงแยกตาม session ไว้ในไฟล์ index.json
+    - ลบไฟล์เมื่อไม่มี session อ้างอิงและเลยช่วงเวลาผ่อนผันแล้ว
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR, orphan_grace: Optional[float] = None):
+        """
+        ตัวสร้างสำหรับ BlobStore
+        Parameters:
+            root (str): โฟลเดอร์หลักสำหรับเก็บไฟล์
+            orphan_grace (float): เวลา (วินาที) ที่ไฟล์ซึ่งไม่มีการอ้างอิงจะถูกเก็บไว้ก่อนลบ
+        """
+        self.root = root
+        self.orphan_grace = BLOB_ORPHAN_GRACE_SECONDS if orphan_grace is None else orphan_grace
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        # lock สำหรับป้องกันการแก้ไข index พร้อมกันจากหลาย thread
+        self._lock = threading.RLock()
+        self._index: Optional[Dict[str, dict]] = None
+
+    # -------------------------------------------------------------------
+    # การจัดการไฟล์ index
+    # -------------------------------------------------------------------
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path, "r") as f:
+                        self._index = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.error(f"Error loading blob index, rebuilding from disk: {e}")
+                    self._index = self._rebuild_index()
+        return self._index
+
+    def _rebuild_index(self) -> Dict[str, dict]:
+        # สร้าง index ใหม่จากไฟล์ที่มีอยู่จริง (ข้อมูลการอ้างอิงจะหายไป จึงถือว่าเป็นไฟล์ที่ไม่มีการอ้างอิง)
+        index = {}
+        now = time.time()
+        for shard in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                match = _BLOB_NAME.match(name)
+                if not match:
+                    continue
+                index[match.group(1)] = {
+                    "ext": os.path.splitext(name)[1],
+                    "size": os.path.getsize(os.path.join(shard_dir, name)),
+                    "created_at": now,
+                    "last_access": now,
+                    "refs": {},
+                }
+        return index
+
+    def _save_index(self) -> None:
+        # เขียน index ลงไฟล์ชั่วคราวแล้วแทนที่ เพื่อป้องกันไฟล์เสียหายหากโปรแกรมหยุดกลางคัน
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    # -------------------------------------------------------------------
+    # การเขียนและอ่านไฟล์
+    # -------------------------------------------------------------------
+    def file_path(self, digest: str, ext: Optional[str] = None) -> str:
+        """
+        คืนค่าเส้นทางของไฟล์ (เช่น "blobs/ab/abcdef....csv") โดยนามสกุลไฟล์จะถูกเก็บไว้เพื่อให้ DataHandler เลือกวิธีอ่านได้
+        """
+        if ext is None:
+            with self._lock:
+                ext = self._load_index()[digest]["ext"]
+        return os.path.join(self.root, digest[:2], f"{digest}{ext}")
+
+    def put_stream(self, stream: BinaryIO, ext: str, session_id: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        เขียนข้อมูลจาก stream ลงดิสก์ทีละ BLOB_CHUNK_BYTES พร้อมคำนวณ sha256
+        หากมีไฟล์ที่เนื้อหาเหมือนกันอยู่แล้ว ไฟล์ที่เพิ่งเขียนจะถูกลบทิ้งและใช้ไฟล์เดิม
+        (รวมถึงนามสกุลเดิม หากไฟล์เดิมถูกอัปโหลดด้วยนามสกุลอื่น ให้ใช้ file_path(digest) เพื่อหาเส้นทางของไฟล์)
+        Parameters:
+            stream: file-like object ที่อ่านแบบ binary ได้ (เช่น Streamlit UploadedFile)
+            ext (str): นามสกุลไฟล์ (เช่น ".csv")
+            session_id (str): รหัสของ session ที่อ้างอิงไฟล์นี้ (ถ้ามี)
+        Returns:
+            tuple ของ digest (sha256 ของเนื้อหา) และ True หากเป็นไฟล์ใหม่ (False หากมีไฟล์เดิมอยู่แล้ว)
+        """
+        ext = ext.lower()
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f"upload.{os.getpid()}.{threading.get_ident()}.tmp")
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = stream.read(BLOB_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            now = time.time()
+            with self._lock:
+                index = self._load_index()
+                # เนื้อหาที่มีอยู่แล้วใช้เส้นทางและนามสกุลของ entry เดิม เพื่อไม่ให้เกิดไฟล์ที่สองที่ index ไม่ได้ติดตาม
+                path = self.file_path(digest, index[digest]["ext"] if digest in index else ext)
+                created = not os.path.exists(path)
+                if created:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                entry = index.setdefault(digest, {"ext": ext, "size": size, "created_at": now, "refs": {}})
+                entry["last_access"] = now
+                if session_id:
+                    entry["refs"][session_id] = 1
+                self._save_index()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.info(f"Blob {digest[:12]} {'stored' if created else 'deduplicated'} ({size} bytes)")
+        return digest, created
+
+    # -------------------------------------------------------------------
+    # การอ้างอิงจาก session
+    # -------------------------------------------------------------------
+    def add_ref(self, session_id: str, digest: str) -> None:
+        with self._lock:
+            entry = self._load_index().get(digest)
+            if entry is not None:
+                entry["refs"][session_id] = 1
+                entry["last_access"] = time.time()
+                self._save_index()
+
+    def release_session(self, session_id: str) -> Dict[str, int]:
+        """
+        ลบการอ้างอิงทั้งหมดของ session (เช่น เมื่อ session ถูกลบหรือไฟล์ถูก evict โดย janitor) แล้วรัน garbage collection
+        Returns:
+            รายงานผลการลบ (จำนวนไฟล์และจำนวน bytes ที่ถูกลบ)
+        """
+        with self._lock:
+            changed = False
+            for entry in self._load_index().values():
+                if entry["refs"].pop(session_id, None) is not None:
+                    changed = True
+            if changed:
+                self._save_index()
+        return self.collect()
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            entry = self._load_index().get(digest)
+            return len(entry["refs"]) if entry else 0
+
+    def release_ref(self, session_id: str, digest: str) -> None:
+        # ลบการอ้างอิงไฟล์เดียวของ session (ไฟล์ที่ไม่มี session อ้างอิงแล้วจะถูกลบโดย collect())
+        with self._lock:
+            entry = self._load_index().get(digest)
+            if entry is not None and entry["refs"].pop(session_id, None) is not None:
+                self._save_index()
+
+    def session_blobs(self, session_id: str) -> List[Tuple[str, int, float]]:
+        # รายการไฟล์ (digest, ขนาด, เวลาที่ใช้งานล่าสุด) ที่ session อ้างอิงอยู่
+        with self._lock:
+            return [(digest, entry["size"], entry.get("last_access", entry["created_at"]))
+                    for digest, entry in self._load_index().items() if session_id in entry["refs"]]
+
+    def disk_usage(self) -> int:
+        with self._lock:
+            return sum(entry["size"] for entry in self._load_index().values())
+
+    # -------------------------------------------------------------------
+    # Garbage collection
+    # -------------------------------------------------------------------
+    def collect(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        ลบไฟล์ที่ไม่มี session อ้างอิงและไม่ถูกใช้งานนานกว่าช่วงเวลาผ่อนผัน
+        Returns:
+            dict ที่มีจำนวนไฟล์ (removed) และจำนวน bytes (bytes_freed) ที่ถูกลบ
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        bytes_freed = 0
+        with self._lock:
+            index = self._load_index()
+            for digest in [digest for digest, entry in index.items()
+                           if not entry["refs"] and now - entry.get("last_access", entry["created_at"]) >= self.orphan_grace]:
+                entry = index.pop(digest)
+                try:
+                    os.remove(self.file_path(digest, entry["ext"]))
+                    bytes_freed += entry["size"]
+                except FileNotFoundError:
+                    pass
+                removed += 1
+            if removed:
+                self._save_index()
+        if removed:
+            logging.info(f"Blob store GC removed {removed} files ({bytes_freed} bytes)")
+        return {"removed": removed, "bytes_freed": bytes_freed}
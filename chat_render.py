@@ -0,0 +1,134 @@
+# -----------------------------------------------------------------------
+# การเตรียมข้อมูลสำหรับแสดงข้อความในแชท
+# ข้อความที่บันทึกแล้วไม่มีการเปลี่ยนแปลง จึงเตรียมข้อมูลที่ใช้แสดงผล (การแปลภาษา, การจัดรูปแบบ trace/raw_response
+# และรายการกราฟ) เพียงครั้งเดียวต่อข้อความ แล้วเก็บไว้ใน cache (LRU) ตามรหัสของข้อความ
+# การ rerun ของ Streamlit จึงเหลือเพียงการเรียก st.* ของข้อความที่อยู่ในหน้าต่างที่แสดงอยู่ (CHAT_WINDOW_SIZE ข้อความล่าสุด)
+# -----------------------------------------------------------------------
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from agent_trace import format_trace
+
+# ค่าเริ่มต้นของการแสดงข้อความในแชท (ปรับได้ผ่าน environment variables)
+CHAT_WINDOW_SIZE = int(os.getenv("CHAT_WINDOW_SIZE", 20))                # จำนวนข้อความล่าสุดที่แสดง (กด "load earlier" เพื่อดูเพิ่ม)
+CHAT_RENDER_CACHE_SIZE = int(os.getenv("CHAT_RENDER_CACHE_SIZE", 512))   # จำนวนข้อความที่เก็บข้อมูลที่เตรียมไว้ใน cache
+
+# cache ของข้อมูลที่เตรียมไว้: รหัสของข้อความ -> dict ที่พร้อมแสดงผล
+_render_cache: "OrderedDict[str, dict]" = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+
+def new_message_id() -> str:
+    """
+    สร้างรหัสของข้อความใหม่ (เก็บไว้ในข้อความเป็น "id")
+    """
+    return uuid.uuid4().hex
+
+
+def message_id(message: dict, session_id: str, index: int) -> str:
+    """
+    คืนค่ารหัสของข้อความ (ข้อความที่บันทึกก่อนมี "id" จะใช้ session, ตำแหน่ง, เวลาและผู้ส่งแทน)
+    """
+    return message.get("id") or f"{session_id}:{index}:{message.get('timestamp')}:{message.get('role')}"
+
+
+def format_thought_log(content: Any) -> Optional[Dict[str, Any]]:
+    """
+    จัดรูปแบบขั้นตอนการทำงานของ agent ของคำตอบหนึ่งข้อความสำหรับส่วน Thought logs
+    Returns:
+        dict ที่มี markdown และ html (True หากต้องแสดงด้วย unsafe_allow_html) หรือ None หากไม่มีข้อมูล
+    """
+    if not isinstance(content, dict):
+        return None
+    # ขั้นตอนการทำงานของ agent จาก trace ที่บันทึกไว้ระหว่างการประมวลผล
+    if content.get("trace"):
+        return {"markdown": format_trace(content["trace"]), "html": False}
+    # ข้อความรุ่นเก่าที่บันทึกก่อนมี trace จะมีเฉพาะ raw_response ให้จัดรูปแบบ
+    if "raw_response" in content:
+        raw_response = content["raw_response"]
+        if not raw_response:
+            return {"markdown": "No console logs available.", "html": False}
+        formatted_text = re.sub(r"(Thought:|Final Answer:|Action:|Action Input:|Observation:|Action Output:)", r"\n\1", raw_response)
+        formatted_text = re.sub(r"<br>\s*<br>", "<br>", formatted_text)
+        return {"markdown": formatted_text, "html": True}
+    return None
+
+
+def _translated(text: Any, translate: Callable[[str, Any], str]) -> str:
+    try:
+        return translate('th', text)
+    except Exception:
+        return text
+
+
+def prepare_message(message: dict, translate: Callable[[str, Any], str]) -> dict:
+    """
+    เตรียมข้อมูลสำหรับแสดงข้อความของผู้ช่วย (ไม่เรียก st.* จึงเก็บผลไว้ใน cache ได้)
+    Parameters:
+        message (dict): ข้อความที่บันทึกใน session
+        translate: ฟังก์ชันแปลภาษา (target_lang, text) -> ข้อความที่แปลแล้ว
+    Returns:
+        dict ที่มี thought (ส่วน Thought logs), pandas / analysis (ผลของ agent ย่อย) และ response (คำตอบหลัก)
+    """
+    content = message["content"] if isinstance(message.get("content"), dict) else {}
+    prepared: Dict[str, Any] = {
+        "thought": format_thought_log(content),
+        "pandas": None,
+        "analysis": None,
+        "response": content.get("response", ""),
+    }
+    sub_response = content.get("sub_response") or {}
+
+    if "pandas_agent" in sub_response:
+        pandas_response = sub_response["pandas_agent"]
+        execution_result = pandas_response.get("execution_result") or {}
+        explanation = pandas_response.get("explanation")
+        if explanation:
+            # คำอธิบายจาก template มีภาษาไทยอยู่แล้ว ไม่ต้องแปล
+            explanation = explanation.get("explanation_th") or _translated(explanation.get("explanation", ""), translate)
+        prepared["pandas"] = {
+            # กราฟ (digest สำหรับภาพย่อใน PLOT_STORE และ filename ของไฟล์ความละเอียดเต็ม)
+            "plots": [{"digest": plot.get("digest"), "filename": plot["filename"]}
+                      for plot in execution_result.get("plots") or []],
+            "has_output": "output" in execution_result,
+            "output": execution_result.get("output"),
+            "code": pandas_response.get("code"),
+            "explanation": explanation,
+        }
+    elif "analysis_agent" in sub_response:
+        analysis_response = sub_response["analysis_agent"]
+        explanation = analysis_response.get("explanation")
+        if isinstance(explanation, dict):
+            explanation = translate('th', explanation.get('text', ''))
+        prepared["analysis"] = {
+            "explanation": explanation if "explanation" in analysis_response else None,
+            "code": analysis_response.get("code"),
+            "execution_result": analysis_response.get("execution_result"),
+            "response": analysis_response.get("response"),
+        }
+    return prepared
+
+
+def prepared_message(key: str, message: dict, translate: Callable[[str, Any], str]) -> dict:
+    """
+    คืนค่าข้อมูลที่เตรียมไว้ของข้อความจาก cache (เตรียมใหม่เมื่อยังไม่มีใน cache)
+    Parameters:
+        key (str): รหัสของข้อความ (ดู message_id())
+        message (dict): ข้อความที่บันทึกใน session
+        translate: ฟังก์ชันแปลภาษา
+    """
+    with _render_cache_lock:
+        prepared = _render_cache.get(key)
+        if prepared is not None:
+            _render_cache.move_to_end(key)
+            return prepared
+    prepared = prepare_message(message, translate)
+    with _render_cache_lock:
+        _render_cache[key] = prepared
+        while len(_render_cache) > CHAT_RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return prepared
@@ -0,0 +1,137 @@
+# -----------------------------------------------------------------------
+# การแสดงตัวอย่างข้อมูล (Data Preview) แบบแบ่งหน้าฝั่ง server
+# แทนการส่ง DataFrame ทั้งหมดไปยัง browser ทุกครั้งที่ Streamlit rerun จะส่งเฉพาะแถวของหน้าที่แสดงอยู่
+# การเรียงลำดับและการกรองคอลัมน์ทำบน server และตำแหน่งแถวที่ได้จะถูก cache ไว้ (LRU)
+# การเปลี่ยนหน้าจึงเป็นเพียงการ slice ตาม cache โดยไม่ต้องเรียงหรือกรองข้อมูลใหม่
+# -----------------------------------------------------------------------
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ค่าเริ่มต้นของ data preview (ปรับได้ผ่าน environment variables)
+PREVIEW_PAGE_SIZE = int(os.getenv("PREVIEW_PAGE_SIZE", 50))            # จำนวนแถวต่อหน้า
+PREVIEW_ORDER_CACHE_SIZE = int(os.getenv("PREVIEW_ORDER_CACHE_SIZE", 16))  # จำนวนผลการเรียง/กรองที่ cache ไว้
+
+# cache ของตำแหน่งแถวหลังการเรียงและกรอง: (dataset, จำนวนแถว, sort, filters) -> numpy array ของตำแหน่งแถว
+_order_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_order_cache_lock = threading.Lock()
+
+_RANGE = re.compile(r"^\s*(-?[\d.,]*)\s*\.\.\s*(-?[\d.,]*)\s*$")
+_COMPARISON = re.compile(r"^\s*(>=|<=|>|<|=)\s*(-?[\d.,]+)\s*$")
+
+
+def _to_number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+def _filter_mask(series: pd.Series, expression: str) -> np.ndarray:
+    """
+    สร้าง mask ของแถวที่ตรงกับเงื่อนไขการกรองของคอลัมน์
+    - คอลัมน์ตัวเลข: "10..20" (ช่วง), ">100", "<=5", "=3" หรือค่าเดียว
+    - คอลัมน์อื่น: ข้อความที่ปรากฏในค่า (ไม่สนใจตัวพิมพ์เล็ก/ใหญ่)
+    """
+    expression = expression.strip()
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        try:
+            match = _RANGE.match(expression)
+            if match:
+                low, high = match.groups()
+                mask = np.ones(len(series), dtype=bool)
+                if low:
+                    mask &= (series >= _to_number(low)).to_numpy()
+                if high:
+                    mask &= (series <= _to_number(high)).to_numpy()
+                return mask
+            match = _COMPARISON.match(expression)
+            operator, value = match.groups() if match else ("=", expression)
+            value = _to_number(value)
+            compare = {">=": series.ge, "<=": series.le, ">": series.gt, "<": series.lt, "=": series.eq}[operator]
+            return compare(value).fillna(False).to_numpy(dtype=bool)
+        except ValueError:
+            pass
+    return series.astype(str).str.contains(expression, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+
+def _row_order(df: pd.DataFrame, dataset_id: str, sort_by: Optional[str], ascending: bool,
+               filters: Dict[str, str]) -> np.ndarray:
+    # ตำแหน่งแถวหลังการกรองและเรียงลำดับ (ใช้ผลจาก cache หากเคยคำนวณแล้ว)
+    filters = {column: text for column, text in filters.items() if text and text.strip() and column in df.columns}
+    sort_by = sort_by if sort_by in df.columns else None
+    key = (dataset_id, len(df), tuple(df.columns), sort_by, ascending, tuple(sorted(filters.items())))
+    with _order_cache_lock:
+        cached = _order_cache.get(key)
+        if cached is not None:
+            _order_cache.move_to_end(key)
+            return cached
+
+    positions = np.arange(len(df))
+    if filters:
+        mask = np.ones(len(df), dtype=bool)
+        for column, text in filters.items():
+            mask &= _filter_mask(df[column], text)
+        positions = positions[mask]
+    if sort_by is not None:
+        values = df[sort_by].iloc[positions]
+        try:
+            order = np.argsort(values.to_numpy(), kind="stable")
+        except TypeError:
+            # คอลัมน์ที่มีค่าหลายชนิดปนกัน ให้เรียงตามข้อความ
+            order = np.argsort(values.astype(str).to_numpy(), kind="stable")
+        # ค่าว่าง (NaN/NaT) อยู่ท้ายสุดเสมอ
+        missing = values.isna().to_numpy()[order]
+        order = np.concatenate([order[~missing] if ascending else order[~missing][::-1], order[missing]])
+        positions = positions[order]
+
+    with _order_cache_lock:
+        _order_cache[key] = positions
+        _order_cache.move_to_end(key)
+        while len(_order_cache) > PREVIEW_ORDER_CACHE_SIZE:
+            _order_cache.popitem(last=False)
+    return positions
+
+
+def preview_page(df: pd.DataFrame, dataset_id: str, page: int = 0, page_size: int = PREVIEW_PAGE_SIZE,
+                 sort_by: Optional[str] = None, ascending: bool = True,
+                 filters: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    คืนค่าแถวของหน้าที่ต้องการหลังการกรองและเรียงลำดับ
+    Parameters:
+        df (pd.DataFrame): ข้อมูลทั้งหมด
+        dataset_id (str): ตัวระบุของข้อมูล (เช่น fingerprint ของไฟล์) ใช้เป็น key ของ cache
+        page (int): หมายเลขหน้า (เริ่มจาก 0)
+        page_size (int): จำนวนแถวต่อหน้า
+        sort_by (str): คอลัมน์ที่ใช้เรียงลำดับ (None คือลำดับเดิม)
+        ascending (bool): เรียงจากน้อยไปมากหรือไม่
+        filters (dict): เงื่อนไขการกรอง {ชื่อคอลัมน์: เงื่อนไข}
+    Returns:
+        tuple ของ DataFrame ของหน้านั้นและจำนวนแถวทั้งหมดหลังการกรอง
+    """
+    positions = _row_order(df, dataset_id, sort_by, ascending, filters or {})
+    total = len(positions)
+    page_count = max((total + page_size - 1) // page_size, 1)
+    page = min(max(page, 0), page_count - 1)
+    window = positions[page * page_size:(page + 1) * page_size]
+    return df.iloc[window], total
+
+
+def summary_header(profile: dict) -> str:
+    """
+    สร้างข้อความสรุปของ dataset จาก profile ที่คำนวณไว้แล้ว (DataHandler.get_profile)
+    """
+    columns = profile.get("columns", {})
+    dtypes: Dict[str, int] = {}
+    for info in columns.values():
+        kind = info.get("dtype", "")
+        kind = ("numeric" if re.match(r"^(u?int|float)", kind) else
+                "datetime" if kind.startswith("datetime") else
+                "bool" if kind == "bool" else "text")
+        dtypes[kind] = dtypes.get(kind, 0) + 1
+    missing = sum(1 for info in columns.values() if info.get("non_null", 0) < profile.get("rows", 0))
+    kinds = ", ".join(f"{count} {kind}" for kind, count in sorted(dtypes.items()))
+    return (f"{profile.get('rows', 0):,} rows × {len(columns)} columns ({kinds})"
+            f"{f' · {missing} columns with missing values' if missing else ''}")
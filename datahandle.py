@@ -1,12 +1,51 @@
 import os
 import re  
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
 import pandas as pd  
 import logging  
 from dateutil.parser import parse  # สำหรับ fallback ในการแปลงวันที่
+from blob_store import dataset_fingerprint
 
 # ตั้งค่า logging ให้แสดง log ระดับ INFO และกำหนดรูปแบบข้อความ log ให้แสดงวันที่ เวลา ระดับ log และข้อความ
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# ขนาดสูงสุด (MB) ของ cache DataFrame ที่ parse และ preprocess แล้ว (ปรับได้ผ่าน environment variable)
+FRAME_CACHE_MB = float(os.getenv("FRAME_CACHE_MB", 1024))
+
+# cache ระดับ process: fingerprint ของไฟล์ -> (พารามิเตอร์ของ preprocess, DataFrame) เรียงตามการใช้งานล่าสุด (LRU)
+# ไฟล์ที่มีเนื้อหาเหมือนกัน (hash เดียวกันใน BlobStore) จึงถูก parse เพียงครั้งเดียวไม่ว่าจะถูกอัปโหลดกี่ครั้ง
+_frame_cache: "OrderedDict[str, Tuple[tuple, pd.DataFrame, int]]" = OrderedDict()
+_frame_cache_lock = threading.Lock()
+
+
+def _cached_frame(fingerprint: Optional[str]) -> Optional[Tuple[tuple, pd.DataFrame]]:
+    if fingerprint is None:
+        return None
+    with _frame_cache_lock:
+        cached = _frame_cache.get(fingerprint)
+        if cached is None:
+            return None
+        _frame_cache.move_to_end(fingerprint)
+        return cached[0], cached[1]
+
+
+def _cache_frame(fingerprint: Optional[str], params: tuple, df: pd.DataFrame) -> None:
+    if fingerprint is None or FRAME_CACHE_MB <= 0:
+        return
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    limit = FRAME_CACHE_MB * 1024 * 1024
+    if size > limit:
+        return
+    with _frame_cache_lock:
+        _frame_cache[fingerprint] = (params, df, size)
+        _frame_cache.move_to_end(fingerprint)
+        total = sum(entry[2] for entry in _frame_cache.values())
+        while total > limit:
+            _, evicted = _frame_cache.popitem(last=False)
+            total -= evicted[2]
+
 
 class DataHandler:
     """
@@ -39,6 +78,9 @@ class DataHandler:
                 dataset_paths = {}  # หากไม่มีการส่ง dataset_paths เข้ามา ให้ใช้ dict ว่าง
             self.dataset_paths = dataset_paths  # เก็บพจนานุกรมของ dataset paths ไว้ใน attribute ของ instance
             self._data = {}  # สร้าง attribute สำหรับเก็บข้อมูล DataFrame ที่โหลดมา
+            self._profiles = {}  # cache ของ profile ของแต่ละ dataset (ถูกล้างเมื่อโหลดหรือ preprocess ข้อมูลใหม่)
+            self._fingerprints = {}  # fingerprint ของไฟล์ของแต่ละ dataset (key ของ cache DataFrame)
+            self._preprocessed = {}  # พารามิเตอร์ของ preprocess ที่ใช้กับ dataset แล้ว (dataset ที่ได้จาก cache ไม่ต้อง preprocess ซ้ำ)
 
     def load_data(self) -> None:
         """
@@ -48,6 +90,7 @@ class DataHandler:
         # หากไม่มี dataset paths ให้โยนข้อผิดพลาด
         if not self.dataset_paths:
             raise ValueError("No dataset paths provided.")
+        self._profiles.clear()
 
         # วนลูปผ่านพจนานุกรม dataset_paths โดย key เป็น identifier และ dataset_path เป็นเส้นทางไฟล์
         for key, dataset_path in self.dataset_paths.items():
@@ -55,6 +98,17 @@ class DataHandler:
             if not os.path.exists(dataset_path):
                 raise FileNotFoundError(f"Dataset file not found at {dataset_path}.")
 
+            # หากไฟล์เดียวกัน (fingerprint เดียวกัน) เคยถูก parse แล้ว ให้ใช้สำเนาของ DataFrame จาก cache โดยไม่ต้องอ่านไฟล์
+            fingerprint = dataset_fingerprint(dataset_path)
+            self._fingerprints[key] = fingerprint
+            cached = _cached_frame(fingerprint)
+            if cached is not None:
+                self._preprocessed[key] = cached[0]
+                self._data[key] = cached[1].copy()
+                logging.info(f"Data for {key} loaded from frame cache ({fingerprint[:12]}).")
+                continue
+            self._preprocessed.pop(key, None)
+
             # แยกส่วนชื่อไฟล์และนามสกุลออกจาก dataset_path
             _, ext = os.path.splitext(dataset_path)
             if ext == ".csv":
@@ -88,7 +142,11 @@ class DataHandler:
 
         id_pattern = r"id"  # regex สำหรับคอลัมน์ที่มี "id"
 
+        params = (threshold, date_format)
         for key, df in self._data.items():
+            if self._preprocessed.get(key) == params:
+                logging.info(f"Dataset '{key}' already preprocessed, skipped.")
+                continue
             logging.info(f"Starting preprocessing for dataset '{key}'.")
             for col in df.columns:
                 logging.info(f"Processing column '{col}'.")
@@ -168,7 +226,11 @@ class DataHandler:
                     logging.error(f"Error converting column '{col}' to numeric in dataset '{key}': {e}")
                     continue
 
+            self._preprocessed[key] = params
+            # เก็บสำเนาไว้ใน cache (DataFrame ที่ใช้งานอาจถูกแก้ไขโดยโค้ดของ agent)
+            _cache_frame(self._fingerprints.get(key), params, df.copy())
             logging.info(f"Finished preprocessing for dataset '{key}'.")
+        self._profiles.clear()
         logging.info("Preprocessing complete.")
 
 
@@ -184,3 +246,73 @@ class DataHandler:
         if key not in self._data:
             raise ValueError(f"Data for key '{key}' not loaded.")
         return self._data[key]  # คืนค่า DataFrame ที่เก็บไว้ใน self._data สำหรับ key นั้น
+
+    def is_loaded(self, key: str, dataset_path: str) -> bool:
+        """
+        ตรวจสอบว่า dataset ถูกโหลดและ preprocess จากไฟล์เดียวกันไว้แล้วหรือไม่ (ไม่ต้องโหลดใหม่)
+        """
+        return (key in self._data and key in self._preprocessed
+                and self._fingerprints.get(key) is not None
+                and self._fingerprints.get(key) == dataset_fingerprint(dataset_path))
+
+    def unload(self, key: str) -> None:
+        """
+        ลบ dataset ออกจาก memory (เช่น เมื่อ agent ที่ใช้ dataset นี้ถูก evict ออกจาก AgentPool)
+        สำเนาที่ preprocess แล้วยังอยู่ใน cache DataFrame หาก cache ยังมีพื้นที่
+        """
+        for store in (self.dataset_paths, self._data, self._fingerprints, self._preprocessed, self._profiles):
+            store.pop(key, None)
+
+    def get_fingerprint(self, key: str) -> Optional[str]:
+        """
+        คืนค่า fingerprint ของไฟล์ของ dataset (sha256 ของไฟล์ใน BlobStore) หรือ None หากไม่ทราบ
+        """
+        return self._fingerprints.get(key)
+
+    def get_profile(self, key: str, max_categories: int = 10, sample_rows: int = 3) -> dict:
+        """
+        สร้าง profile ของ dataset (schema และสถิติพื้นฐานของแต่ละคอลัมน์) สำหรับใช้ใน prompt
+        ผลลัพธ์จะถูก cache ไว้จนกว่าจะมีการโหลดหรือ preprocess ข้อมูลใหม่
+        Parameters:
+            key: ตัวระบุของ dataset
+            max_categories: จำนวนค่าที่พบบ่อยที่สุดที่จะเก็บสำหรับคอลัมน์ที่ไม่ใช่ตัวเลข
+            sample_rows: จำนวนแถวตัวอย่าง
+        Returns:
+            dict ที่มี rows, columns (รายละเอียดของแต่ละคอลัมน์) และ sample (แถวตัวอย่าง)
+        """
+        df = self.get_data(key)
+        cached = self._profiles.get(key)
+        if cached is not None and cached[0] is df:
+            return cached[1]
+
+        columns = {}
+        for col in df.columns:
+            series = df[col]
+            info = {
+                "dtype": str(series.dtype),
+                "non_null": int(series.notna().sum()),
+                "unique": int(series.nunique(dropna=True)),
+            }
+            try:
+                if pd.api.types.is_bool_dtype(series):
+                    info["top_values"] = {str(k): int(v) for k, v in series.value_counts().head(max_categories).items()}
+                elif pd.api.types.is_numeric_dtype(series):
+                    described = series.describe()
+                    info.update({stat: round(float(described[stat]), 4) for stat in ("min", "max", "mean", "std")
+                                 if stat in described and pd.notna(described[stat])})
+                elif pd.api.types.is_datetime64_any_dtype(series):
+                    info["min"] = str(series.min())
+                    info["max"] = str(series.max())
+                else:
+                    info["top_values"] = {str(k): int(v) for k, v in series.value_counts().head(max_categories).items()}
+            except Exception as e:
+                logging.error(f"Error profiling column '{col}' of dataset '{key}': {e}")
+            columns[col] = info
+
+        profile = {
+            "rows": int(len(df)),
+            "columns": columns,
+            "sample": df.head(sample_rows).astype(str).to_dict(orient="records"),
+        }
+        self._profiles[key] = (df, profile)
+        return profile
@@ -0,0 +1,259 @@
+# -----------------------------------------------------------------------
+# กำหนดเวลาสิ้นสุด (deadline) และการยกเลิกของ request
+# deadline ถูกส่งต่อผ่าน ContextVar ไปยังทุกขั้นตอนของ SupervisorAgent (agent, การเรียก LLM,
+# การรอคิวของ scheduler และการรันโค้ด) โดยแต่ละขั้นตอนจะตรวจสอบและหยุดทำงานเองเมื่อหมดเวลา
+# หรือเมื่อผู้ใช้กดยกเลิก (cooperative cancellation)
+# -----------------------------------------------------------------------
+import asyncio
+import contextlib
+import ctypes
+import logging
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import current_metrics, current_stage
+
+# เวลาสูงสุดของหนึ่ง request (วินาที, 0 = ไม่จำกัด)
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", 180))
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(BaseException):
+    """
+    ข้อผิดพลาดเมื่อ request หมดเวลาหรือถูกยกเลิก
+    สืบทอดจาก BaseException (เช่นเดียวกับ asyncio.CancelledError) เพื่อไม่ให้ถูกจับโดย
+    except Exception ที่ใช้จัดการข้อผิดพลาดทั่วไปภายใน agent และ tool
+    Attributes:
+        stage (str): stage ที่กำลังทำงานอยู่เมื่อหมดเวลา
+        reason (str): "timeout" หรือ "cancelled"
+    """
+
+    def __init__(self, stage: Optional[str] = None, reason: Optional[str] = None):
+        deadline = current_deadline()
+        self.stage = stage or current_stage()
+        self.reason = reason or (deadline.reason if deadline else "timeout")
+        super().__init__(f"Request {'cancelled' if self.reason == 'cancelled' else 'timed out'} during stage '{self.stage}'")
+
+
+class Deadline:
+    """
+    deadline ของหนึ่ง request ซึ่งหมดอายุเมื่อถึงเวลาที่กำหนดหรือเมื่อถูกยกเลิกด้วย cancel()
+    """
+
+    def __init__(self, timeout: Optional[float] = REQUEST_TIMEOUT_SECONDS):
+        """
+        ตัวสร้างสำหรับ Deadline
+        Parameters:
+            timeout (float): เวลาสูงสุด (วินาที) นับจากตอนนี้ หรือ None/0 เพื่อไม่จำกัดเวลา
+        """
+        self.timeout = timeout or None
+        self.expires_at = time.monotonic() + timeout if timeout else math.inf
+        self._cancelled = threading.Event()
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def reason(self) -> str:
+        return "cancelled" if self._cancelled.is_set() else "timeout"
+
+    def remaining(self) -> float:
+        """
+        เวลาที่เหลือ (วินาที) หรือ 0 หากหมดเวลาหรือถูกยกเลิกแล้ว (math.inf หากไม่จำกัดเวลา)
+        """
+        if self._cancelled.is_set():
+            return 0.0
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """
+        โยน DeadlineExceeded หากหมดเวลาหรือถูกยกเลิกแล้ว
+        """
+        if self.expired():
+            raise DeadlineExceeded()
+
+    def cancel(self) -> None:
+        """
+        ยกเลิก request (เรียกได้จากทุก thread เช่น เมื่อผู้ใช้กดยกเลิกหรือออกจากหน้า)
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            listeners = list(self._listeners)
+        logging.info("Request cancelled by user")
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """
+        ลงทะเบียนฟังก์ชันที่จะถูกเรียกเมื่อ cancel() (ถูกเรียกทันทีหากถูกยกเลิกไปแล้ว)
+        Returns:
+            ฟังก์ชันสำหรับยกเลิกการลงทะเบียน
+        """
+        with self._lock:
+            cancelled = self._cancelled.is_set()
+            if not cancelled:
+                self._listeners.append(listener)
+        if cancelled:
+            listener()
+
+        def remove() -> None:
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return remove
+
+    def child(self) -> "Deadline":
+        """
+        สร้าง deadline ย่อยที่หมดเวลาพร้อมกับ deadline นี้และถูกยกเลิกตามเมื่อ deadline นี้ถูกยกเลิก
+        (การยกเลิก deadline ย่อยไม่มีผลกับ deadline นี้ เช่น การยกเลิกงานที่รันล่วงหน้าแต่ไม่ถูกใช้)
+        """
+        child = Deadline(None)
+        child.timeout, child.expires_at = self.timeout, self.expires_at
+        self.add_listener(child.cancel)
+        return child
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        context manager สำหรับกำหนดให้ deadline นี้เป็น deadline ของ request ปัจจุบัน
+        """
+        token = _current_deadline.set(self)
+        try:
+            yield self
+        finally:
+            _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    คืนค่า Deadline ของ request ที่กำลังประมวลผลใน context ปัจจุบัน (ถ้ามี)
+    """
+    return _current_deadline.get()
+
+
+def check_deadline() -> None:
+    """
+    โยน DeadlineExceeded หาก deadline ของ request ปัจจุบันหมดเวลาหรือถูกยกเลิกแล้ว
+    """
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+
+
+class DeadlineCallbackHandler(BaseCallbackHandler):
+    """
+    callback สำหรับตรวจสอบ deadline ก่อนการเรียก LLM, ระหว่าง streaming token, และก่อนการเรียก tool
+    (raise_error=True ทำให้ DeadlineExceeded หยุดการทำงานของ agent ทันที)
+    """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self.deadline.check()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        self.deadline.check()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.deadline.check()
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.deadline.check()
+
+    def on_agent_action(self, action: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.deadline.check()
+
+
+def deadline_callbacks() -> List[BaseCallbackHandler]:
+    """
+    คืนค่ารายการ callback สำหรับตรวจสอบ deadline ของ request ปัจจุบัน (ว่างหากไม่มี deadline)
+    """
+    deadline = current_deadline()
+    return [DeadlineCallbackHandler(deadline)] if deadline else []
+
+
+@contextlib.contextmanager
+def exec_watchdog():
+    """
+    context manager สำหรับหยุดโค้ดที่กำลังรันใน thread ปัจจุบันเมื่อ deadline หมดเวลาหรือถูกยกเลิก
+    (ใช้กับ exec ของโค้ดที่ LLM สร้าง) โดยส่ง DeadlineExceeded เข้าไปใน thread แบบ asynchronous
+    ซึ่งจะถูกโยนเมื่อ thread กลับมารัน Python bytecode (การคำนวณภายใน C extension จะไม่ถูกขัดจังหวะ)
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        yield
+        return
+    deadline.check()
+    thread_id = threading.get_ident()
+    lock = threading.Lock()
+    state = {"active": True}
+
+    def interrupt() -> None:
+        with lock:
+            if state["active"]:
+                state["active"] = False
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(DeadlineExceeded))
+
+    timer = threading.Timer(deadline.remaining(), interrupt) if deadline.remaining() != math.inf else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+    remove = deadline.add_listener(interrupt)
+    try:
+        yield
+    finally:
+        with lock:
+            state["active"] = False
+        if timer is not None:
+            timer.cancel()
+        remove()
+
+
+async def run_with_deadline(coro: Coroutine[Any, Any, Any], deadline: Deadline) -> Any:
+    """
+    รัน coroutine จนเสร็จ หรือยกเลิกเมื่อ deadline หมดเวลาหรือถูกยกเลิก
+    Parameters:
+        coro: coroutine ที่ต้องการรัน
+        deadline (Deadline): deadline ของ request
+    Returns:
+        ผลลัพธ์ของ coroutine
+    Raises:
+        DeadlineExceeded: พร้อมชื่อ stage ที่กำลังทำงานอยู่ตอนหมดเวลา
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coro)
+    cancelled = asyncio.Event()
+    remove = deadline.add_listener(lambda: loop.call_soon_threadsafe(cancelled.set))
+    watcher = asyncio.ensure_future(cancelled.wait())
+    try:
+        timeout = deadline.remaining()
+        await asyncio.wait({task, watcher}, timeout=None if timeout == math.inf else timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        # บันทึก stage ที่ยังทำงานอยู่ก่อนยกเลิก task (stage จะถูกปิดระหว่างการยกเลิก)
+        metrics = current_metrics()
+        stages = metrics.active_stages() if metrics else []
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, DeadlineExceeded):
+            await task
+        raise DeadlineExceeded(stage=", ".join(stages) or None, reason=deadline.reason)
+    finally:
+        remove()
+        watcher.cancel()
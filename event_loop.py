@@ -0,0 +1,46 @@
+# -----------------------------------------------------------------------
+# event loop กลางสำหรับรัน coroutine จากโค้ดแบบ synchronous (เช่น Streamlit script thread)
+# ใช้ loop เดียวที่ทำงานตลอดอายุของ process ใน background thread เพื่อให้ async client ของ LLM
+# (ซึ่งผูกกับ event loop ที่สร้างมัน) ถูกนำกลับมาใช้ซ้ำได้ระหว่าง request
+# -----------------------------------------------------------------------
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    คืนค่า event loop กลางของ process (สร้างและเริ่มทำงานใน background thread เมื่อเรียกครั้งแรก)
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="supervisor-event-loop", daemon=True).start()
+        return _loop
+
+
+def submit_coroutine(coro: Coroutine[Any, Any, Any]) -> concurrent.futures.Future:
+    """
+    ส่ง coroutine ไปรันบน event loop กลางโดยไม่รอผลลัพธ์
+    (ใช้เมื่อ thread ที่เรียกต้องทำงานอื่นระหว่างรอ เช่น แสดง token ที่ stream เข้ามา)
+    Returns:
+        concurrent.futures.Future ของผลลัพธ์
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_coroutine(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """
+    รัน coroutine บน event loop กลางและรอผลลัพธ์ (block thread ที่เรียก)
+    Parameters:
+        coro: coroutine ที่ต้องการรัน
+        timeout (float): เวลารอสูงสุด (วินาที) หรือ None เพื่อรอจนเสร็จ
+    Returns:
+        ผลลัพธ์ของ coroutine
+    """
+    return submit_coroutine(coro).result(timeout)
@@ -0,0 +1,187 @@
+# -----------------------------------------------------------------------
+# คำอธิบายผลลัพธ์แบบ template สำหรับผลลัพธ์ที่ไม่ซับซ้อน
+# ผลการรันโค้ดของ pandas_agent จะถูกจัดประเภทเป็น scalar, small_table, plot_only, error หรือ complex
+# ประเภทที่ไม่ซับซ้อนจะถูกอธิบายด้วย template ภาษาไทยและภาษาอังกฤษทันทีโดยไม่ต้องเรียก LLM
+# ส่วนผลลัพธ์ประเภท complex ยังคงใช้ LLM ย่อยอธิบายตามเดิม
+# -----------------------------------------------------------------------
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# ค่าเริ่มต้นของ explanation engine (ปรับได้ผ่าน environment variables)
+TEMPLATED_EXPLANATIONS = os.getenv("TEMPLATED_EXPLANATIONS", "true").lower() == "true"  # เปิดใช้ template
+TEMPLATE_MAX_SCALAR_CHARS = int(os.getenv("TEMPLATE_MAX_SCALAR_CHARS", 120))    # ความยาวสูงสุดของ output ที่ถือว่าเป็นค่าเดียว
+TEMPLATE_MAX_TABLE_ROWS = int(os.getenv("TEMPLATE_MAX_TABLE_ROWS", 10))         # จำนวนแถวสูงสุดของตารางขนาดเล็ก
+TEMPLATE_MAX_TABLE_COLUMNS = int(os.getenv("TEMPLATE_MAX_TABLE_COLUMNS", 6))    # จำนวนคอลัมน์สูงสุดของตารางขนาดเล็ก
+
+# ประเภทของผลลัพธ์
+SCALAR = "scalar"
+SMALL_TABLE = "small_table"
+PLOT_ONLY = "plot_only"
+ERROR = "error"
+COMPLEX = "complex"
+
+# คำแนะนำสำหรับ error ที่พบบ่อยในโค้ดที่ LLM สร้าง (ภาษาอังกฤษ, ภาษาไทย)
+_ERROR_HINTS: Dict[str, Tuple[str, str]] = {
+    "KeyError": ("A column or key used by the code does not exist in the dataset.",
+                 "โค้ดอ้างถึงคอลัมน์หรือคีย์ที่ไม่มีอยู่ในชุดข้อมูล"),
+    "NameError": ("The code uses a variable or function that was not defined.",
+                  "โค้ดเรียกใช้ตัวแปรหรือฟังก์ชันที่ยังไม่ได้กำหนด"),
+    "TypeError": ("An operation was applied to a column with an incompatible data type.",
+                  "มีการคำนวณกับคอลัมน์ที่ชนิดข้อมูลไม่รองรับ"),
+    "ValueError": ("A value in the data could not be processed as expected.",
+                   "ค่าบางค่าในข้อมูลไม่สามารถประมวลผลได้ตามที่คาดไว้"),
+    "SyntaxError": ("The generated code is not valid Python.",
+                    "โค้ดที่ถูกสร้างขึ้นไม่ใช่ Python ที่ถูกต้อง"),
+}
+
+_TABLE_RULE = re.compile(r"^[\s\-+=|:]+$")
+_COLUMN_GAP = re.compile(r"\s{2,}")
+_NUMBER = re.compile(r"^-?\d[\d,]*(\.\d+)?(e[-+]?\d+)?%?$", re.IGNORECASE)
+# บรรทัดสุดท้ายของ print(series) เช่น "Name: units, dtype: int64" (Length จะมีเมื่อ pandas ย่อแถวด้วย "...")
+_SERIES_FOOTER = re.compile(r"^(?:Freq: [^,]*, )?(?:Name: (?P<name>.*?), )?(?P<length>Length: \d+, )?dtype: \S+$")
+
+
+def is_thai(text: str) -> bool:
+    """
+    ตรวจสอบว่าข้อความมีตัวอักษรภาษาไทยหรือไม่ (ใช้เลือกภาษาของคำอธิบายหลัก)
+    """
+    return bool(re.search(r"[฀-๿]", text or ""))
+
+
+def _parse_series(lines: List[str], footer: "re.Match") -> Optional[Tuple[List[str], List[List[str]]]]:
+    # แยก output ของ print(series) เป็นตารางสองคอลัมน์ (index และค่า) โดยตัดบรรทัด Name:/dtype: ออก
+    # คืนค่า None หาก series ถูกย่อแถว (Length) หรือมี index หลายระดับ
+    if footer.group("length"):
+        return None
+    body = lines[:-1]
+    # บรรทัดแรกที่มีเพียงช่องเดียวคือชื่อของ index (เช่น ผลของ groupby)
+    index_name = body.pop(0).strip() if len(body) > 1 and len(_COLUMN_GAP.split(body[0].strip())) == 1 else "index"
+    rows = [_COLUMN_GAP.split(line.strip()) for line in body]
+    if not rows or any(len(row) != 2 for row in rows):
+        return None
+    return [index_name, footer.group("name") or "value"], rows
+
+
+def _parse_table(output: str) -> Optional[Tuple[List[str], List[List[str]]]]:
+    # แยกตารางข้อความ (รูปแบบของ tabulate, DataFrame.to_string หรือ print(series)) เป็นชื่อคอลัมน์และแถว
+    # คืนค่า None หาก output ไม่ใช่ตารางที่มีโครงสร้างสม่ำเสมอ
+    lines = [line for line in output.splitlines() if line.strip() and not _TABLE_RULE.match(line)]
+    if len(lines) < 2:
+        return None
+    footer = _SERIES_FOOTER.match(lines[-1].strip())
+    if footer:
+        return _parse_series(lines, footer)
+    # คอลัมน์ถูกคั่นด้วยช่องว่างอย่างน้อยสองช่อง (ชื่อคอลัมน์หรือค่าที่มีช่องว่างเดียวจึงไม่ถูกแยก)
+    header = _COLUMN_GAP.split(lines[0].strip())
+    rows = [_COLUMN_GAP.split(line.strip()) for line in lines[1:]]
+    # header ที่มีเพียงคอลัมน์เดียวแยกไม่ออกว่าเป็นชื่อคอลัมน์หรือข้อความอื่น จึงไม่ถือว่าเป็นตาราง
+    if len(header) < 2 or any(len(row) not in (len(header), len(header) + 1) for row in rows):
+        return None
+    # แถวที่มีจำนวนช่องมากกว่า header หนึ่งช่องคือแถวที่มี index อยู่ด้านหน้า
+    rows = [row[1:] if len(row) == len(header) + 1 else row for row in rows]
+    return header, rows
+
+
+def classify_output(output: Optional[str], error: Optional[str], plot_count: int = 0,
+                    truncated: bool = False) -> str:
+    """
+    จัดประเภทผลลัพธ์ของการรันโค้ด
+    Parameters:
+        output (str): ข้อความ output ของโค้ด
+        error (str): ข้อความ error (ถ้ามี)
+        plot_count (int): จำนวนกราฟที่โค้ดสร้างขึ้น
+        truncated (bool): output ถูกตัดให้สั้นลงหรือไม่
+    Returns:
+        ประเภทของผลลัพธ์ (SCALAR, SMALL_TABLE, PLOT_ONLY, ERROR หรือ COMPLEX)
+    """
+    if error:
+        return ERROR
+    text = (output or "").strip()
+    if truncated:
+        return COMPLEX
+    if not text:
+        return PLOT_ONLY if plot_count else COMPLEX
+    if "\n" not in text and len(text) <= TEMPLATE_MAX_SCALAR_CHARS:
+        return SCALAR
+    table = _parse_table(text)
+    if table is not None:
+        header, rows = table
+        if len(rows) <= TEMPLATE_MAX_TABLE_ROWS and len(header) <= TEMPLATE_MAX_TABLE_COLUMNS:
+            return SMALL_TABLE
+    return COMPLEX
+
+
+def _plots_sentence(plot_count: int) -> Tuple[str, str]:
+    if not plot_count:
+        return "", ""
+    return (f" {plot_count} chart{'s' if plot_count > 1 else ''} {'were' if plot_count > 1 else 'was'} created from the result.",
+            f" สร้างกราฟจากผลลัพธ์แล้ว {plot_count} ภาพ")
+
+
+def _explain_scalar(text: str) -> Tuple[str, str]:
+    # output รูปแบบ "label: value" หรือค่าเดียว
+    label, _, value = text.rpartition(": ")
+    if label and value.strip():
+        return (f"From the question, the result for {label.strip()} is **{value.strip()}**.",
+                f"จากคำถาม ผลลัพธ์ของ {label.strip()} คือ **{value.strip()}**")
+    return f"From the question, the result is **{text}**.", f"จากคำถาม ผลลัพธ์ที่ได้คือ **{text}**"
+
+
+def _explain_table(header: List[str], rows: List[List[str]]) -> Tuple[str, str]:
+    columns = ", ".join(f"`{name}`" for name in header)
+    english = f"The result is a table with {len(rows)} row{'s' if len(rows) != 1 else ''} and columns {columns}."
+    thai = f"ผลลัพธ์เป็นตาราง {len(rows)} แถว ประกอบด้วยคอลัมน์ {columns}"
+    # ระบุแถวที่มีค่าสูงสุดของคอลัมน์ตัวเลขสุดท้าย (เช่น ผลรวมหรือค่าเฉลี่ยหลัง groupby)
+    if len(rows) > 1 and len(header) >= 2 and all(_NUMBER.match(row[-1]) for row in rows):
+        top = max(rows, key=lambda row: float(row[-1].replace(",", "").rstrip("%")))
+        english += f" The highest `{header[-1]}` is {top[-1]} ({header[0]} = {top[0]})."
+        thai += f" โดย `{header[-1]}` สูงสุดคือ {top[-1]} ({header[0]} = {top[0]})"
+    return english, thai
+
+
+def _explain_error(error: str) -> Tuple[str, str]:
+    error_type = next((name for name in _ERROR_HINTS if name in error), None)
+    hint_en, hint_th = _ERROR_HINTS.get(error_type, ("", ""))
+    first_line = error.strip().splitlines()[-1] if error.strip() else error
+    english = f"The generated code could not be executed: `{first_line}`. {hint_en}".strip()
+    thai = f"ไม่สามารถรันโค้ดที่ถูกสร้างขึ้นได้: `{first_line}` {hint_th}".strip()
+    return english, thai
+
+
+def explain_locally(output: Optional[str], error: Optional[str], user_input: str,
+                    plot_count: int = 0, truncated: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    สร้างคำอธิบายของผลลัพธ์ที่ไม่ซับซ้อนด้วย template (ไม่เรียก LLM)
+    Parameters:
+        output (str): ข้อความ output ของโค้ด
+        error (str): ข้อความ error (ถ้ามี)
+        user_input (str): คำถามของผู้ใช้ (ใช้เลือกภาษาของคำอธิบายหลัก)
+        plot_count (int): จำนวนกราฟที่โค้ดสร้างขึ้น
+        truncated (bool): output ถูกตัดให้สั้นลงหรือไม่
+    Returns:
+        dict ที่มี key "explanation" (ภาษาเดียวกับคำถาม), "explanation_en", "explanation_th" และ "kind"
+        หรือ None หากผลลัพธ์ซับซ้อนเกินกว่าจะใช้ template (ให้ใช้ LLM แทน)
+    """
+    kind = classify_output(output, error, plot_count, truncated)
+    if kind == COMPLEX:
+        return None
+    text = (output or "").strip()
+    if kind == ERROR:
+        english, thai = _explain_error(error)
+    elif kind == SCALAR:
+        english, thai = _explain_scalar(text)
+    elif kind == SMALL_TABLE:
+        english, thai = _explain_table(*_parse_table(text))
+    else:
+        english = f"The code created {plot_count} chart{'s' if plot_count > 1 else ''} without text output."
+        thai = f"โค้ดสร้างกราฟ {plot_count} ภาพ โดยไม่มีผลลัพธ์ที่เป็นข้อความ"
+    if kind != PLOT_ONLY:
+        plots_en, plots_th = _plots_sentence(plot_count)
+        english, thai = english + plots_en, thai + plots_th
+    return {
+        "explanation": thai if is_thai(user_input) else english,
+        "explanation_en": english,
+        "explanation_th": thai,
+        "kind": kind,
+    }
@@ -0,0 +1,147 @@
+# -----------------------------------------------------------------------
+# ตัวจัดการ figure ของ matplotlib แบบแยกตาม thread
+# pyplot เก็บ figure ทั้งหมดไว้ใน Gcf ซึ่งเป็น state ระดับ process ทำให้การรันโค้ดพร้อมกัน
+# หลาย session ปิดหรือบันทึก figure ของกันและกันได้ โมดูลนี้เปลี่ยน registry ของ Gcf
+# ให้แยกตาม thread และมี FigureCapture สำหรับเก็บเฉพาะ figure ที่การรันครั้งนั้นสร้างขึ้น
+# -----------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, List, Optional
+
+import matplotlib
+
+# ใช้ backend แบบ non-interactive ซึ่งปลอดภัยสำหรับการ render จากหลาย thread
+matplotlib.use("Agg")
+
+from matplotlib import _pylab_helpers
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+
+
+class _ThreadLocalFigs(MutableMapping):
+    """
+    registry ของ figure manager ที่แยกตาม thread ใช้แทน Gcf.figs (OrderedDict ระดับ process)
+    รองรับเมธอดที่ Gcf เรียกใช้ (get, pop, clear, values, move_to_end ฯลฯ)
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def _figs(self) -> OrderedDict:
+        figs = getattr(self._local, "figs", None)
+        if figs is None:
+            figs = self._local.figs = OrderedDict()
+        return figs
+
+    def __getitem__(self, num):
+        return self._figs[num]
+
+    def __setitem__(self, num, manager):
+        self._figs[num] = manager
+
+    def __delitem__(self, num):
+        del self._figs[num]
+
+    def __iter__(self):
+        return iter(self._figs)
+
+    def __len__(self):
+        return len(self._figs)
+
+    def __contains__(self, num):
+        return num in self._figs
+
+    def keys(self):
+        return self._figs.keys()
+
+    def values(self):
+        return self._figs.values()
+
+    def items(self):
+        return self._figs.items()
+
+    def move_to_end(self, num, last=True):
+        self._figs.move_to_end(num, last=last)
+
+
+_install_lock = threading.Lock()
+
+
+def install_thread_local_figures() -> None:
+    """
+    เปลี่ยน Gcf.figs ให้เป็น registry แบบแยกตาม thread (เรียกซ้ำได้อย่างปลอดภัย)
+    หลังจากนี้ plt.figure(), plt.get_fignums() และ plt.close('all') จะเห็นเฉพาะ figure ของ thread ตัวเอง
+    """
+    with _install_lock:
+        if isinstance(_pylab_helpers.Gcf.figs, _ThreadLocalFigs):
+            return
+        existing = _pylab_helpers.Gcf.figs
+        thread_local_figs = _ThreadLocalFigs()
+        # ย้าย figure ที่เปิดอยู่แล้วให้เป็นของ thread ที่เรียกติดตั้ง
+        thread_local_figs._figs.update(existing)
+        _pylab_helpers.Gcf.figs = thread_local_figs
+
+
+def _as_figure(value: Any) -> Optional[Figure]:
+    # แปลงค่าที่อ้างถึง figure (Figure, Axes, seaborn FacetGrid/PairGrid/JointGrid) ให้เป็น Figure
+    if isinstance(value, Figure):
+        return value
+    figure = getattr(value, "figure", None)
+    if isinstance(figure, Figure):
+        return figure
+    return None
+
+
+class FigureCapture:
+    """
+    context manager สำหรับเก็บ figure ที่ถูกสร้างขึ้นระหว่างการรันโค้ดใน thread ปัจจุบัน
+    figure ที่ถูกเก็บทั้งหมดจะถูกปิดเมื่อออกจาก context เพื่อปล่อยหน่วยความจำ
+
+    ตัวอย่าง:
+        with FigureCapture() as capture:
+            exec(code, context)
+            for fig in capture.collect(context):
+                fig.savefig(...)
+    """
+
+    def __init__(self):
+        self._before = set()
+        self._figures: List[Figure] = []
+
+    def __enter__(self) -> "FigureCapture":
+        install_thread_local_figures()
+        # ปิด figure ที่ค้างอยู่ของ thread นี้จากการรันครั้งก่อน (ไม่กระทบ thread อื่น)
+        plt.close('all')
+        self._before = set(plt.get_fignums())
+        return self
+
+    def collect(self, namespace: Optional[Dict[str, Any]] = None) -> List[Figure]:
+        """
+        คืนค่ารายการ figure ที่ถูกสร้างขึ้นตั้งแต่เข้า context ตามลำดับการสร้าง
+        Parameters:
+            namespace (dict): context ที่ใช้รันโค้ด (ถ้ามี) ใช้ค้นหา figure ที่สร้างแบบ object-oriented
+                              โดยไม่ผ่าน pyplot เช่น Figure() หรือ seaborn grid ที่ถูกเก็บไว้ในตัวแปร
+        Returns:
+            รายการของ matplotlib Figure
+        """
+        figures: List[Figure] = []
+        for num in plt.get_fignums():
+            if num not in self._before:
+                figures.append(plt.figure(num))
+        for value in (namespace or {}).values():
+            figure = _as_figure(value)
+            if figure is not None and figure not in figures:
+                figures.append(figure)
+        self._figures = figures
+        return figures
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        for figure in self._figures:
+            plt.close(figure)
+        # ปิด figure ที่สร้างขึ้นแต่ไม่ได้ถูก collect (เช่น กรณีเกิด error ระหว่างรันโค้ด)
+        for num in plt.get_fignums():
+            if num not in self._before:
+                plt.close(num)
+        self._figures = []
@@ -0,0 +1,377 @@
+# -----------------------------------------------------------------------
+# การลบข้อมูลเก่าอัตโนมัติ (janitor) สำหรับไฟล์ที่อัปโหลด, กราฟ และไฟล์ชั่วคราว
+# ทำงานใน background thread เป็นระยะ และตรวจสอบ session ทีละชุด (batch) เพื่อไม่ให้ block request
+#   - session ที่ไม่ได้ใช้งานนานเกิน SESSION_IDLE_DAYS: ลบไฟล์ที่อัปโหลด, ปล่อยการอ้างอิงไฟล์ใน BlobStore และกราฟ
+#     (ข้อมูลของ session และข้อความยังถูกเก็บไว้ ผู้ใช้อัปโหลดไฟล์ใหม่เพื่อใช้งานต่อได้)
+#   - session ที่ไฟล์อัปโหลดรวมเกิน SESSION_QUOTA_MB (ไฟล์ในโฟลเดอร์ของ session และไฟล์ใน BlobStore ที่ session อ้างอิง):
+#     ลบไฟล์หรือปล่อยการอ้างอิงไฟล์ที่เก่าที่สุดที่ไม่ได้ใช้งานอยู่
+#   - พื้นที่รวมเกิน DISK_BUDGET_MB: ลบไฟล์ output/profile ที่เก่าที่สุด แล้วจึง evict session ที่ไม่ได้ใช้งานนานที่สุดก่อน
+#     จนกว่าจะอยู่ในงบ
+#   - ไฟล์ใน temp_uploads ที่เก่ากว่า TEMP_UPLOAD_TTL_HOURS
+#   - ไฟล์ output ฉบับเต็ม (artifacts/outputs) และไฟล์ profile (artifacts/profiles) ที่เก่ากว่า ARTIFACT_TTL_HOURS
+# -----------------------------------------------------------------------
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from blob_store import BlobStore
+from plot_store import PlotStore
+from profiling import PROFILE_DIR
+from session_store import LOG_FILENAME, SESSION_FILENAME, THAI_TZ
+from stdout_capture import OUTPUT_SPILL_DIR
+
+# ค่าเริ่มต้นของ janitor (ปรับได้ผ่าน environment variables)
+JANITOR_ENABLED = os.getenv("JANITOR_ENABLED", "true").lower() == "true"          # เปิดใช้งาน
+JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", 600))      # ระยะห่างระหว่างการรันแต่ละรอบ
+JANITOR_BATCH_SIZE = int(os.getenv("JANITOR_BATCH_SIZE", 50))                     # จำนวน session ที่ตรวจสอบต่อ batch
+JANITOR_BATCH_PAUSE_SECONDS = float(os.getenv("JANITOR_BATCH_PAUSE_SECONDS", 0.05))  # เวลาพักระหว่าง batch
+SESSION_IDLE_DAYS = float(os.getenv("SESSION_IDLE_DAYS", 14))                     # อายุสูงสุดของไฟล์ของ session ที่ไม่ได้ใช้งาน
+SESSION_QUOTA_MB = float(os.getenv("SESSION_QUOTA_MB", 200))                      # พื้นที่สูงสุดของไฟล์ที่อัปโหลดต่อ session
+DISK_BUDGET_MB = float(os.getenv("DISK_BUDGET_MB", 5120))                         # พื้นที่รวมสูงสุด (ไฟล์ที่อัปโหลด + กราฟ + ไฟล์ output/profile)
+SESSION_ACTIVE_GRACE_MINUTES = float(os.getenv("SESSION_ACTIVE_GRACE_MINUTES", 60))  # session ที่ใช้งานล่าสุดภายในช่วงนี้จะไม่ถูก evict
+TEMP_UPLOAD_TTL_HOURS = float(os.getenv("TEMP_UPLOAD_TTL_HOURS", 24))             # อายุสูงสุดของไฟล์ใน temp_uploads
+ARTIFACT_TTL_HOURS = float(os.getenv("ARTIFACT_TTL_HOURS", 72))                   # อายุสูงสุดของไฟล์ output ฉบับเต็มและไฟล์ profile
+
+# ไฟล์ของระบบที่ไม่ใช่ไฟล์ที่ผู้ใช้อัปโหลด
+_SESSION_SYSTEM_FILES = {SESSION_FILENAME, LOG_FILENAME}
+
+
+class JanitorReport(BaseModel):
+    """
+    โมเดลสำหรับเก็บผลการทำงานของ janitor หนึ่งรอบ
+    Attributes:
+        started_at (str): เวลาที่เริ่มทำงาน
+        seconds (float): เวลาที่ใช้
+        sessions_scanned (int): จำนวน session ที่ถูกตรวจสอบ
+        sessions_evicted (int): จำนวน session ที่ไฟล์ถูกลบ (เพราะไม่ได้ใช้งานนานหรือเกินงบพื้นที่รวม)
+        upload_files_removed (int): จำนวนไฟล์ที่อัปโหลดที่ถูกลบ
+        upload_bytes_freed (int): จำนวน bytes ของไฟล์ที่อัปโหลดที่ถูกลบ
+        plots_removed (int): จำนวนไฟล์กราฟที่ถูกลบ
+        plot_bytes_freed (int): จำนวน bytes ของไฟล์กราฟที่ถูกลบ
+        temp_files_removed (int): จำนวนไฟล์ชั่วคราวที่ถูกลบ
+        temp_bytes_freed (int): จำนวน bytes ของไฟล์ชั่วคราวที่ถูกลบ
+        artifact_files_removed (int): จำนวนไฟล์ output ฉบับเต็มและไฟล์ profile ที่ถูกลบ
+        artifact_bytes_freed (int): จำนวน bytes ของไฟล์ output ฉบับเต็มและไฟล์ profile ที่ถูกลบ
+        disk_bytes (int): พื้นที่ที่ใช้อยู่หลังการทำงาน (ไฟล์ที่อัปโหลด + กราฟ + ไฟล์ output/profile)
+    """
+    started_at: str
+    seconds: float = 0.0
+    sessions_scanned: int = 0
+    sessions_evicted: int = 0
+    upload_files_removed: int = 0
+    upload_bytes_freed: int = 0
+    plots_removed: int = 0
+    plot_bytes_freed: int = 0
+    temp_files_removed: int = 0
+    temp_bytes_freed: int = 0
+    artifact_files_removed: int = 0
+    artifact_bytes_freed: int = 0
+    disk_bytes: int = 0
+
+    def bytes_freed(self) -> int:
+        return self.upload_bytes_freed + self.plot_bytes_freed + self.temp_bytes_freed + self.artifact_bytes_freed
+
+
+def _parse_time(value: str) -> float:
+    # แปลงเวลาในรูปแบบของ session (เวลาไทย) เป็น timestamp
+    try:
+        return THAI_TZ.localize(datetime.strptime(value, '%Y-%m-%d %H:%M:%S')).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Janitor:
+    """
+    คลาสสำหรับลบไฟล์ที่อัปโหลด กราฟ ไฟล์ชั่วคราว และไฟล์ output/profile ตามอายุ, quota ต่อ session และงบพื้นที่รวม
+    """
+
+    def __init__(self, session_manager, plot_store: PlotStore, blob_store: Optional[BlobStore] = None,
+                 temp_dir: Optional[str] = None, idle_days: float = SESSION_IDLE_DAYS, quota_mb: float = SESSION_QUOTA_MB,
+                 budget_mb: float = DISK_BUDGET_MB, temp_ttl_hours: float = TEMP_UPLOAD_TTL_HOURS,
+                 artifact_dirs: Optional[List[str]] = None, artifact_ttl_hours: float = ARTIFACT_TTL_HOURS):
+        """
+        ตัวสร้างสำหรับ Janitor
+        Parameters:
+            session_manager: ที่เก็บ session (SqliteSessionManager หรือ JsonSessionManager)
+            plot_store (PlotStore): ที่เก็บไฟล์กราฟ
+            blob_store (BlobStore): ที่เก็บไฟล์ชุดข้อมูลที่อัปโหลด (ไฟล์ถูกลบเมื่อไม่มี session อ้างอิงแล้ว)
+            temp_dir (str): โฟลเดอร์ไฟล์ชั่วคราว (เช่น temp_uploads)
+            idle_days (float): อายุสูงสุด (วัน) ของไฟล์ของ session ที่ไม่ได้ใช้งาน
+            quota_mb (float): พื้นที่สูงสุด (MB) ของไฟล์ที่อัปโหลดต่อ session
+            budget_mb (float): พื้นที่รวมสูงสุด (MB) ของไฟล์ที่อัปโหลด กราฟ และไฟล์ output/profile
+            temp_ttl_hours (float): อายุสูงสุด (ชั่วโมง) ของไฟล์ชั่วคราว
+            artifact_dirs (list): โฟลเดอร์ของไฟล์ output ฉบับเต็มและไฟล์ profile (ค่าเริ่มต้น OUTPUT_SPILL_DIR และ PROFILE_DIR)
+            artifact_ttl_hours (float): อายุสูงสุด (ชั่วโมง) ของไฟล์ใน artifact_dirs
+        """
+        self.session_manager = session_manager
+        self.plot_store = plot_store
+        self.blob_store = blob_store
+        self.temp_dir = temp_dir
+        self.idle_seconds = idle_days * 86400
+        self.quota_bytes = int(quota_mb * 1024 * 1024)
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.temp_ttl_seconds = temp_ttl_hours * 3600
+        self.artifact_dirs = [OUTPUT_SPILL_DIR, PROFILE_DIR] if artifact_dirs is None else artifact_dirs
+        self.artifact_ttl_seconds = artifact_ttl_hours * 3600
+        self.last_report: Optional[JanitorReport] = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -------------------------------------------------------------------
+    # ไฟล์ของ session
+    # -------------------------------------------------------------------
+    def _upload_files(self, session_id: str) -> List[Tuple[str, int, float]]:
+        # รายการไฟล์ที่ผู้ใช้อัปโหลดใน session (path, ขนาด, เวลาแก้ไขล่าสุด)
+        session_dir = self.session_manager.get_session_dir(session_id)
+        files = []
+        if not os.path.isdir(session_dir):
+            return files
+        for name in os.listdir(session_dir):
+            path = os.path.join(session_dir, name)
+            if name in _SESSION_SYSTEM_FILES or name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _remove(self, path: str, report: JanitorReport) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        report.upload_files_removed += 1
+        report.upload_bytes_freed += size
+        return size
+
+    def _collect_blobs(self, result: dict, report: JanitorReport) -> int:
+        report.upload_files_removed += result["removed"]
+        report.upload_bytes_freed += result["bytes_freed"]
+        return result["bytes_freed"]
+
+    def _evict(self, session, report: JanitorReport) -> int:
+        """
+        ลบไฟล์ที่อัปโหลดทั้งหมดของ session และปล่อยการอ้างอิงไฟล์ชุดข้อมูลและกราฟ (ข้อมูลของ session และข้อความยังอยู่)
+        ไฟล์ใน BlobStore ที่ session อื่นยังอ้างอิงอยู่จะไม่ถูกลบ
+        Returns:
+            จำนวน bytes ของไฟล์ที่อัปโหลดที่ถูกลบ
+        """
+        freed = sum(self._remove(path, report) for path, _, _ in self._upload_files(session.session_id))
+        if self.blob_store is not None:
+            freed += self._collect_blobs(self.blob_store.release_session(session.session_id), report)
+        if session.file_path:
+            # ล้างเส้นทางของไฟล์ เพื่อให้ผู้ใช้อัปโหลดไฟล์ใหม่ได้เมื่อกลับมาใช้ session นี้
+            session.file_path = session.file_hash = session.file_name = None
+            self.session_manager.save_session(session)
+        plots = self.plot_store.release_session(session.session_id)
+        report.plots_removed += plots["removed"]
+        report.plot_bytes_freed += plots["bytes_freed"]
+        report.sessions_evicted += 1
+        logging.info(f"Janitor evicted files of session {session.session_id} ({freed} bytes)")
+        return freed
+
+    def _session_blobs(self, session_id: str) -> List[Tuple[str, int, float]]:
+        # ไฟล์ใน BlobStore ที่ session อ้างอิงอยู่ (digest, ขนาด, เวลาที่ใช้งานล่าสุด)
+        return self.blob_store.session_blobs(session_id) if self.blob_store is not None else []
+
+    def _enforce_quota(self, session, files: List[Tuple[str, int, float]], blobs: List[Tuple[str, int, float]],
+                       report: JanitorReport) -> Tuple[List[Tuple[str, int, float]], List[Tuple[str, int, float]]]:
+        """
+        ลบไฟล์ในโฟลเดอร์ของ session หรือปล่อยการอ้างอิงไฟล์ใน BlobStore ที่เก่าที่สุด จนกว่าขนาดรวมจะไม่เกิน quota
+        (ไม่ลบไฟล์ที่ session ใช้งานอยู่ ไฟล์ใน BlobStore ที่ไม่มี session อ้างอิงแล้วจะถูกลบโดย collect())
+        Returns:
+            tuple ของรายการไฟล์ในโฟลเดอร์ของ session และไฟล์ใน BlobStore ที่เหลืออยู่
+        """
+        total = sum(size for _, size, _ in files) + sum(size for _, size, _ in blobs)
+        current = os.path.abspath(session.file_path) if session.file_path else None
+        candidates = [("file", item) for item in files] + [("blob", item) for item in blobs]
+        removed = set()
+        for kind, item in sorted(candidates, key=lambda candidate: candidate[1][2]):
+            if total <= self.quota_bytes:
+                break
+            key, size, _ = item
+            if kind == "file":
+                if os.path.abspath(key) == current:
+                    continue
+                self._remove(key, report)
+            else:
+                if key == session.file_hash:
+                    continue
+                self.blob_store.release_ref(session.session_id, key)
+            removed.add(key)
+            total -= size
+        return ([item for item in files if item[0] not in removed],
+                [item for item in blobs if item[0] not in removed])
+
+    # -------------------------------------------------------------------
+    # การทำงานหนึ่งรอบ
+    # -------------------------------------------------------------------
+    def _sweep(self, directory: Optional[str], ttl_seconds: float, now: float) -> Tuple[int, int, List[Tuple[str, int, float]]]:
+        """
+        ลบไฟล์ในโฟลเดอร์ที่เก่ากว่า ttl_seconds
+        Returns:
+            tuple ของจำนวนไฟล์ที่ถูกลบ, จำนวน bytes ที่ถูกลบ และรายการไฟล์ที่เหลืออยู่ (path, ขนาด, เวลาแก้ไขล่าสุด)
+        """
+        removed, freed, remaining = 0, 0, []
+        if not directory or not os.path.isdir(directory):
+            return removed, freed, remaining
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime >= ttl_seconds:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+                    else:
+                        remaining.append((path, stat.st_size, stat.st_mtime))
+                except FileNotFoundError:
+                    continue
+        return removed, freed, remaining
+
+    def _clean_temp(self, report: JanitorReport, now: float) -> None:
+        removed, freed, _ = self._sweep(self.temp_dir, self.temp_ttl_seconds, now)
+        report.temp_files_removed += removed
+        report.temp_bytes_freed += freed
+
+    def _clean_artifacts(self, report: JanitorReport, now: float) -> List[Tuple[str, int, float]]:
+        # ไฟล์ output ฉบับเต็มและไฟล์ profile (คืนค่ารายการไฟล์ที่เหลืออยู่สำหรับตรวจสอบงบพื้นที่รวม)
+        remaining = []
+        for directory in self.artifact_dirs:
+            removed, freed, files = self._sweep(directory, self.artifact_ttl_seconds, now)
+            report.artifact_files_removed += removed
+            report.artifact_bytes_freed += freed
+            remaining.extend(files)
+        return remaining
+
+    def _remove_artifact(self, path: str, report: JanitorReport) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        report.artifact_files_removed += 1
+        report.artifact_bytes_freed += size
+        return size
+
+    def run_once(self, now: Optional[float] = None) -> JanitorReport:
+        """
+        ตรวจสอบและลบข้อมูลหนึ่งรอบ (session ถูกตรวจสอบทีละ JANITOR_BATCH_SIZE รายการ โดยพักระหว่าง batch)
+        Returns:
+            instance ของ JanitorReport
+        """
+        with self._run_lock:
+            started = time.perf_counter()
+            now = time.time() if now is None else now
+            report = JanitorReport(started_at=datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S'))
+            self._clean_temp(report, now)
+            artifacts = self._clean_artifacts(report, now)
+
+            # ขนาดไฟล์ในโฟลเดอร์ของ session ที่ยังมีไฟล์อยู่ (ใช้ตรวจสอบงบพื้นที่รวม)
+            remaining: List[Tuple[float, Any, int]] = []
+            offset = 0
+            while not self._stop.is_set():
+                sessions = self.session_manager.list_sessions(limit=JANITOR_BATCH_SIZE, offset=offset)
+                if not sessions:
+                    break
+                offset += len(sessions)
+                for session in sessions:
+                    report.sessions_scanned += 1
+                    files = self._upload_files(session.session_id)
+                    blobs = self._session_blobs(session.session_id)
+                    last_activity = _parse_time(session.last_activity)
+                    if now - last_activity >= self.idle_seconds:
+                        if files or blobs or session.file_path:
+                            self._evict(session, report)
+                        continue
+                    if sum(size for _, size, _ in files) + sum(size for _, size, _ in blobs) > self.quota_bytes:
+                        files, blobs = self._enforce_quota(session, files, blobs, report)
+                    # ไฟล์ใน BlobStore ถูกนับในงบพื้นที่รวมผ่าน blob_store.disk_usage() (ไฟล์หนึ่งอาจถูกอ้างอิงจากหลาย session)
+                    size = sum(size for _, size, _ in files)
+                    if size or blobs or session.file_path:
+                        remaining.append((last_activity, session, size))
+                time.sleep(JANITOR_BATCH_PAUSE_SECONDS)
+
+            plots = self.plot_store.collect(now)
+            report.plots_removed += plots["removed"]
+            report.plot_bytes_freed += plots["bytes_freed"]
+            disk_bytes = sum(size for _, _, size in remaining) + self.plot_store.disk_usage()
+            if self.blob_store is not None:
+                # ไฟล์ที่ไม่มี session อ้างอิง (เช่น การอัปโหลดที่ไม่สำเร็จ)
+                self._collect_blobs(self.blob_store.collect(now), report)
+                disk_bytes += self.blob_store.disk_usage()
+            disk_bytes += sum(size for _, size, _ in artifacts)
+
+            # ลบไฟล์ output/profile ที่เก่าที่สุดก่อน (ไม่ใช่ข้อมูลของผู้ใช้) จนกว่าพื้นที่รวมจะอยู่ในงบ
+            for path, _, _ in sorted(artifacts, key=lambda item: item[2]):
+                if disk_bytes <= self.budget_bytes:
+                    break
+                disk_bytes -= self._remove_artifact(path, report)
+
+            # evict session ที่ไม่ได้ใช้งานนานที่สุดก่อน จนกว่าพื้นที่รวมจะอยู่ในงบ
+            grace = SESSION_ACTIVE_GRACE_MINUTES * 60
+            for last_activity, session, size in sorted(remaining, key=lambda item: item[0]):
+                if disk_bytes <= self.budget_bytes or now - last_activity < grace:
+                    break
+                plot_bytes_before = report.plot_bytes_freed
+                disk_bytes -= self._evict(session, report)
+                disk_bytes -= report.plot_bytes_freed - plot_bytes_before
+
+            report.disk_bytes = max(disk_bytes, 0)
+            report.seconds = round(time.perf_counter() - started, 3)
+            self.last_report = report
+            logging.info(f"Janitor reclaimed {report.bytes_freed()} bytes: {report.model_dump()}")
+            return report
+
+    # -------------------------------------------------------------------
+    # background thread
+    # -------------------------------------------------------------------
+    def start(self, interval: float = JANITOR_INTERVAL_SECONDS) -> None:
+        """
+        เริ่ม background thread ที่รัน run_once() ทุก interval วินาที (เรียกซ้ำได้โดยไม่สร้าง thread ใหม่)
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logging.error(f"Janitor run failed: {e}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_janitor: Optional[Janitor] = None
+_janitor_lock = threading.Lock()
+
+
+def start_janitor(session_manager, plot_store: PlotStore, blob_store: Optional[BlobStore] = None,
+                  temp_dir: Optional[str] = None) -> Optional[Janitor]:
+    """
+    สร้างและเริ่ม janitor ของ process (ครั้งแรกที่ถูกเรียกเท่านั้น) หากเปิด JANITOR_ENABLED
+    Returns:
+        instance ของ Janitor ที่ทำงานอยู่ หรือ None หากปิดใช้งาน
+    """
+    global _janitor
+    if not JANITOR_ENABLED:
+        return None
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = Janitor(session_manager, plot_store, blob_store=blob_store, temp_dir=temp_dir)
+            _janitor.start()
+        return _janitor
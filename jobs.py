@@ -0,0 +1,378 @@
+# -----------------------------------------------------------------------
+# การรันคำถามของผู้ใช้เป็นงานเบื้องหลัง (background job)
+# แทนการรัน SupervisorAgent ใน Streamlit script thread จนเสร็จ handle_submit จะส่งคำถามเป็น job แล้วคืนค่าทันที
+#   - job ทำงานบน event loop กลาง (event_loop.py) โดยจำนวน job ที่ทำงานพร้อมกันถูกจำกัดด้วย JOB_WORKERS
+#   - สถานะและความคืบหน้าแยกตามขั้นตอน (routing, tool, execution, explanation) ถูกบันทึกลง SQLite
+#   - เมื่อ job เสร็จ คำตอบจะถูกบันทึกลงที่เก็บ session โดย worker เอง (ไม่ขึ้นกับ browser)
+#   - UI อ่านสถานะของ job เป็นระยะ การรีเฟรช browser จึงไม่ทำให้งานที่กำลังทำอยู่หายไป
+# -----------------------------------------------------------------------
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from agent_pool import AGENT_POOL, AgentPool
+from deadline import Deadline, REQUEST_TIMEOUT_SECONDS
+from event_loop import submit_coroutine
+from streaming import StreamCallbackHandler, StreamView
+
+# ค่าเริ่มต้นของ background job (ปรับได้ผ่าน environment variables)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))                                  # จำนวน job ที่ทำงานพร้อมกันสูงสุดต่อ process
+JOB_DB_FILENAME = os.getenv("JOB_DB_FILENAME", "jobs.db")                       # ชื่อไฟล์ฐานข้อมูลของ job ภายในโฟลเดอร์ sessions
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1.0))                    # ความถี่ที่ UI อ่านสถานะของ job
+JOB_PROGRESS_FLUSH_SECONDS = float(os.getenv("JOB_PROGRESS_FLUSH_SECONDS", 0.5))  # ความถี่ที่บันทึกความคืบหน้าลงฐานข้อมูล
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 7))                  # เก็บประวัติของ job ที่เสร็จแล้วกี่วัน
+
+# สถานะของ job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"  # process หยุดทำงานระหว่างที่ job ยังไม่เสร็จ
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# ขั้นตอนของ job ที่แสดงให้ผู้ใช้เห็น (จับคู่จาก stage ของ metrics)
+JOB_STAGES = {
+    "supervisor": "routing",
+    "memory_summary": "routing",
+    "speculative_wait": "routing",
+    "pandas_agent": "tool",
+    "analysis_agent": "tool",
+    "pandas_single_shot": "tool",
+    "execute_code": "execution",
+    "plot_saving": "execution",
+    "explanation": "explanation",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_input TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL DEFAULT '[]',
+    answer TEXT NOT NULL DEFAULT '',
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, created_at);
+"""
+_JOB_COLUMNS = "job_id, session_id, user_input, status, stage, progress, answer, error, created_at, updated_at"
+
+
+def job_stage(stage: str) -> Optional[str]:
+    """
+    คืนค่าขั้นตอนของ job (routing, tool, execution, explanation) จากชื่อ stage ของ metrics
+    """
+    return JOB_STAGES.get(stage)
+
+
+class JobStatus(BaseModel):
+    """
+    โมเดลสำหรับเก็บสถานะของ job
+    Attributes:
+        job_id (str): รหัสของ job
+        session_id (str): รหัสของ session ที่ส่งคำถาม
+        user_input (str): คำถามของผู้ใช้
+        status (str): สถานะ (queued, running, done, failed, cancelled, interrupted)
+        stage (Optional[str]): ขั้นตอนที่กำลังทำงานอยู่ (routing, tool, execution, explanation)
+        progress (List[str]): รายการความคืบหน้าของ tool และขั้นตอนต่าง ๆ
+        answer (str): คำตอบที่กำลังถูกสร้าง (บางส่วน)
+        error (Optional[str]): ข้อความ error หาก job ไม่สำเร็จ
+        created_at (float): เวลาที่ส่ง job (epoch seconds)
+        updated_at (float): เวลาที่สถานะถูกแก้ไขล่าสุด (epoch seconds)
+    """
+    job_id: str
+    session_id: str
+    user_input: str
+    status: str
+    stage: Optional[str] = None
+    progress: List[str] = []
+    answer: str = ""
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+
+class JobStore:
+    """
+    คลาสสำหรับเก็บสถานะของ job ในฐานข้อมูล SQLite (หนึ่ง connection ต่อ thread, WAL mode)
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _from_row(row) -> JobStatus:
+        job_id, session_id, user_input, status, stage, progress, answer, error, created_at, updated_at = row
+        return JobStatus(job_id=job_id, session_id=session_id, user_input=user_input, status=status, stage=stage,
+                         progress=json.loads(progress), answer=answer, error=error,
+                         created_at=created_at, updated_at=updated_at)
+
+    def save(self, job: JobStatus) -> None:
+        # ไม่เขียนทับสถานะที่ใหม่กว่า (การบันทึกความคืบหน้าจาก thread อื่นอาจเสร็จหลังการบันทึกผลลัพธ์)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT INTO jobs ({_JOB_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET status = excluded.status, stage = excluded.stage, "
+                "progress = excluded.progress, answer = excluded.answer, error = excluded.error, "
+                "updated_at = excluded.updated_at WHERE excluded.updated_at >= jobs.updated_at",
+                (job.job_id, job.session_id, job.user_input, job.status, job.stage,
+                 json.dumps(job.progress, ensure_ascii=False), job.answer, job.error,
+                 job.created_at, job.updated_at),
+            )
+
+    def get(self, job_id: str) -> Optional[JobStatus]:
+        row = self._connect().execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def latest(self, session_id: str) -> Optional[JobStatus]:
+        # job ล่าสุดของ session
+        row = self._connect().execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE session_id = ? ORDER BY created_at DESC LIMIT 1",
+            (session_id,),
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def interrupt_active(self) -> int:
+        # job ที่ยังไม่เสร็จจาก process ก่อนหน้า (เช่น server ถูก restart) ไม่สามารถทำงานต่อได้
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, "The server restarted before this request finished.", time.time(), *ACTIVE_STATUSES),
+            )
+        return cursor.rowcount
+
+    def prune(self, days: float = JOB_RETENTION_DAYS) -> int:
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+                (*ACTIVE_STATUSES, time.time() - days * 86400),
+            )
+        return cursor.rowcount
+
+
+class _Job:
+    # ข้อมูลของ job ที่กำลังทำงานใน process นี้ (stream และ view ใช้แสดงผลแบบ streaming ใน UI)
+    def __init__(self, status: JobStatus):
+        self.status = status
+        self.stream = StreamCallbackHandler()
+        self.view = StreamView()
+        self.deadline: Optional[Deadline] = None
+        self.cancel_requested = False
+        self.lock = threading.Lock()
+
+
+class JobManager:
+    """
+    คลาสสำหรับส่ง job ไปทำงานเบื้องหลังและติดตามสถานะของ job
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, pool: AgentPool = AGENT_POOL):
+        """
+        ตัวสร้างสำหรับ JobManager
+        Parameters:
+            store (JobStore): ที่เก็บสถานะของ job
+            workers (int): จำนวน job ที่ทำงานพร้อมกันสูงสุด
+            pool (AgentPool): pool ของ agent (agent ของ job ที่ยังไม่เสร็จจะถูก pin ไว้ไม่ให้ session อื่นยืม)
+        """
+        self.store = store
+        self.workers = workers
+        self.pool = pool
+        self._jobs: Dict[str, _Job] = {}
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        interrupted = store.interrupt_active()
+        pruned = store.prune()
+        if interrupted or pruned:
+            logging.info(f"Job store: {interrupted} unfinished jobs marked interrupted, {pruned} old jobs pruned")
+
+    def submit(self, session_id: str, agent: Any, user_input: str,
+               on_result: Callable[[str, Any], None]) -> str:
+        """
+        ส่งคำถามไปทำงานเบื้องหลังและคืนค่าทันที
+        Parameters:
+            session_id (str): รหัสของ session ที่ส่งคำถาม
+            agent: instance ของ SupervisorAgent ที่ session ยืมอยู่
+            user_input (str): คำถามของผู้ใช้
+            on_result: ฟังก์ชันที่ถูกเรียกพร้อม (session_id, SupervisorResponse) เมื่อได้คำตอบ
+                (ทำงานใน worker thread เพื่อบันทึกคำตอบลงที่เก็บ session ห้ามเรียก st.*)
+        Returns:
+            รหัสของ job (job_id)
+        """
+        now = time.time()
+        job = _Job(JobStatus(job_id=uuid.uuid4().hex, session_id=session_id, user_input=user_input,
+                             status=QUEUED, created_at=now, updated_at=now))
+        self.store.save(job.status)
+        with self._lock:
+            self._jobs[job.status.job_id] = job
+        # pin agent ไว้จนกว่า job จะเสร็จ (session อาจเปลี่ยนไปใช้ session อื่นและคืน lease ระหว่างที่ job ทำงาน)
+        self.pool.pin(agent)
+        try:
+            submit_coroutine(self._run(job, agent, on_result))
+        except Exception:
+            self.pool.unpin(agent)
+            with self._lock:
+                self._jobs.pop(job.status.job_id, None)
+            raise
+        logging.info(f"Job {job.status.job_id[:8]} queued for session {session_id[:8]}")
+        return job.status.job_id
+
+    def get(self, job_id: str) -> Optional[JobStatus]:
+        """
+        คืนค่าสถานะล่าสุดของ job (จาก memory หาก job ทำงานใน process นี้ หรือจากฐานข้อมูล)
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            with job.lock:
+                return job.status.model_copy(deep=True)
+        return self.store.get(job_id)
+
+    def view(self, job_id: str) -> Optional[StreamView]:
+        """
+        คืนค่า StreamView ของ job ที่ทำงานใน process นี้ (สำหรับแสดง thought และคำตอบที่กำลังถูกสร้าง)
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.view if job is not None else None
+
+    def active_job(self, session_id: str) -> Optional[JobStatus]:
+        """
+        คืนค่า job ของ session ที่ยังไม่เสร็จ (ถ้ามี) ใช้หา job เดิมหลังการรีเฟรช browser
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.status.session_id == session_id]
+        for job in sorted(jobs, key=lambda job: job.status.created_at, reverse=True):
+            if job.status.active():
+                return self.get(job.status.job_id)
+        latest = self.store.latest(session_id)
+        return latest if latest is not None and latest.active() else None
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        ขอให้ยกเลิก job (job ที่รออยู่ในคิวจะไม่ถูกรัน ส่วน job ที่กำลังทำงานจะหยุดตาม deadline)
+        Returns:
+            True หาก job ยังไม่เสร็จและถูกขอให้ยกเลิกแล้ว
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or not job.status.active():
+            return False
+        job.cancel_requested = True
+        if job.deadline is not None:
+            job.deadline.cancel()
+        logging.info(f"Job {job_id[:8]} cancel requested")
+        return True
+
+    # -------------------------------------------------------------------
+    # การทำงานของ job บน event loop กลาง
+    # -------------------------------------------------------------------
+    def _update(self, job: _Job, **fields: Any) -> JobStatus:
+        with job.lock:
+            for name, value in fields.items():
+                setattr(job.status, name, value)
+            job.status.updated_at = time.time()
+            return job.status.model_copy(deep=True)
+
+    def _flush(self, job: _Job) -> bool:
+        # ดึง event จาก stream เข้า view และคืนค่า True หากขั้นตอนหรือความคืบหน้าเปลี่ยนไป
+        events = job.stream.drain()
+        if not job.view.update(events):
+            return False
+        stage = job.status.stage
+        for event in events:
+            # tool ที่ supervisor เรียกเริ่มทำงานภายใต้ stage ของ supervisor
+            stage = "tool" if event.type == "tool_start" else job_stage(event.stage) or stage
+        self._update(job, stage=stage, progress=job.view.progress_lines(),
+                     answer=job.view.answer)
+        return True
+
+    async def _pump(self, job: _Job) -> None:
+        # บันทึกความคืบหน้าลงฐานข้อมูลเป็นระยะระหว่างที่ job ทำงาน
+        while True:
+            await asyncio.sleep(JOB_PROGRESS_FLUSH_SECONDS)
+            if self._flush(job):
+                await asyncio.to_thread(self.store.save, job.status.model_copy(deep=True))
+
+    async def _run(self, job: _Job, agent: Any, on_result: Callable[[str, Any], None]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        job_id = job.status.job_id
+        try:
+            async with self._semaphore:
+                if job.cancel_requested:
+                    await asyncio.to_thread(self.store.save, self._update(job, status=CANCELLED))
+                    return
+                # deadline เริ่มนับเมื่อ job เริ่มทำงาน (ไม่นับเวลาที่รออยู่ในคิว)
+                job.deadline = Deadline(REQUEST_TIMEOUT_SECONDS)
+                if job.cancel_requested:
+                    job.deadline.cancel()
+                await asyncio.to_thread(self.store.save, self._update(job, status=RUNNING, stage="routing"))
+                pump = asyncio.create_task(self._pump(job))
+                try:
+                    response = await agent.arun(job.status.user_input, stream=job.stream, deadline=job.deadline)
+                finally:
+                    pump.cancel()
+                self._flush(job)
+                # บันทึกคำตอบ (รวมคำตอบบางส่วนของ job ที่ถูกยกเลิกหรือหมดเวลา) ลงที่เก็บ session
+                await asyncio.to_thread(on_result, job.status.session_id, response)
+                outcome = response.metadata.status
+                status = {"success": DONE, "cancelled": CANCELLED}.get(outcome, FAILED)
+                error = None if status == DONE else (response.error or outcome)
+                await asyncio.to_thread(self.store.save, self._update(job, status=status, error=error))
+                logging.info(f"Job {job_id[:8]} finished with status {status}")
+        except Exception as e:
+            logging.error(f"Error in job {job_id[:8]}: {str(e)}")
+            self.store.save(self._update(job, status=FAILED, error=str(e)))
+        finally:
+            self.pool.unpin(agent)
+            # job ที่เสร็จแล้วอ่านสถานะจากฐานข้อมูลแทน
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(base_dir: str) -> JobManager:
+    """
+    คืนค่า JobManager ของ process (สร้างเมื่อเรียกครั้งแรก ใช้ร่วมกันทุก Streamlit session)
+    Parameters:
+        base_dir (str): โฟลเดอร์หลักของ session (ฐานข้อมูลอยู่ที่ base_dir/JOB_DB_FILENAME)
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(JobStore(os.path.join(base_dir, JOB_DB_FILENAME)))
+        return _manager
@@ -0,0 +1,158 @@
+# -----------------------------------------------------------------------
+# การสร้าง ChatOpenAI ที่ใช้ HTTP client ร่วมกันทั้ง process
+# ทุก agent และทุก session ที่เรียก base_url เดียวกันจะใช้ connection pool เดียวกัน (keep-alive)
+# จึงไม่ต้องเปิด TCP connection และทำ TLS handshake ใหม่ทุกครั้งที่สร้าง SupervisorAgent
+# การนำ connection กลับมาใช้ซ้ำถูกนับผ่าน trace extension ของ httpcore และบันทึกใน metrics
+# ทุก request ผ่าน transport ของ llm_scheduler ซึ่งจำกัดอัตราต่อ API key และจัดคิวแบบยุติธรรมระหว่าง session
+# -----------------------------------------------------------------------
+import importlib.util
+import logging
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+from llm_scheduler import AsyncRateLimitedTransport, RateLimitedTransport
+from metrics import current_metrics
+from streaming import LLM_STREAMING, LLM_STREAM_USAGE
+
+# ค่าเริ่มต้นของ connection pool (ปรับได้ผ่าน environment variables)
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", 20))      # จำนวน connection สูงสุดต่อ base_url
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", 10))          # จำนวน connection ที่เปิดค้างไว้ได้
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))            # เวลาที่ connection ว่างถูกเก็บไว้ (วินาที)
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))               # เวลารอการเชื่อมต่อ (วินาที)
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 600))                   # เวลารอการตอบกลับ (วินาที)
+# จำนวนครั้งที่ client ของ OpenAI ลองใหม่เมื่อเกิดข้อผิดพลาด (429 ถูกจัดการโดย llm_scheduler ตาม Retry-After แล้ว)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 1))
+# ใช้ HTTP/2 เมื่อเปิดไว้และติดตั้ง h2 แล้ว (pip install "httpx[http2]") มิฉะนั้นใช้ HTTP/1.1 แบบ keep-alive
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+# event ของ httpcore ที่แสดงว่ามีการเปิด connection ใหม่
+_NEW_CONNECTION_EVENT = "connection.connect_tcp.complete"
+
+
+class ConnectionStats(BaseModel):
+    """
+    โมเดลสำหรับเก็บสถิติการใช้ connection ของ HTTP client
+    Attributes:
+        requests (int): จำนวน request ทั้งหมด
+        new_connections (int): จำนวน connection ที่ถูกเปิดใหม่
+        reused (int): จำนวน request ที่ใช้ connection เดิมซ้ำ
+    """
+    requests: int = 0
+    new_connections: int = 0
+    reused: int = 0
+
+
+class _ClientPool:
+    # HTTP client แบบ sync และ async ของ base_url หนึ่ง พร้อมสถิติการใช้ connection
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.stats = ConnectionStats()
+        self._lock = threading.Lock()
+        limits = httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        self.client = httpx.Client(
+            transport=RateLimitedTransport(httpx.HTTPTransport(limits=limits, http2=LLM_HTTP2)),
+            event_hooks={"request": [self._on_request]},
+            timeout=timeout,
+            follow_redirects=True,
+        )
+        # AsyncClient ผูก connection กับ event loop ที่ใช้งาน จึงต้องใช้ร่วมกับ event loop กลาง (event_loop.py) เท่านั้น
+        self.async_client = httpx.AsyncClient(
+            transport=AsyncRateLimitedTransport(httpx.AsyncHTTPTransport(limits=limits, http2=LLM_HTTP2)),
+            event_hooks={"request": [self._aon_request]},
+            timeout=timeout,
+            follow_redirects=True,
+        )
+
+    def _record(self, new_connection: bool) -> None:
+        # new_connection=False สำหรับ request ใหม่ และ True เมื่อ request นั้นต้องเปิด connection ใหม่
+        with self._lock:
+            if new_connection:
+                self.stats.new_connections += 1
+            else:
+                self.stats.requests += 1
+            self.stats.reused = max(self.stats.requests - self.stats.new_connections, 0)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.record_http(new_connection)
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == _NEW_CONNECTION_EVENT:
+            self._record(new_connection=True)
+
+    async def _atrace(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._trace(event_name, info)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self._record(new_connection=False)
+        request.extensions["trace"] = self._trace
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        self._record(new_connection=False)
+        request.extensions["trace"] = self._atrace
+
+
+_pools: Dict[str, _ClientPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(base_url: str) -> _ClientPool:
+    key = (base_url or "").rstrip("/")
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _ClientPool(key)
+            logging.info(f"Created pooled HTTP client for {key or 'default'} (http2={LLM_HTTP2})")
+        return pool
+
+
+def get_http_clients(base_url: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    คืนค่า HTTP client แบบ sync และ async ที่ใช้ร่วมกันทั้ง process สำหรับ base_url ที่ระบุ
+    """
+    pool = _get_pool(base_url)
+    return pool.client, pool.async_client
+
+
+def create_chat_llm(base_url: str, model: str, api_key: str, temperature: float, **kwargs: Any) -> ChatOpenAI:
+    """
+    สร้าง ChatOpenAI ที่ใช้ connection pool ร่วมกับทุก agent และทุก session ของ base_url เดียวกัน
+    Parameters:
+        base_url (str): URL ของ API ของโมเดล
+        model (str): ชื่อโมเดล
+        api_key (str): API key
+        temperature (float): ค่า temperature ของโมเดล
+        **kwargs: พารามิเตอร์อื่นของ ChatOpenAI (เช่น top_p)
+    Returns:
+        instance ของ ChatOpenAI ที่ถูกกำหนดค่าแล้ว (เปิด streaming ตาม LLM_STREAMING)
+    """
+    http_client, http_async_client = get_http_clients(base_url)
+    return ChatOpenAI(
+        base_url=base_url,
+        model=model,
+        api_key=api_key,
+        temperature=temperature,
+        streaming=LLM_STREAMING,  # ส่ง token ไปยังหน้าจอระหว่างที่ LLM กำลังสร้างคำตอบ
+        stream_usage=LLM_STREAM_USAGE,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        max_retries=LLM_MAX_RETRIES,
+        **kwargs
+    )
+
+
+def pool_stats() -> Dict[str, ConnectionStats]:
+    """
+    คืนค่าสถิติการใช้ connection ของทุก base_url ตั้งแต่เริ่ม process
+    """
+    with _pools_lock:
+        return {base_url: pool.stats.model_copy() for base_url, pool in _pools.items()}
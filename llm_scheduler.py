@@ -0,0 +1,342 @@
+# -----------------------------------------------------------------------
+# การจำกัดอัตราการเรียก LLM ต่อ API key และการจัดคิวแบบยุติธรรมระหว่าง session
+# ทุก HTTP request ไปยัง LLM (ผ่าน client ของ llm_factory) ต้องได้รับสิทธิ์จาก scheduler ก่อน:
+#   - token bucket ต่อ API key สำหรับจำนวน request ต่อนาที (RPM) และจำนวน token ต่อนาที (TPM)
+#   - request ที่ต้องรอจะถูกปล่อยแบบ round-robin ระหว่าง session เพื่อไม่ให้ผู้ใช้ที่ส่งงานหนักแย่งสิทธิ์ทั้งหมด
+#   - เมื่อ provider ตอบ 429 จะหยุดส่ง request ของ key นั้นตาม Retry-After แล้วลองใหม่ (แทนการ retry ถี่ ๆ)
+# เวลาที่รอในคิวถูกบันทึกใน metrics ของ request และการรอจะหยุดเมื่อ deadline ของ request หมดเวลาหรือถูกยกเลิก
+# -----------------------------------------------------------------------
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Deque, Dict, Optional
+
+import httpx
+
+from deadline import DeadlineExceeded, current_deadline
+from memory import estimate_tokens
+from metrics import current_metrics, current_stage
+
+# ค่าเริ่มต้นของ scheduler (ปรับได้ผ่าน environment variables, 0 = ไม่จำกัด)
+LLM_RPM = float(os.getenv("LLM_RPM", 0))                                  # จำนวน request ต่อนาทีต่อ API key
+LLM_TPM = float(os.getenv("LLM_TPM", 0))                                  # จำนวน token (prompt โดยประมาณ) ต่อนาทีต่อ API key
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", 10))             # ขนาดของ bucket เทียบเป็นวินาทีของอัตราที่กำหนด
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", 3))      # จำนวนครั้งที่ลองใหม่เมื่อได้รับ 429
+LLM_DEFAULT_RETRY_AFTER = float(os.getenv("LLM_DEFAULT_RETRY_AFTER", 2))  # เวลารอ (วินาที) เมื่อ 429 ไม่มี Retry-After
+
+DEFAULT_SESSION = "default"
+
+_DEADLINE_POLL_SECONDS = 0.1
+
+_current_session: ContextVar[str] = ContextVar("current_llm_session", default=DEFAULT_SESSION)
+
+
+@contextlib.contextmanager
+def session_scope(session_id: str):
+    """
+    context manager สำหรับกำหนด session ของการเรียก LLM ที่เกิดขึ้นภายใน (ใช้จัดคิวแบบยุติธรรม)
+    """
+    token = _current_session.set(session_id or DEFAULT_SESSION)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+class TokenBucket:
+    """
+    token bucket แบบเติมต่อเนื่อง (rate_per_minute = 0 หมายถึงไม่จำกัด)
+    ต้องเรียกภายใต้ lock ของ KeyLimiter
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = LLM_BURST_SECONDS):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds) if self.rate else 0.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        คืนค่าเวลา (วินาที) ที่ต้องรอจนกว่าจะมี token เพียงพอ (0 หากใช้ได้ทันที)
+        """
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    # request หนึ่งรายการที่รอสิทธิ์ (ปลดล็อกได้ทั้ง thread ที่รอแบบ sync และ task ที่รอแบบ async)
+    __slots__ = ("session", "tokens", "event", "future", "loop")
+
+    def __init__(self, session: str, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.session = session
+        self.tokens = tokens
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+
+    def grant(self) -> None:
+        self.event.set()
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class KeyLimiter:
+    """
+    ตัวจำกัดอัตราของ API key หนึ่ง พร้อมคิวแยกตาม session ที่ถูกปล่อยแบบ round-robin
+    """
+
+    def __init__(self, name: str, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, waiter: _Waiter, front: bool = False) -> None:
+        with self._lock:
+            queue = self._queues.setdefault(waiter.session, deque())
+            queue.appendleft(waiter) if front else queue.append(waiter)
+            self._dispatch()
+
+    def cancel(self, waiter: _Waiter) -> None:
+        with self._lock:
+            queue = self._queues.get(waiter.session)
+            if queue and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[waiter.session]
+
+    def penalize(self, retry_after: float) -> None:
+        """
+        หยุดปล่อย request ของ key นี้เป็นเวลา retry_after วินาที (เมื่อ provider ตอบ 429)
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            logging.error(f"Rate limited by provider for key {self.name}, pausing {retry_after:.1f}s")
+
+    def _dispatch(self) -> None:
+        # ต้องเรียกภายใต้ self._lock: ปล่อย request ตามลำดับ round-robin ของ session จนกว่าสิทธิ์จะหมด
+        while self._queues:
+            session, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            now = time.monotonic()
+            wait = max(self.blocked_until - now,
+                       self.requests.wait_time(1, now),
+                       self.tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._schedule(wait)
+                return
+            self.requests.consume(1)
+            self.tokens.consume(waiter.tokens)
+            queue.popleft()
+            # ย้าย session ไปท้ายคิว เพื่อให้ session อื่นได้สิทธิ์ในรอบถัดไป
+            del self._queues[session]
+            if queue:
+                self._queues[session] = queue
+            waiter.grant()
+
+    def _schedule(self, wait: float) -> None:
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(wait, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+
+class LLMScheduler:
+    """
+    scheduler กลางของ process ที่เก็บ KeyLimiter แยกตาม API key
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, KeyLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, key: str) -> KeyLimiter:
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = KeyLimiter(key)
+            return limiter
+
+    def acquire(self, key: str, tokens: int, front: bool = False) -> float:
+        """
+        รอจนกว่าจะได้รับสิทธิ์ส่ง request (แบบ sync)
+        Returns:
+            เวลาที่รอในคิว (วินาที)
+        """
+        started = time.perf_counter()
+        deadline = current_deadline()
+        waiter = _Waiter(_current_session.get(), tokens)
+        limiter = self.limiter(key)
+        limiter.submit(waiter, front=front)
+        # รอเป็นช่วงสั้น ๆ เพื่อตรวจสอบ deadline (ทั้งการหมดเวลาและการยกเลิกโดยผู้ใช้)
+        while not waiter.event.wait(_DEADLINE_POLL_SECONDS if deadline else None):
+            if deadline.expired():
+                limiter.cancel(waiter)
+                raise DeadlineExceeded()
+        return self._record_wait(time.perf_counter() - started)
+
+    async def aacquire(self, key: str, tokens: int, front: bool = False) -> float:
+        """
+        รอจนกว่าจะได้รับสิทธิ์ส่ง request (แบบ async)
+        Returns:
+            เวลาที่รอในคิว (วินาที)
+        """
+        started = time.perf_counter()
+        waiter = _Waiter(_current_session.get(), tokens, loop=asyncio.get_running_loop())
+        limiter = self.limiter(key)
+        limiter.submit(waiter, front=front)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            limiter.cancel(waiter)
+            raise
+        return self._record_wait(time.perf_counter() - started)
+
+    def _record_wait(self, seconds: float) -> float:
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.record_queue_wait(current_stage(), seconds)
+        return seconds
+
+
+SCHEDULER = LLMScheduler()
+
+
+def _request_key(request: httpx.Request) -> str:
+    # ใช้ hash ของ API key เป็นชื่อของ limiter (ไม่เก็บ key จริงไว้ใน log)
+    authorization = request.headers.get("authorization", "")
+    return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:12]
+
+
+def _request_tokens(request: httpx.Request) -> int:
+    # ประมาณจำนวน prompt token จาก body ของ request (chat completions)
+    try:
+        body = json.loads(request.content or b"{}")
+    except (httpx.RequestNotRead, ValueError):
+        return 0
+    messages = body.get("messages") or []
+    return sum(estimate_tokens(str(message.get("content") or "")) + 4 for message in messages if isinstance(message, dict))
+
+
+def _retry_after(response: httpx.Response) -> float:
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return LLM_DEFAULT_RETRY_AFTER
+
+
+def _apply_deadline(request: httpx.Request) -> None:
+    # จำกัด timeout ของ request ไม่ให้เกินเวลาที่เหลือของ deadline
+    deadline = current_deadline()
+    if deadline is None:
+        return
+    deadline.check()
+    remaining = deadline.remaining()
+    timeouts = request.extensions.get("timeout") or {}
+    request.extensions["timeout"] = {
+        name: min(value, remaining) if value is not None else remaining
+        for name, value in {**dict.fromkeys(("connect", "read", "write", "pool")), **timeouts}.items()
+    }
+
+
+def _timed_out(exc: httpx.TimeoutException) -> BaseException:
+    # แปลง timeout ที่เกิดจาก deadline เป็น DeadlineExceeded (timeout ปกติของ transport จะถูกส่งต่อตามเดิม)
+    deadline = current_deadline()
+    return DeadlineExceeded() if deadline is not None and deadline.expired() else exc
+
+
+def _record_rate_limited() -> None:
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.record_rate_limited(current_stage())
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    transport ของ httpx ที่ขอสิทธิ์จาก SCHEDULER ก่อนส่งทุก request และรอตาม Retry-After เมื่อได้รับ 429
+    """
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key, tokens = _request_key(request), _request_tokens(request)
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            # request ที่ถูกปฏิเสธด้วย 429 จะกลับเข้าคิวที่ตำแหน่งแรกของ session
+            SCHEDULER.acquire(key, tokens, front=attempt > 0)
+            _apply_deadline(request)
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TimeoutException as e:
+                raise _timed_out(e)
+            if response.status_code != 429 or attempt == LLM_RATE_LIMIT_RETRIES:
+                return response
+            _record_rate_limited()
+            response.close()
+            SCHEDULER.limiter(key).penalize(_retry_after(response))
+        return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    RateLimitedTransport แบบ async
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key, tokens = _request_key(request), _request_tokens(request)
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            await SCHEDULER.aacquire(key, tokens, front=attempt > 0)
+            _apply_deadline(request)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TimeoutException as e:
+                raise _timed_out(e)
+            if response.status_code != 429 or attempt == LLM_RATE_LIMIT_RETRIES:
+                return response
+            _record_rate_limited()
+            await response.aclose()
+            SCHEDULER.limiter(key).penalize(_retry_after(response))
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
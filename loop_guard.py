@@ -0,0 +1,229 @@
+# -----------------------------------------------------------------------
+# การตรวจจับการเรียก tool ซ้ำและวงวนที่ไม่คืบหน้าของ ReAct supervisor
+# LoopGuard เก็บ fingerprint ของ (tool, Action Input) และ observation ของแต่ละ step
+# เมื่อ supervisor เรียก tool เดิมด้วย input เดิม (ต่างกันเฉพาะตัวพิมพ์ เว้นวรรค หรือเครื่องหมายวรรคตอน)
+# จะคืน observation เดิมทันทีโดยไม่รัน agent ย่อยซ้ำ ส่วน input ที่เกือบเหมือนเดิม (เช่น เปลี่ยนเฉพาะปี) จะรัน tool ตามปกติ
+# step ที่ได้ observation ซ้ำกับที่เคยได้รับแล้วนับเป็น step ที่ไม่คืบหน้า (input ที่เกือบเหมือนเดิมแต่ได้ผลใหม่ถือว่าคืบหน้า)
+# และเมื่อไม่มีความคืบหน้าติดต่อกันหลาย step จะบังคับให้จบด้วย Final Answer จากผลลัพธ์ที่มีอยู่แล้ว
+# -----------------------------------------------------------------------
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from contextvars import ContextVar
+from typing import Any, List, Optional, Tuple, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+
+from agent_trace import TraceCallbackHandler, TRACE_MAX_CHARS
+
+# ค่าเริ่มต้นของ loop guard (ปรับได้ผ่าน environment variables)
+LOOP_GUARD_ENABLED = os.getenv("LOOP_GUARD_ENABLED", "true").lower() == "true"      # เปิดใช้งาน
+LOOP_NO_PROGRESS_STEPS = int(os.getenv("LOOP_NO_PROGRESS_STEPS", 2))                # จำนวน step ที่ไม่คืบหน้าติดต่อกันก่อนบังคับจบ
+
+_current_guard: ContextVar[Optional["LoopGuard"]] = ContextVar("current_loop_guard", default=None)
+
+# ข้อความที่แนบไปกับ observation เดิมเพื่อบอก supervisor ว่าไม่ต้องเรียก tool ซ้ำ
+_REPEAT_NOTE = (
+    "[Repeated call] `{tool}` was already called with this input. "
+    "The previous result is shown below; do not call it again. "
+    "Use the results you already have and reply with 'Final Answer:'.\n"
+)
+
+
+def _normalize(text: Any) -> str:
+    # แปลงเป็นตัวพิมพ์เล็ก ตัดเครื่องหมายคำพูดและรวม whitespace เพื่อให้ input ที่ต่างกันเล็กน้อยเทียบกันได้
+    text = text if isinstance(text, str) else json.dumps(text, sort_keys=True, ensure_ascii=False, default=str)
+    text = re.sub(r"[\"'`]", "", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _input_key(text: str) -> str:
+    # key ของ Action Input ที่ normalize แล้วสำหรับใช้ observation เดิม: ตัด whitespace และเครื่องหมายวรรคตอนทั้งหมด
+    # (ตัวอักษร ตัวเลข และสัญลักษณ์ เช่น < > + ยังคงอยู่ input ที่ต่างกันแม้เพียงตัวเดียวจึงไม่ถูกนับว่าซ้ำ)
+    return "".join(ch for ch in text if not (ch.isspace() or unicodedata.category(ch).startswith("P")))
+
+
+def normalized_input(tool_input: Any) -> str:
+    """
+    คืนค่า key ของ Action Input สำหรับเทียบว่าเป็น input เดียวกันหรือไม่
+    (ไม่สนใจตัวพิมพ์ เครื่องหมายคำพูด whitespace และเครื่องหมายวรรคตอน)
+    """
+    return _input_key(_normalize(tool_input))
+
+
+def _fingerprint(observation: Any) -> str:
+    return hashlib.sha1(_normalize(observation).encode("utf-8")).hexdigest()
+
+
+def _observation_text(observation: Any) -> str:
+    # ดึงข้อความคำตอบจาก observation ของ tool (dict หรือ JSON string) สำหรับใช้เป็น Final Answer
+    if isinstance(observation, str):
+        try:
+            observation = json.loads(observation)
+        except json.JSONDecodeError:
+            return observation.strip()
+    if isinstance(observation, dict):
+        for key in ("explanation", "text", "response", "error"):
+            value = observation.get(key)
+            if isinstance(value, dict) or (key == "response" and isinstance(value, str) and value):
+                return _observation_text(value)
+            if isinstance(value, str) and value:
+                return value
+    return str(observation)
+
+
+class LoopGuard:
+    """
+    คลาสสำหรับติดตามการเรียก tool ของ supervisor ภายในหนึ่ง request
+    - lookup(): คืน observation เดิมเมื่อ tool และ Action Input ตรงกับการเรียกก่อนหน้า (ต่างกันเฉพาะเว้นวรรคหรือเครื่องหมายวรรคตอน)
+    - should_stop(): True เมื่อไม่มีความคืบหน้า (observation ซ้ำกับที่เคยได้รับแล้ว หรือใช้ผลเดิม)
+      ติดต่อกัน LOOP_NO_PROGRESS_STEPS step
+    - iterations_saved: จำนวน iteration ที่ไม่ต้องรัน (tool ที่ใช้ผลเดิม และรอบของ supervisor ที่ถูกข้ามเมื่อบังคับจบ)
+    """
+
+    def __init__(self, trace: Optional[TraceCallbackHandler] = None,
+                 no_progress_steps: int = LOOP_NO_PROGRESS_STEPS):
+        """
+        ตัวสร้างสำหรับ LoopGuard
+        Parameters:
+            trace (TraceCallbackHandler): trace ของ request (ใช้บันทึก observation ที่ใช้ผลเดิม)
+            no_progress_steps (int): จำนวน step ที่ไม่คืบหน้าติดต่อกันก่อนบังคับจบ
+        """
+        self.trace = trace
+        self.no_progress_steps = no_progress_steps
+        self.iterations_saved = 0
+        self.forced = False
+        self._calls: List[Tuple[str, str, str, Any]] = []     # (tool, input ที่ normalize แล้ว, key ของ input, observation)
+        self._fingerprints: set = set()
+        self._cached_actions: set = set()
+        self._no_progress = 0
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        context manager สำหรับกำหนดให้ guard นี้เป็น guard ของ request ปัจจุบัน (ดู LoopGuardedAgentExecutor)
+        """
+        token = _current_guard.set(self)
+        try:
+            yield self
+        finally:
+            _current_guard.reset(token)
+
+    def lookup(self, action: AgentAction) -> Optional[Any]:
+        """
+        คืนค่า observation ของการเรียกก่อนหน้าที่ใช้ tool เดียวกันและ Action Input เดียวกัน (หรือ None)
+        (input ที่เกือบเหมือนเดิม เช่น "plot revenue for 2023" กับ "... 2024" ถือเป็นคำขอใหม่)
+        """
+        key = normalized_input(action.tool_input)
+        for tool, _, previous_key, observation in self._calls:
+            if tool == action.tool and key == previous_key:
+                return observation
+        return None
+
+    def record(self, action: AgentAction, observation: Any) -> None:
+        """
+        บันทึกผลการเรียก tool และนับ step ที่ไม่คืบหน้า (observation ซ้ำกับที่เคยได้รับแล้ว)
+        Action Input ที่เกือบเหมือนการเรียกก่อนหน้าไม่นับเป็น step ที่ไม่คืบหน้าหากได้ observation ใหม่
+        (เช่น "plot revenue for 2023", "... 2024", "... 2025" ได้กราฟใหม่ทุกครั้ง)
+        """
+        fingerprint = _fingerprint(observation)
+        tool_input = _normalize(action.tool_input)
+        if fingerprint in self._fingerprints:
+            self._no_progress += 1
+        else:
+            self._no_progress = 0
+        self._fingerprints.add(fingerprint)
+        self._calls.append((action.tool, tool_input, _input_key(tool_input), observation))
+
+    def cached_step(self, action: AgentAction, observation: Any) -> AgentStep:
+        """
+        สร้าง AgentStep จาก observation เดิมแทนการรัน tool ซ้ำ
+        """
+        self.iterations_saved += 1
+        self._no_progress += 1
+        self._cached_actions.add(id(action))
+        logging.info(f"Loop guard: reused observation of repeated call to {action.tool}")
+        if self.trace is not None:
+            self.trace.record("observation", f"[cached] {str(observation)[:TRACE_MAX_CHARS]}", tool=action.tool)
+        return AgentStep(action=action, observation=_REPEAT_NOTE.format(tool=action.tool) + str(observation))
+
+    def should_stop(self) -> bool:
+        return bool(self._calls) and self._no_progress >= self.no_progress_steps
+
+    def final_answer(self) -> AgentFinish:
+        """
+        สร้าง Final Answer จาก observation ล่าสุดที่ได้จาก tool (ใช้เมื่อ should_stop() เป็น True)
+        """
+        self.forced = True
+        self.iterations_saved += 1
+        logging.info(f"Loop guard: no progress after {self._no_progress} steps, forcing final answer")
+        output = _observation_text(self._calls[-1][3]) if self._calls else ""
+        return AgentFinish(return_values={"output": output},
+                           log=f"Loop guard: no progress after {self._no_progress} repeated steps.")
+
+    def filter_steps(self, intermediate_steps: List[Tuple[AgentAction, Any]]) -> List[Tuple[AgentAction, Any]]:
+        """
+        คืนค่าเฉพาะ step ที่รัน tool จริง (ตัด step ที่ใช้ observation เดิมออก เพื่อไม่ให้ผลลัพธ์ถูกประมวลผลซ้ำ)
+        """
+        return [step for step in intermediate_steps if id(step[0]) not in self._cached_actions]
+
+
+def current_loop_guard() -> Optional[LoopGuard]:
+    """
+    คืนค่า LoopGuard ของ request ที่กำลังประมวลผลใน context ปัจจุบัน (ถ้ามี)
+    """
+    return _current_guard.get()
+
+
+class LoopGuardedAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor ที่ตรวจสอบการเรียก tool ซ้ำผ่าน LoopGuard ของ request ปัจจุบัน
+    (ทำงานเหมือน AgentExecutor ปกติเมื่อไม่มี guard ที่ active อยู่)
+    """
+
+    def _take_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                        run_manager=None) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        guard = current_loop_guard()
+        if guard is not None and guard.should_stop():
+            return guard.final_answer()
+        return super()._take_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+
+    async def _atake_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                               run_manager=None) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        guard = current_loop_guard()
+        if guard is not None and guard.should_stop():
+            return guard.final_answer()
+        return await super()._atake_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action: AgentAction,
+                              run_manager=None) -> AgentStep:
+        guard = current_loop_guard()
+        if guard is None or agent_action.tool not in name_to_tool_map:
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        cached = guard.lookup(agent_action)
+        if cached is not None:
+            if run_manager:
+                run_manager.on_agent_action(agent_action, color="green")
+            return guard.cached_step(agent_action, cached)
+        step = super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        guard.record(agent_action, step.observation)
+        return step
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action: AgentAction,
+                                     run_manager=None) -> AgentStep:
+        guard = current_loop_guard()
+        if guard is None or agent_action.tool not in name_to_tool_map:
+            return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        cached = guard.lookup(agent_action)
+        if cached is not None:
+            if run_manager:
+                await run_manager.on_agent_action(agent_action, verbose=self.verbose, color="green")
+            return guard.cached_step(agent_action, cached)
+        step = await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        guard.record(agent_action, step.observation)
+        return step
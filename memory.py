@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------
+# memory ของการสนทนาแบบจำกัดจำนวน token สำหรับ SupervisorAgent
+# เก็บบทสนทนารอบล่าสุดแบบเต็ม และรวบบทสนทนาที่เก่ากว่าเป็นสรุปแบบต่อเนื่อง (rolling summary)
+# เมื่อประวัติเกินงบประมาณ token ที่กำหนด พร้อมตัดโค้ดและข้อความขนาดใหญ่ออกก่อนบันทึก
+# -----------------------------------------------------------------------
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, List
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import Callbacks
+from langchain_core.messages import BaseMessage
+
+from metrics import track_stage
+
+# ค่าเริ่มต้นของ memory (ปรับได้ผ่าน environment variables)
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 1500))          # จำนวน token สูงสุดของบทสนทนาที่เก็บแบบเต็ม
+MEMORY_MAX_MESSAGE_CHARS = int(os.getenv("MEMORY_MAX_MESSAGE_CHARS", 1500))  # จำนวนตัวอักษรสูงสุดของข้อความหนึ่งข้อความใน memory
+
+_CODE_BLOCK_PATTERN = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    ประมาณจำนวน token ของข้อความโดยไม่ต้องเรียกใช้ tokenizer ของโมเดล
+    (ChatOpenAI นับ token ได้เฉพาะโมเดลของ OpenAI) โดยนับตัวอักษร ASCII ประมาณ 4 ตัวต่อ token
+    และตัวอักษรอื่น (เช่น ภาษาไทย) ประมาณ 2 ตัวต่อ token ซึ่งเป็นค่าที่ค่อนข้างสูงกว่าจริงเล็กน้อย
+    Parameters:
+        text (str): ข้อความที่ต้องการประมาณจำนวน token
+    Returns:
+        จำนวน token โดยประมาณ
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + math.ceil((len(text) - ascii_chars) / 2)
+
+
+def estimate_message_tokens(messages: List[BaseMessage]) -> int:
+    """
+    ประมาณจำนวน token ของรายการข้อความ (รวม overhead ของ role ข้อความละประมาณ 4 token)
+    """
+    return sum(estimate_tokens(str(message.content)) + 4 for message in messages)
+
+
+def compact_text(text: str, max_chars: int = MEMORY_MAX_MESSAGE_CHARS) -> str:
+    """
+    ตัดโค้ดและส่วนที่ยาวเกินไปออกจากข้อความก่อนบันทึกลง memory
+    Parameters:
+        text (str): ข้อความที่ต้องการย่อ
+        max_chars (int): จำนวนตัวอักษรสูงสุดที่เก็บไว้
+    Returns:
+        ข้อความที่ถูกย่อแล้ว
+    """
+    text = _CODE_BLOCK_PATTERN.sub("[code omitted]", str(text)).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + f" ... [{len(text) - max_chars:,} characters omitted]"
+    return text
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """
+    memory ของการสนทนาที่จำกัดจำนวน token ของประวัติที่ส่งให้ supervisor
+    - บทสนทนารอบล่าสุดจะถูกเก็บแบบเต็มจนถึง max_token_limit
+    - บทสนทนาที่เก่ากว่าจะถูกรวบเป็นสรุปโดย LLM (ครั้งละหนึ่งรอบถาม-ตอบ)
+    - โค้ดและข้อความที่ยาวเกิน MEMORY_MAX_MESSAGE_CHARS จะถูกตัดออกก่อนบันทึก
+    """
+
+    max_message_chars: int = MEMORY_MAX_MESSAGE_CHARS
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+        super().save_context(self._compact(inputs), self._compact(outputs))
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+        await super().asave_context(self._compact(inputs), self._compact(outputs))
+
+    def _compact(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: compact_text(value, self.max_message_chars) if isinstance(value, str) else value
+                for key, value in values.items()}
+
+    def _pop_oldest_turns(self) -> List[BaseMessage]:
+        # ตัดบทสนทนาที่เก่าที่สุดออกทีละรอบ (ข้อความของผู้ใช้และคำตอบ) จนกว่าจะไม่เกินงบประมาณ
+        buffer = self.chat_memory.messages
+        pruned: List[BaseMessage] = []
+        while buffer and estimate_message_tokens(buffer) > self.max_token_limit:
+            pruned.extend(buffer[:2])
+            del buffer[:2]
+        return pruned
+
+    def prune(self) -> None:
+        pruned = self._pop_oldest_turns()
+        if pruned:
+            with track_stage("memory_summary"):
+                try:
+                    self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+                except Exception as e:
+                    # หากสรุปไม่สำเร็จ ให้เก็บสรุปเดิมไว้ (บทสนทนาที่ถูกตัดออกจะหายไป แต่ประวัติยังไม่เกินงบประมาณ)
+                    logging.error(f"Error summarizing conversation memory: {e}")
+
+    async def aprune(self) -> None:
+        pruned = self._pop_oldest_turns()
+        if pruned:
+            with track_stage("memory_summary"):
+                try:
+                    self.moving_summary_buffer = await self.apredict_new_summary(pruned, self.moving_summary_buffer)
+                except Exception as e:
+                    logging.error(f"Error summarizing conversation memory: {e}")
+
+    def history_tokens(self) -> int:
+        """
+        คืนค่าจำนวน token โดยประมาณของประวัติการสนทนา (สรุป + บทสนทนาล่าสุด) ที่จะถูกส่งให้ supervisor
+        """
+        history = self.load_memory_variables({})[self.memory_key]
+        if isinstance(history, str):
+            return estimate_tokens(history)
+        return estimate_message_tokens(history)
+
+
+# resolve forward reference ของ field ใน llm (BaseCache, Callbacks) สำหรับ subclass ของ pydantic model
+TokenBudgetMemory.model_rebuild()
@@ -0,0 +1,379 @@
+# -----------------------------------------------------------------------
+# การวัด latency แยกตามขั้นตอน (stage) ของ SupervisorAgent.run
+# เก็บเวลาของแต่ละ stage, เวลาและจำนวน token ของการเรียก LLM แต่ละครั้ง (ผ่าน callback)
+# และจำนวน iteration ของ agent พร้อมบันทึกลงไฟล์ log เพื่อนำไปคำนวณ percentile
+# -----------------------------------------------------------------------
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from pydantic import BaseModel
+
+# เส้นทางของไฟล์ log สำหรับเก็บ metrics ของแต่ละ request (หนึ่ง JSON ต่อหนึ่งบรรทัด)
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", os.path.join("logs", "metrics.jsonl"))
+
+# ชื่อ stage ที่ใช้เมื่อไม่มี stage อื่นครอบอยู่ (เช่น การเรียก LLM ของ supervisor)
+ROOT_STAGE = "supervisor"
+
+# run และ stage ปัจจุบันของ context (แยกตาม thread และ asyncio task)
+_current_run: ContextVar[Optional["RunMetrics"]] = ContextVar("current_run_metrics", default=None)
+_current_stage: ContextVar[Optional["_StageFrame"]] = ContextVar("current_metrics_stage", default=None)
+
+
+class _StageFrame:
+    # stage ที่กำลังทำงานอยู่ เก็บเวลารวมของ stage ย่อยไว้สำหรับคำนวณ self_seconds
+    __slots__ = ("name", "child_seconds")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.child_seconds = 0.0
+
+
+class StageLatency(BaseModel):
+    """
+    โมเดลสำหรับเก็บ latency ของแต่ละ stage
+    Attributes:
+        seconds (float): เวลารวมทั้งหมดของ stage (รวม stage ย่อยที่อยู่ภายใน)
+        self_seconds (float): เวลาของ stage โดยไม่รวม stage ย่อย
+        calls (int): จำนวนครั้งที่ stage ถูกเรียก
+        llm_calls (int): จำนวนครั้งที่เรียก LLM ภายใน stage
+        llm_seconds (float): เวลารวมที่รอ LLM ภายใน stage
+        prompt_tokens (int): จำนวน prompt token รวม
+        completion_tokens (int): จำนวน completion token รวม
+        iterations (int): จำนวน iteration (agent action) ของ agent ภายใน stage
+        ttft_seconds (float): เวลารวมตั้งแต่เรียก LLM จนได้รับ token แรก (เฉพาะการเรียกแบบ streaming)
+        streamed_calls (int): จำนวนการเรียก LLM แบบ streaming ภายใน stage
+        queue_seconds (float): เวลารวมที่ request ไปยัง LLM รอสิทธิ์ใน scheduler (rate limit)
+        rate_limited (int): จำนวนครั้งที่ provider ตอบ 429 ภายใน stage
+    """
+    seconds: float = 0.0
+    self_seconds: float = 0.0
+    calls: int = 0
+    llm_calls: int = 0
+    llm_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    iterations: int = 0
+    ttft_seconds: float = 0.0
+    streamed_calls: int = 0
+    queue_seconds: float = 0.0
+    rate_limited: int = 0
+
+
+class RunMetrics:
+    """
+    คลาสสำหรับเก็บ metrics ของการประมวลผลหนึ่ง request
+    ใช้ร่วมกับ track_stage() และ MetricsCallbackHandler
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, StageLatency] = {}
+        self.first_token_at: Optional[float] = None
+        self._active: List[str] = []
+        self.http_requests = 0
+        self.http_new_connections = 0
+        self.callback = MetricsCallbackHandler(self)
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> StageLatency:
+        # ต้องเรียกภายใต้ self._lock
+        return self.stages.setdefault(name, StageLatency())
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        context manager สำหรับกำหนดให้ metrics นี้เป็น run ปัจจุบันของ context
+        """
+        token = _current_run.set(self)
+        try:
+            yield self
+        finally:
+            _current_run.reset(token)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        context manager สำหรับจับเวลาของ stage ที่ระบุ (stage ซ้อนกันได้)
+        """
+        parent = _current_stage.get()
+        frame = _StageFrame(name)
+        token = _current_stage.set(frame)
+        started = time.perf_counter()
+        with self._lock:
+            self._active.append(name)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_stage.reset(token)
+            with self._lock:
+                self._active.remove(name)
+                stats = self._get(name)
+                stats.seconds += elapsed
+                stats.self_seconds += max(elapsed - frame.child_seconds, 0.0)
+                stats.calls += 1
+                if parent is not None:
+                    parent.child_seconds += elapsed
+
+    def active_stages(self) -> List[str]:
+        """
+        คืนค่ารายชื่อ stage ที่กำลังทำงานอยู่ (stage ที่ซ้อนอยู่ด้านในสุดอยู่ท้ายรายการ, ไม่ซ้ำกัน)
+        """
+        with self._lock:
+            return list(dict.fromkeys(self._active))
+
+    def record_llm(self, stage: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            stats = self._get(stage)
+            stats.llm_calls += 1
+            stats.llm_seconds += seconds
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+    def record_first_token(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._get(stage)
+            stats.ttft_seconds += seconds
+            stats.streamed_calls += 1
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+
+    def record_queue_wait(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._get(stage).queue_seconds += seconds
+
+    def record_rate_limited(self, stage: str) -> None:
+        with self._lock:
+            self._get(stage).rate_limited += 1
+
+    def queue_seconds(self) -> float:
+        """
+        เวลารวมที่ request ไปยัง LLM ทั้งหมดของ run นี้รอสิทธิ์ใน scheduler
+        """
+        with self._lock:
+            return sum(stats.queue_seconds for stats in self.stages.values())
+
+    def record_http(self, new_connection: bool) -> None:
+        # new_connection=False สำหรับ request ใหม่ และ True เมื่อ request นั้นต้องเปิด connection ใหม่
+        with self._lock:
+            if new_connection:
+                self.http_new_connections += 1
+            else:
+                self.http_requests += 1
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        คืนค่าจำนวน HTTP request ไปยัง LLM, จำนวน connection ที่เปิดใหม่ และจำนวนที่ใช้ connection เดิมซ้ำ
+        """
+        with self._lock:
+            return {
+                "requests": self.http_requests,
+                "new_connections": self.http_new_connections,
+                "reused": max(self.http_requests - self.http_new_connections, 0),
+            }
+
+    def ttft_seconds(self) -> Optional[float]:
+        """
+        เวลาตั้งแต่เริ่ม request จนได้รับ token แรกจาก LLM ใด ๆ (time-to-first-token ที่ผู้ใช้เห็น)
+        หรือ None หากไม่มีการเรียก LLM แบบ streaming
+        """
+        return None if self.first_token_at is None else self.first_token_at - self.started
+
+    def record_iteration(self, stage: str) -> None:
+        with self._lock:
+            self._get(stage).iterations += 1
+
+    def total_seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> Dict[str, StageLatency]:
+        """
+        คืนค่าสำเนาของ latency แยกตาม stage (ปัดทศนิยมเพื่อให้อ่านง่าย)
+        """
+        with self._lock:
+            return {
+                name: stats.model_copy(update={
+                    "seconds": round(stats.seconds, 4),
+                    "self_seconds": round(stats.self_seconds, 4),
+                    "llm_seconds": round(stats.llm_seconds, 4),
+                    "ttft_seconds": round(stats.ttft_seconds, 4),
+                    "queue_seconds": round(stats.queue_seconds, 4),
+                })
+                for name, stats in self.stages.items()
+            }
+
+
+def current_metrics() -> Optional[RunMetrics]:
+    """
+    คืนค่า RunMetrics ของ request ที่กำลังประมวลผลใน context ปัจจุบัน (ถ้ามี)
+    """
+    return _current_run.get()
+
+
+def current_stage() -> str:
+    """
+    คืนค่าชื่อ stage ที่กำลังทำงานอยู่ใน context ปัจจุบัน (ROOT_STAGE หากไม่มี)
+    """
+    frame = _current_stage.get()
+    return frame.name if frame else ROOT_STAGE
+
+
+def metrics_callbacks() -> List[BaseCallbackHandler]:
+    """
+    คืนค่ารายการ callback สำหรับส่งให้ LLM/agent เพื่อเก็บ metrics ของ run ปัจจุบัน
+    """
+    metrics = current_metrics()
+    return [metrics.callback] if metrics else []
+
+
+@contextlib.contextmanager
+def track_stage(name: str):
+    """
+    จับเวลาของ stage ใน run ปัจจุบัน หากไม่มี run ที่ active อยู่จะไม่ทำอะไร
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    callback สำหรับวัด latency, เวลาจนถึง token แรก (กรณี streaming) และจำนวน token ของการเรียก LLM แต่ละครั้ง
+    และนับจำนวน iteration ของ agent โดยจัดกลุ่มตาม stage ที่การเรียกนั้นเกิดขึ้น
+    """
+
+    # รัน callback ใน task ที่เรียกโดยตรงเมื่อใช้กับ async agent (ไม่ส่งไป thread pool)
+    # เพื่อให้อ่าน stage ปัจจุบันจาก ContextVar ได้ถูกต้องและลำดับของ event ไม่สลับกัน
+    run_inline = True
+
+    def __init__(self, metrics: RunMetrics):
+        self.metrics = metrics
+        self._llm_runs: Dict[UUID, tuple] = {}
+        self._first_tokens: set = set()
+
+    def _start(self, run_id: UUID) -> None:
+        self._llm_runs[run_id] = (current_stage(), time.perf_counter())
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_runs.get(run_id)
+        if started is None or run_id in self._first_tokens:
+            return
+        self._first_tokens.add(run_id)
+        self.metrics.record_first_token(started[0], time.perf_counter() - started[1])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._first_tokens.discard(run_id)
+        started = self._llm_runs.pop(run_id, None)
+        if started is None:
+            return
+        stage, started_at = started
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self.metrics.record_llm(stage, time.perf_counter() - started_at, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._first_tokens.discard(run_id)
+        started = self._llm_runs.pop(run_id, None)
+        if started is not None:
+            stage, started_at = started
+            self.metrics.record_llm(stage, time.perf_counter() - started_at)
+
+    def on_agent_action(self, action: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.metrics.record_iteration(current_stage())
+
+
+def _token_usage(response: LLMResult) -> tuple:
+    # ดึงจำนวน token จาก llm_output (OpenAI) หรือ usage_metadata ของข้อความ (กรณี streaming)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    if not prompt_tokens and not completion_tokens:
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+# -----------------------------------------------------------------------
+# การบันทึกและสรุป metrics log
+# -----------------------------------------------------------------------
+_log_lock = threading.Lock()
+
+
+def append_metrics_log(record: Dict[str, Any], path: Optional[str] = None) -> None:
+    """
+    เพิ่ม metrics ของหนึ่ง request ลงในไฟล์ log (JSON lines)
+    """
+    path = path or METRICS_LOG_PATH
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logging.error(f"Error writing metrics log: {e}")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize_metrics_log(path: Optional[str] = None, percentiles=(50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """
+    อ่านไฟล์ metrics log แล้วคำนวณ percentile ของเวลาแต่ละ stage, เวลารวม และ time-to-first-token
+    Returns:
+        dict ที่มี key เป็นชื่อ stage (และ "total", "ttft") และ value เป็น dict ของ count และ p50/p90/p99
+    """
+    path = path or METRICS_LOG_PATH
+    samples: Dict[str, List[float]] = {}
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("total_seconds") is not None:
+                samples.setdefault("total", []).append(record["total_seconds"])
+            if record.get("ttft_seconds") is not None:
+                samples.setdefault("ttft", []).append(record["ttft_seconds"])
+            for name, stats in (record.get("latency") or {}).items():
+                samples.setdefault(name, []).append(stats.get("seconds", 0.0))
+    return {
+        name: {"count": len(values), **{f"p{p}": round(_percentile(values, p), 4) for p in percentiles}}
+        for name, values in samples.items()
+    }
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน: python metrics.py [path/to/metrics.jsonl]
+    summary = summarize_metrics_log(sys.argv[1] if len(sys.argv) > 1 else None)
+    for name, stats in sorted(summary.items()):
+        print(f"{name:<20} " + "  ".join(f"{key}={value}" for key, value in stats.items()))
@@ -14,7 +14,15 @@ from datahandle import DataHandler
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 import json  
-from prompt import get_prefix, get_suffix
+from typing import Optional
+import ast
+from prompt import get_prefix, get_suffix, get_single_shot_prompt
+from agent_trace import AGENT_VERBOSE
+from llm_factory import create_chat_llm
+from metrics import track_stage
+from figure_manager import FigureCapture
+from stdout_capture import BoundedOutput, capture_stdout
+from deadline import exec_watchdog
 
 # โหลด environment variables จากไฟล์ .env 
 load_dotenv()
@@ -22,6 +30,11 @@ load_dotenv()
 # ปิดการติดตามข้อมูลของ LangSmith โดยตั้งค่า environment variable ให้เป็น "false"
 os.environ["LANGCHAIN_TRACING_V2"] = "false"
 
+# โหมด single-shot: สร้างโค้ดด้วยการเรียก LLM ครั้งเดียวจาก profile ของข้อมูล แล้วตรวจสอบโค้ดในเครื่อง
+# หากไม่ผ่านการตรวจสอบจะกลับไปใช้ agent แบบหลายรอบตามเดิม
+PANDAS_SINGLE_SHOT = os.getenv("PANDAS_SINGLE_SHOT", "true").lower() == "true"
+PANDAS_DRY_RUN_ROWS = int(os.getenv("PANDAS_DRY_RUN_ROWS", 200))  # จำนวนแถวตัวอย่างที่ใช้ทดลองรันโค้ด
+
 
 # =======================================================================
 # กำหนดโมเดล Pydantic สำหรับโครงสร้างของ output ที่ agent จะส่งกลับมา
@@ -81,7 +94,7 @@ class PandasAgent:
         if not self.api_key:
             raise ValueError("API key is missing. Ensure 'PANDAS_API_KEY' is set in your environment.")
         # สร้างและคืนค่า instance ของ ChatOpenAI ด้วยพารามิเตอร์ที่จำเป็น
-        return ChatOpenAI(
+        return create_chat_llm(
             base_url=self.base_url,
             model=self.model_name,
             api_key=self.api_key,
@@ -125,7 +138,7 @@ class PandasAgent:
             agent_type=AgentType.OPENAI_FUNCTIONS,
             prefix=prefix, 
             suffix=suffix,
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_dangerous_code=True,  
             return_intermediate_steps=True,
             handle_parsing_errors=True,
@@ -154,18 +167,89 @@ class PandasAgent:
             return ''
 
 
-    def run(self, query: str, dataset_key: str) -> dict:
+    def validate_code(self, code: str, df: pd.DataFrame) -> Optional[str]:
+        """
+        ฟังก์ชันสำหรับตรวจสอบโค้ดที่ถูกสร้างขึ้นในเครื่อง (ไม่เรียก LLM):
+          - ตรวจสอบ syntax ด้วย ast.parse
+          - ทดลองรันโค้ดกับตัวอย่างข้อมูลขนาดเล็ก (PANDAS_DRY_RUN_ROWS แถว)
+        output และ figure ที่เกิดจากการทดลองรันจะถูกทิ้งไป
+        Parameters:
+            code (str): โค้ด Python ที่ต้องการตรวจสอบ
+            df (pd.DataFrame): DataFrame ที่โค้ดจะถูกนำไปรันจริง
+        Returns:
+            ข้อความ error หากโค้ดไม่ผ่านการตรวจสอบ หรือ None หากผ่าน
+        """
+        if not code or not code.strip():
+            return "No code generated"
+        try:
+            compiled = compile(ast.parse(code), "<single-shot>", "exec")
+        except SyntaxError as e:
+            return f"SyntaxError: {e}"
+
+        if len(df) > PANDAS_DRY_RUN_ROWS:
+            sample = df.sample(PANDAS_DRY_RUN_ROWS, random_state=0).sort_index()
+        else:
+            sample = df.copy()
+        context = {"pd": pd, "np": np, "sns": sns, "plt": plt, "tabulate": tabulate, "df": sample}
+        output = BoundedOutput(max_chars=2000)
+        try:
+            with capture_stdout(output), FigureCapture(), exec_watchdog():
+                exec(compiled, context)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        finally:
+            output.close()
+        return None
+
+    def run_single_shot(self, query: str, dataset_key: str, callbacks=None) -> Optional[dict]:
+        """
+        ฟังก์ชันสำหรับสร้างโค้ดด้วยการเรียก LLM ครั้งเดียว (structured output ตามโมเดล PlotResponse)
+        โดยใช้ profile ของ DataFrame แทนการสำรวจข้อมูลผ่าน agent
+        Parameters:
+            query (str): คำถามหรือคำสั่งที่ผู้ใช้ส่งเข้ามา
+            dataset_key (str): คีย์ของชุดข้อมูลที่ต้องการใช้งาน
+            callbacks: callback ของ langchain ที่ส่งต่อให้ LLM (เช่น สำหรับเก็บ metrics)
+        Returns:
+            dict ของ PlotResponse หากโค้ดผ่านการตรวจสอบ หรือ None หากต้องกลับไปใช้ agent แบบหลายรอบ
+        """
+        try:
+            df = self.handler.get_data(dataset_key)
+            profile = json.dumps(self.handler.get_profile(dataset_key), ensure_ascii=False, default=str)
+            prompt = get_single_shot_prompt(profile=profile, json_format=self.output_parser.get_format_instructions())
+            chain = prompt | self.llm | self.output_parser
+            response = chain.invoke({"query": query}, config={"callbacks": callbacks})
+        except Exception as e:
+            logging.error(f"Single-shot generation failed, falling back to agent: {e}")
+            return None
+
+        error = self.validate_code(response.code.replace("plt.show()", ""), df)
+        if error:
+            logging.error(f"Single-shot code failed validation, falling back to agent: {error}")
+            return None
+        logging.info("Single-shot code passed validation.")
+        return response.model_dump()
+
+    def run(self, query: str, dataset_key: str, callbacks=None) -> dict:
         """
         ฟังก์ชันสำหรับประมวลผลคำสั่งของผู้ใช้:
+          - หากเปิด PANDAS_SINGLE_SHOT จะลองสร้างโค้ดด้วยการเรียก LLM ครั้งเดียวก่อน และใช้ agent เมื่อไม่สำเร็จ
           - สร้าง agent สำหรับชุดข้อมูลที่ระบุ
           - ส่ง query ไปให้ agent ประมวลผล
           - Parse และ validate ผลลัพธ์ที่ได้ให้อยู่ในรูปแบบ JSON ตามโมเดล PlotResponse
         Parameters:
             query (str): คำถามหรือคำสั่งที่ผู้ใช้ส่งเข้ามา
             dataset_key (str): คีย์ของชุดข้อมูลที่ต้องการใช้งาน
+            callbacks: callback ของ langchain ที่ส่งต่อให้ agent (เช่น สำหรับเก็บ metrics)
         Returns:
             dict ที่มี key "status" ระบุผลลัพธ์ (success/error) และ key "data" หรือ "message" สำหรับผลลัพธ์หรือข้อความ error
         """
+        # ลองสร้างโค้ดด้วยการเรียก LLM ครั้งเดียวก่อน (ถ้าเปิดใช้งาน)
+        if PANDAS_SINGLE_SHOT:
+            with track_stage("pandas_single_shot"):
+                single_shot = self.run_single_shot(query, dataset_key, callbacks=callbacks)
+            if single_shot is not None:
+                return {"status": "success", "data": single_shot}
+
         try:
             # สร้าง agent สำหรับชุดข้อมูลที่ระบุโดยใช้เมธอด create_agent
             agent = self.create_agent(dataset_key)
@@ -187,7 +271,7 @@ class PandasAgent:
 
 
             # Invoke the agent with the formatted prompt
-            response = agent.invoke(prompt_template)
+            response = agent.invoke(prompt_template, config={"callbacks": callbacks})
             
             try:
                 # ตรวจสอบผลลัพธ์ที่ได้จาก agent:
@@ -220,12 +304,13 @@ class PandasAgent:
 
 
         
-    def run_and_return_code(self, query: str, dataset_key: str) -> dict:
+    def run_and_return_code(self, query: str, dataset_key: str, callbacks=None) -> dict:
         """
         ฟังก์ชันสำหรับประมวลผล query และคืนค่าเฉพาะส่วนของโค้ดและคำอธิบาย
         Parameters:
             query (str): คำถามหรือคำสั่งจากผู้ใช้
             dataset_key (str): คีย์ของชุดข้อมูลที่ต้องการใช้งาน
+            callbacks: callback ของ langchain ที่ส่งต่อให้ agent (เช่น สำหรับเก็บ metrics)
         Returns:
             dict ที่ประกอบด้วย:
               - query: คำถามของผู้ใช้
@@ -248,7 +333,7 @@ class PandasAgent:
         #     # หากสถานะไม่ใช่ success ให้คืนค่า dict ที่มี key "error" พร้อมข้อความ error ที่ได้รับ
         #     return {"error": result.get("message", "Unknown error")}
         try:
-            result = self.run(query, dataset_key)
+            result = self.run(query, dataset_key, callbacks=callbacks)
             if isinstance(result, str):
                 try:
                     result = json.loads(result)
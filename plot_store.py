@@ -0,0 +1,344 @@
+# -----------------------------------------------------------------------
+# ที่เก็บไฟล์กราฟแบบ content-addressed
+# ตั้งชื่อไฟล์ตาม hash ของเนื้อหา (sha256) แบ่ง shard เป็นโฟลเดอร์ย่อยตาม 2 ตัวอักษรแรก,
+# นับจำนวนการอ้างอิงจากข้อความใน session และลบกราฟที่ไม่ถูกใช้งาน (garbage collection)
+# กราฟแต่ละไฟล์มีภาพย่อ (thumbnail) สำหรับแสดงในแชท ซึ่งถูกสร้างตอนบันทึกกราฟ
+# -----------------------------------------------------------------------
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+# ค่าเริ่มต้นของการเก็บกราฟ (ปรับได้ผ่าน environment variables)
+PLOT_TTL_DAYS = float(os.getenv("PLOT_TTL_DAYS", 30))                      # อายุสูงสุดของกราฟนับจากการใช้งานล่าสุด
+PLOT_DISK_CAP_MB = float(os.getenv("PLOT_DISK_CAP_MB", 1024))              # พื้นที่ดิสก์สูงสุดสำหรับกราฟทั้งหมด
+PLOT_ORPHAN_GRACE_SECONDS = float(os.getenv("PLOT_ORPHAN_GRACE_SECONDS", 3600))  # เวลาผ่อนผันก่อนลบกราฟที่ยังไม่มีใครอ้างอิง
+PLOT_GC_INTERVAL_SECONDS = float(os.getenv("PLOT_GC_INTERVAL_SECONDS", 600))    # ระยะห่างขั้นต่ำระหว่างการรัน GC อัตโนมัติ
+PLOT_THUMBNAIL_WIDTH = int(os.getenv("PLOT_THUMBNAIL_WIDTH", 800))          # ความกว้าง (pixels) ของภาพย่อที่แสดงในแชท
+PLOT_TOUCH_INTERVAL_SECONDS = float(os.getenv("PLOT_TOUCH_INTERVAL_SECONDS", 3600))  # ระยะห่างขั้นต่ำระหว่างการบันทึกเวลาที่กราฟถูกแสดง
+
+INDEX_FILENAME = "index.json"
+
+
+def _disk_size(entry: dict) -> int:
+    # ขนาดของไฟล์กราฟรวมกับภาพย่อ
+    return entry["size"] + entry.get("thumb_size", 0)
+
+
+class PlotStore:
+    """
+    คลาสสำหรับจัดเก็บไฟล์กราฟ (PNG) แบบ content-addressed
+    - ไฟล์ที่มีเนื้อหาเหมือนกันจะถูกเก็บเพียงครั้งเดียว
+    - เก็บจำนวนการอ้างอิงแยกตาม session ไว้ในไฟล์ index.json
+    - ลบกราฟเมื่อไม่มี session อ้างอิง, เมื่อหมดอายุ (TTL) หรือเมื่อใช้พื้นที่เกินกำหนด
+    """
+
+    def __init__(self, root: str, url_prefix: str, ttl_days: Optional[float] = None,
+                 max_bytes: Optional[int] = None, orphan_grace: Optional[float] = None):
+        """
+        ตัวสร้างสำหรับ PlotStore
+        Parameters:
+            root (str): โฟลเดอร์หลักสำหรับเก็บไฟล์กราฟ
+            url_prefix (str): URL prefix สำหรับเข้าถึงกราฟผ่านส่วน frontend
+            ttl_days (float): อายุสูงสุดของกราฟ (วัน) นับจากการใช้งานล่าสุด
+            max_bytes (int): ขนาดรวมสูงสุดของไฟล์กราฟทั้งหมด (bytes)
+            orphan_grace (float): เวลา (วินาที) ที่กราฟซึ่งยังไม่มีการอ้างอิงจะถูกเก็บไว้ก่อนลบ
+        """
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+        self.ttl_seconds = (PLOT_TTL_DAYS if ttl_days is None else ttl_days) * 86400
+        self.max_bytes = int(PLOT_DISK_CAP_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.orphan_grace = PLOT_ORPHAN_GRACE_SECONDS if orphan_grace is None else orphan_grace
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        # lock สำหรับป้องกันการแก้ไข index พร้อมกันจากหลาย thread
+        self._lock = threading.RLock()
+        self._index: Optional[Dict[str, dict]] = None
+        self._last_collect = 0.0
+
+    # -------------------------------------------------------------------
+    # การจัดการไฟล์ index
+    # -------------------------------------------------------------------
+    def _load_index(self) -> Dict[str, dict]:
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path, "r") as f:
+                        self._index = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.error(f"Error loading plot index, rebuilding from disk: {e}")
+                    self._index = self._rebuild_index()
+        return self._index
+
+    def _rebuild_index(self) -> Dict[str, dict]:
+        # สร้าง index ใหม่จากไฟล์ที่มีอยู่จริง (ข้อมูลการอ้างอิงจะหายไป จึงถือว่าเป็นกราฟที่ไม่มีการอ้างอิง)
+        index = {}
+        now = time.time()
+        for shard in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                digest, ext = os.path.splitext(name)
+                if ext != ".png" or "." in digest:
+                    continue
+                index[digest] = {
+                    "size": os.path.getsize(os.path.join(shard_dir, name)),
+                    "created_at": now,
+                    "last_access": now,
+                    "refs": {},
+                }
+        return index
+
+    def _save_index(self) -> None:
+        # เขียน index ลงไฟล์ชั่วคราวแล้วแทนที่ เพื่อป้องกันไฟล์เสียหายหากโปรแกรมหยุดกลางคัน
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    # -------------------------------------------------------------------
+    # การเขียนและอ่านไฟล์กราฟ
+    # -------------------------------------------------------------------
+    @staticmethod
+    def relative_path(digest: str) -> str:
+        """
+        คืนค่าเส้นทางของไฟล์กราฟแบบ relative จาก root (เช่น "ab/abcdef....png")
+        """
+        return f"{digest[:2]}/{digest}.png"
+
+    def file_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.png")
+
+    def url(self, digest: str) -> str:
+        return f"{self.url_prefix}/{self.relative_path(digest)}"
+
+    def thumbnail_file_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.thumb.png")
+
+    def _write_thumbnail(self, digest: str, data: Optional[bytes] = None) -> int:
+        """
+        สร้างภาพย่อของกราฟที่มีความกว้างไม่เกิน PLOT_THUMBNAIL_WIDTH
+        Returns:
+            ขนาดของไฟล์ภาพย่อ (bytes) หรือ 0 หากกราฟมีขนาดเล็กอยู่แล้ว (ใช้ไฟล์เดิมแทน) หรือสร้างไม่สำเร็จ
+        """
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(data) if data is not None else self.file_path(digest)) as image:
+                if image.width <= PLOT_THUMBNAIL_WIDTH:
+                    return 0
+                # ย่อภาพโดยคงสัดส่วนเดิม (ความสูงถูกปรับตามความกว้าง)
+                image.thumbnail((PLOT_THUMBNAIL_WIDTH, image.height), Image.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+        except (OSError, ValueError) as e:
+            logging.error(f"Error creating thumbnail for plot {digest[:12]}: {e}")
+            return 0
+        path = self.thumbnail_file_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        return buffer.tell()
+
+    def thumbnail(self, digest: str) -> Optional[str]:
+        """
+        คืนค่าเส้นทางของภาพย่อของกราฟ (สร้างให้หากยังไม่มี เช่น กราฟที่บันทึกก่อนมีภาพย่อ)
+        Returns:
+            เส้นทางของภาพย่อ, เส้นทางของไฟล์เดิมหากกราฟมีขนาดเล็กอยู่แล้ว หรือ None หากกราฟถูกลบไปแล้ว
+        """
+        path = self.thumbnail_file_path(digest)
+        with self._lock:
+            entry = self._load_index().get(digest)
+            if entry is None or not os.path.exists(self.file_path(digest)):
+                return None
+            # กราฟที่ถูกแสดงถือว่าถูกใช้งาน (TTL นับจากการใช้งานล่าสุด)
+            self._touch(entry)
+            thumb_size = entry.get("thumb_size")
+        if thumb_size is not None and os.path.exists(path):
+            return path
+        if thumb_size is None:
+            thumb_size = self._write_thumbnail(digest)
+            self._record_thumbnail(digest, thumb_size)
+        return path if thumb_size else self.file_path(digest)
+
+    def _touch(self, entry: dict) -> None:
+        # บันทึกเวลาใช้งานล่าสุด (เขียน index ไม่เกินหนึ่งครั้งต่อ PLOT_TOUCH_INTERVAL_SECONDS ต่อกราฟ)
+        now = time.time()
+        if now - entry.get("last_access", entry["created_at"]) >= PLOT_TOUCH_INTERVAL_SECONDS:
+            entry["last_access"] = now
+            self._save_index()
+
+    def _record_thumbnail(self, digest: str, thumb_size: int) -> None:
+        with self._lock:
+            entry = self._load_index().get(digest)
+            if entry is not None:
+                entry["thumb_size"] = thumb_size
+                self._save_index()
+            elif thumb_size and os.path.exists(self.thumbnail_file_path(digest)):
+                # กราฟถูกลบโดย GC ระหว่างที่สร้างภาพย่อ
+                os.remove(self.thumbnail_file_path(digest))
+
+    def put(self, data: bytes) -> str:
+        """
+        บันทึกข้อมูลไฟล์กราฟ หากมีไฟล์ที่เนื้อหาเหมือนกันอยู่แล้วจะไม่เขียนซ้ำ
+        Parameters:
+            data (bytes): ข้อมูลไฟล์ PNG
+        Returns:
+            digest (str): sha256 ของเนื้อหาไฟล์ ซึ่งใช้เป็นชื่อไฟล์
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.file_path(digest)
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            entry = index.setdefault(digest, {"size": len(data), "created_at": now, "refs": {}})
+            entry["last_access"] = now
+            self._save_index()
+            needs_thumbnail = "thumb_size" not in entry
+        if needs_thumbnail:
+            # สร้างภาพย่อนอก lock (ใช้เวลานานกว่าการเขียนไฟล์)
+            self._record_thumbnail(digest, self._write_thumbnail(digest, data))
+        self.maybe_collect()
+        return digest
+
+    def save_figure(self, fig, **savefig_kwargs) -> str:
+        """
+        แปลง figure ของ matplotlib เป็นไฟล์ PNG แล้วบันทึกลงใน store
+        Parameters:
+            fig: instance ของ matplotlib Figure
+            savefig_kwargs: พารามิเตอร์เพิ่มเติมสำหรับ fig.savefig
+        Returns:
+            digest (str) ของไฟล์กราฟที่บันทึก
+        """
+        buffer = io.BytesIO()
+        # ตัด metadata ที่ไม่จำเป็นออกเพื่อให้กราฟที่เหมือนกันได้ hash เดียวกัน
+        fig.savefig(buffer, format="png", metadata={"Software": None}, **savefig_kwargs)
+        return self.put(buffer.getvalue())
+
+    # -------------------------------------------------------------------
+    # การนับการอ้างอิงจาก session
+    # -------------------------------------------------------------------
+    def add_refs(self, session_id: str, digests: Iterable[str]) -> None:
+        """
+        เพิ่มการอ้างอิงกราฟจากข้อความใน session
+        Parameters:
+            session_id (str): รหัสของ session ที่อ้างอิงกราฟ
+            digests: รายการ digest ของกราฟที่ถูกอ้างอิง (หนึ่งครั้งต่อหนึ่งข้อความ)
+        """
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            changed = False
+            for digest in digests:
+                entry = index.get(digest)
+                if entry is None:
+                    continue
+                entry["refs"][session_id] = entry["refs"].get(session_id, 0) + 1
+                entry["last_access"] = now
+                changed = True
+            if changed:
+                self._save_index()
+
+    def release_session(self, session_id: str) -> Dict[str, int]:
+        """
+        ลบการอ้างอิงทั้งหมดของ session (เช่น เมื่อ session ถูกลบหรือล้างประวัติการสนทนา)
+        แล้วรัน garbage collection ทันที
+        Returns:
+            รายงานผลการลบ (จำนวนไฟล์และจำนวน bytes ที่ถูกลบ)
+        """
+        with self._lock:
+            index = self._load_index()
+            changed = False
+            for entry in index.values():
+                if entry["refs"].pop(session_id, None) is not None:
+                    changed = True
+            if changed:
+                self._save_index()
+        return self.collect()
+
+    def disk_usage(self) -> int:
+        # ขนาดรวม (bytes) ของไฟล์กราฟทั้งหมด (รวมภาพย่อ) ตาม index
+        with self._lock:
+            return sum(_disk_size(entry) for entry in self._load_index().values())
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            entry = self._load_index().get(digest)
+            return sum(entry["refs"].values()) if entry else 0
+
+    # -------------------------------------------------------------------
+    # Garbage collection
+    # -------------------------------------------------------------------
+    def maybe_collect(self) -> None:
+        # รัน GC อัตโนมัติไม่เกินหนึ่งครั้งต่อ PLOT_GC_INTERVAL_SECONDS
+        if time.time() - self._last_collect >= PLOT_GC_INTERVAL_SECONDS:
+            self.collect()
+
+    def collect(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        ลบไฟล์กราฟที่:
+          1. ไม่มี session อ้างอิงและไม่ถูกใช้งาน (บันทึกหรืออ้างอิง) นานกว่าช่วงเวลาผ่อนผัน
+          2. ไม่ถูกใช้งาน (บันทึก, อ้างอิง หรือแสดงผล) นานเกิน TTL
+          3. เกินพื้นที่ดิสก์ที่กำหนด (ลบกราฟที่ไม่มีการอ้างอิงก่อน แล้วจึงลบตามการใช้งานล่าสุดที่เก่าที่สุด)
+        Returns:
+            dict ที่มีจำนวนไฟล์ (removed) และจำนวน bytes (bytes_freed) ที่ถูกลบ
+        """
+        now = time.time() if now is None else now
+        removed: Set[str] = set()
+        with self._lock:
+            self._last_collect = now
+            index = self._load_index()
+            for digest, entry in index.items():
+                unreferenced = not any(entry["refs"].values())
+                # นับจากการใช้งานล่าสุด: กราฟเก่าที่ถูกบันทึกซ้ำ (put) จะไม่ถูกลบก่อนที่ข้อความจะเพิ่มการอ้างอิง
+                idle = now - entry.get("last_access", entry["created_at"])
+                if unreferenced and idle >= self.orphan_grace:
+                    removed.add(digest)
+                elif idle >= self.ttl_seconds:
+                    removed.add(digest)
+
+            total = sum(_disk_size(entry) for digest, entry in index.items() if digest not in removed)
+            if total > self.max_bytes:
+                candidates = sorted(
+                    (digest for digest in index if digest not in removed),
+                    key=lambda d: (any(index[d]["refs"].values()), index[d].get("last_access", 0)),
+                )
+                for digest in candidates:
+                    if total <= self.max_bytes:
+                        break
+                    removed.add(digest)
+                    total -= _disk_size(index[digest])
+
+            bytes_freed = 0
+            for digest in removed:
+                entry = index.pop(digest)
+                try:
+                    os.remove(self.file_path(digest))
+                    bytes_freed += entry["size"]
+                except FileNotFoundError:
+                    pass
+                if entry.get("thumb_size"):
+                    try:
+                        os.remove(self.thumbnail_file_path(digest))
+                        bytes_freed += entry["thumb_size"]
+                    except FileNotFoundError:
+                        pass
+            if removed:
+                self._save_index()
+
+        if removed:
+            logging.info(f"Plot store GC removed {len(removed)} plots ({bytes_freed} bytes)")
+        return {"removed": len(removed), "bytes_freed": bytes_freed}
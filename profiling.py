@@ -0,0 +1,190 @@
+# -----------------------------------------------------------------------
+# การ profile การรันโค้ดที่ถูกสร้างโดย agent (เปิดใช้งานเมื่อต้องการเท่านั้น)
+# รวม cProfile (ระดับฟังก์ชัน), การจับเวลาระดับบรรทัดของโค้ดที่สร้างขึ้น (sys.settrace)
+# และ tracemalloc สำหรับวัดหน่วยความจำสูงสุดที่ใช้
+# -----------------------------------------------------------------------
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+# ค่าเริ่มต้นของการ profile (ปรับได้ผ่าน environment variables)
+PROFILE_EXECUTION = os.getenv("PROFILE_EXECUTION", "false").lower() == "true"   # เปิด profile ทุกการรันโค้ด
+PROFILE_DUMP = os.getenv("PROFILE_DUMP", "true").lower() == "true"               # บันทึก profile ฉบับเต็มลงไฟล์ .prof
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("artifacts", "profiles"))   # โฟลเดอร์สำหรับเก็บไฟล์ profile
+PROFILE_TOP_LINES = int(os.getenv("PROFILE_TOP_LINES", 10))                      # จำนวนบรรทัดที่ใช้เวลามากที่สุดที่จะรายงาน
+
+# ชื่อไฟล์ที่ใช้ compile โค้ดที่ถูกสร้างขึ้น เพื่อแยก frame ของโค้ดนี้ออกจาก library อื่น
+GENERATED_CODE_FILENAME = "<generated-code>"
+
+
+class HotLine(BaseModel):
+    """
+    โมเดลสำหรับเก็บข้อมูลของบรรทัดในโค้ดที่ใช้เวลามาก
+    Attributes:
+        lineno (int): หมายเลขบรรทัดในโค้ดที่ถูกสร้างขึ้น
+        code (str): เนื้อหาของบรรทัดนั้น
+        seconds (float): เวลารวมที่ใช้ในบรรทัดนั้น (รวมเวลาของฟังก์ชันที่ถูกเรียก)
+        hits (int): จำนวนครั้งที่บรรทัดนั้นถูกรัน
+    """
+    lineno: int
+    code: str
+    seconds: float
+    hits: int
+
+
+class ProfileReport(BaseModel):
+    """
+    โมเดลสำหรับเก็บผลการ profile การรันโค้ด
+    Attributes:
+        wall_seconds (float): เวลาที่ใช้จริงทั้งหมด
+        cpu_seconds (float): เวลา CPU ที่ thread ที่รันโค้ดใช้
+        peak_memory_bytes (int): หน่วยความจำสูงสุดที่ถูก allocate ระหว่างการรัน (จาก tracemalloc)
+        hot_lines (List[HotLine]): บรรทัดในโค้ดที่ใช้เวลามากที่สุด
+        profile_path (Optional[str]): เส้นทางของไฟล์ profile ฉบับเต็ม (.prof) ถ้ามีการบันทึก
+    """
+    wall_seconds: float
+    cpu_seconds: float
+    peak_memory_bytes: int
+    hot_lines: List[HotLine] = []
+    profile_path: Optional[str] = None
+
+
+class ExecutionProfiler:
+    """
+    context manager สำหรับ profile การรันโค้ดที่ถูก compile ด้วย GENERATED_CODE_FILENAME
+
+    ตัวอย่าง:
+        profiler = ExecutionProfiler(code)
+        with profiler:
+            exec(compile(code, GENERATED_CODE_FILENAME, "exec"), context)
+        report = profiler.report
+    หมายเหตุ: tracemalloc เป็น state ระดับ process หากมีการ profile พร้อมกันหลาย thread
+    ค่า peak_memory_bytes จะรวมการ allocate ของ thread อื่นด้วย
+    """
+
+    _tracemalloc_lock = threading.Lock()
+    _tracemalloc_users = 0
+
+    def __init__(self, source: str, dump_dir: Optional[str] = None, top_lines: Optional[int] = None):
+        """
+        ตัวสร้างสำหรับ ExecutionProfiler
+        Parameters:
+            source (str): โค้ดที่ถูกรัน (ใช้แสดงเนื้อหาของบรรทัดที่ใช้เวลามาก)
+            dump_dir (str): โฟลเดอร์สำหรับบันทึกไฟล์ profile ฉบับเต็ม (None = ไม่บันทึก)
+            top_lines (int): จำนวนบรรทัดที่ใช้เวลามากที่สุดที่จะรายงาน
+        """
+        self.source_lines = source.splitlines()
+        self.dump_dir = dump_dir
+        self.top_lines = PROFILE_TOP_LINES if top_lines is None else top_lines
+        self.report: Optional[ProfileReport] = None
+        self._profile = cProfile.Profile()
+        self._line_stats: Dict[int, List[float]] = {}
+        self._frame_state: Dict[int, Tuple[int, float]] = {}
+        self._previous_trace = None
+        self._profiling = False
+
+    # -------------------------------------------------------------------
+    # การจับเวลาระดับบรรทัด
+    # -------------------------------------------------------------------
+    def _global_trace(self, frame, event, arg):
+        # trace เฉพาะ frame ระดับ module ของโค้ดที่ถูกสร้างขึ้น เวลาของ frame ย่อย (comprehension,
+        # ฟังก์ชันที่โค้ดนิยามเอง) และ library อื่นจะถูกรวมเข้ากับบรรทัดที่เรียกใช้ จึงไม่ถูกนับซ้ำ
+        if frame.f_code.co_filename == GENERATED_CODE_FILENAME and frame.f_code.co_name == "<module>":
+            return self._local_trace
+        return None
+
+    def _record(self, frame_id: int, now: float) -> None:
+        previous = self._frame_state.get(frame_id)
+        if previous is not None:
+            lineno, started = previous
+            stats = self._line_stats.setdefault(lineno, [0.0, 0])
+            stats[0] += now - started
+            stats[1] += 1
+
+    def _local_trace(self, frame, event, arg):
+        now = time.perf_counter()
+        frame_id = id(frame)
+        if event == "line":
+            self._record(frame_id, now)
+            self._frame_state[frame_id] = (frame.f_lineno, now)
+        elif event == "return":
+            self._record(frame_id, now)
+            self._frame_state.pop(frame_id, None)
+        return self._local_trace
+
+    # -------------------------------------------------------------------
+    # context manager
+    # -------------------------------------------------------------------
+    def __enter__(self) -> "ExecutionProfiler":
+        with ExecutionProfiler._tracemalloc_lock:
+            if ExecutionProfiler._tracemalloc_users == 0:
+                if tracemalloc.is_tracing():
+                    tracemalloc.reset_peak()
+                else:
+                    tracemalloc.start()
+            ExecutionProfiler._tracemalloc_users += 1
+        self._start_memory = tracemalloc.get_traced_memory()[0]
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.thread_time()
+        self._previous_trace = sys.gettrace()
+        sys.settrace(self._global_trace)
+        try:
+            self._profile.enable()
+            self._profiling = True
+        except ValueError as e:
+            # Python 3.12+ อนุญาตให้มี profiler ที่ทำงานอยู่ได้ครั้งละหนึ่งตัวต่อ process
+            logging.warning(f"cProfile unavailable for this execution: {e}")
+            self._profiling = False
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._profiling:
+            self._profile.disable()
+        sys.settrace(self._previous_trace)
+        wall_seconds = time.perf_counter() - self._start_wall
+        cpu_seconds = time.thread_time() - self._start_cpu
+        peak_memory = max(tracemalloc.get_traced_memory()[1] - self._start_memory, 0)
+        with ExecutionProfiler._tracemalloc_lock:
+            ExecutionProfiler._tracemalloc_users -= 1
+            if ExecutionProfiler._tracemalloc_users == 0:
+                tracemalloc.stop()
+
+        hot_lines = sorted(self._line_stats.items(), key=lambda item: item[1][0], reverse=True)
+        self.report = ProfileReport(
+            wall_seconds=round(wall_seconds, 6),
+            cpu_seconds=round(cpu_seconds, 6),
+            peak_memory_bytes=peak_memory,
+            hot_lines=[
+                HotLine(
+                    lineno=lineno,
+                    code=self.source_lines[lineno - 1].strip() if 0 < lineno <= len(self.source_lines) else "",
+                    seconds=round(seconds, 6),
+                    hits=int(hits),
+                )
+                for lineno, (seconds, hits) in hot_lines[: self.top_lines]
+            ],
+            profile_path=self._dump(),
+        )
+
+    def _dump(self) -> Optional[str]:
+        # บันทึก profile ฉบับเต็มลงไฟล์ .prof (เปิดดูได้ด้วย pstats หรือ snakeviz)
+        if not self.dump_dir or not self._profiling:
+            return None
+        try:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.prof"
+            path = os.path.join(self.dump_dir, filename)
+            self._profile.dump_stats(path)
+            return path
+        except OSError as e:
+            logging.error(f"Error dumping execution profile: {e}")
+            return None
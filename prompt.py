@@ -214,6 +214,39 @@ def get_suffix(columns, datatype):
     **Do not include any additional text outside of this structure.**
     """.strip()
 
+def get_single_shot_prompt(profile, json_format):
+    """
+    prompt สำหรับโหมด single-shot ของ PandasAgent: สร้างโค้ดทั้งหมดในการเรียก LLM ครั้งเดียว
+    โดยอาศัย profile ของ DataFrame แทนการสำรวจข้อมูลผ่าน agent หลายรอบ
+    """
+    return PromptTemplate(
+        template="""
+    You are a Python expert specializing in data processing and visualization with pandas, matplotlib and seaborn.
+    You cannot run code or inspect the data yourself, so rely ONLY on the DataFrame profile below.
+
+    **DataFrame profile** (JSON: row count, per-column dtype, non-null count, unique count,
+    numeric min/max/mean/std, most frequent values, and a few sample rows):
+    {profile}
+
+    **Python Code Requirements:**
+    - The DataFrame is already loaded as `df`, do not include `pd.read_csv()` or redefine `df`.
+    - `pd`, `np`, `plt`, `sns` and `tabulate` are available; imports are allowed but not required.
+    - Use only the columns listed in the profile and operations appropriate for their dtypes.
+    - Do not call `plt.show()`.
+    - Use `tabulate` to print DataFrame outputs in a structured format.
+    - If generating plots, **always** include `tabulate` output alongside visualization.
+    - If the question references a column or concept that is not present in the DataFrame,
+      substitute the available column(s) that best match the intended analysis.
+
+    Question: {query}
+
+    Your response must be a single valid JSON object with only the keys "query", "explanation" and "code".
+    {format_instructions}
+    """,
+        input_variables=["query"],
+        partial_variables={"profile": profile, "format_instructions": json_format},
+    )
+
 #==================================================================================================
 # analysis agent prompt 
 
@@ -0,0 +1,188 @@
+# -----------------------------------------------------------------------
+# ตัวเลือก agent แบบ rule-based (fast path) สำหรับคำถามที่ชัดเจน
+# คำถามที่ขอกราฟ/ตาราง/การจัดการ DataFrame ชัดเจนจะถูกส่งไปยัง pandas_agent
+# คำถามเชิงสถิติหรือการตีความจะถูกส่งไปยัง analysis_agent โดยไม่ต้องเรียก supervisor LLM
+# คำถามที่กำกวมจะถูกส่งกลับไปให้ supervisor ตัดสินใจตามเดิม
+# -----------------------------------------------------------------------
+import json
+import logging
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+# ค่าเริ่มต้นของ router (ปรับได้ผ่าน environment variables)
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"   # เปิดใช้งาน fast path
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", 0.75))          # ความมั่นใจขั้นต่ำที่จะข้าม supervisor
+ROUTER_QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_queries.json")
+
+PANDAS_AGENT = "pandas_agent"
+ANALYSIS_AGENT = "analysis_agent"
+
+# คำสำคัญพร้อมน้ำหนัก: คำภาษาอังกฤษจะถูกจับคู่แบบทั้งคำ ส่วนคำภาษาไทยจะถูกจับคู่แบบ substring
+# (ภาษาไทยไม่มีการเว้นวรรคระหว่างคำ)
+_KEYWORDS: Dict[str, List[Tuple[str, float]]] = {
+    PANDAS_AGENT: [
+        # การขอกราฟหรือ visualization อย่างชัดเจน
+        (r"plot\w*", 2.0), (r"charts?", 2.0), (r"graphs?", 2.0), (r"histograms?", 2.0), (r"heat ?maps?", 2.0),
+        (r"scatter", 2.0), (r"bar", 1.0), (r"pie", 1.0), (r"boxplots?", 2.0), (r"visuali[sz]\w*", 2.0),
+        ("กราฟ", 2.0), ("แผนภูมิ", 2.0), ("พล็อต", 2.0), ("แผนภาพ", 2.0), ("ฮิสโตแกรม", 2.0),
+        # การขอผลลัพธ์เป็นตาราง
+        (r"tables?", 1.5), (r"tabular", 1.5), ("ตาราง", 1.5),
+        # การจัดการ DataFrame โดยตรง
+        (r"filter\w*", 1.5), (r"group ?by", 1.5), (r"sort\w*", 1.5), (r"top \d+", 1.0), (r"rows?", 0.5),
+        (r"list", 0.5), (r"show", 0.5), (r"display", 0.5),
+        ("กรอง", 1.5), ("เรียงลำดับ", 1.5), ("จัดกลุ่ม", 1.5), ("แสดง", 0.5), ("รายการ", 0.5), ("แถว", 0.5),
+    ],
+    ANALYSIS_AGENT: [
+        # สถิติและการทดสอบสมมติฐาน
+        (r"correlat\w*", 2.0), (r"regression", 2.0), (r"hypothes[ie]s", 2.0), (r"significan\w*", 2.0),
+        (r"statistic\w*", 1.5), (r"variance", 1.5), (r"standard deviation", 1.5), (r"std", 1.0),
+        (r"average", 1.0), (r"mean", 1.0), (r"median", 1.0), (r"percentage", 1.0), (r"percent", 1.0),
+        (r"trends?", 1.5), (r"predict\w*", 2.0), (r"forecast\w*", 2.0), (r"relationship", 1.5),
+        # การตีความและ insight
+        (r"why", 1.5), (r"explain\w*", 1.5), (r"insights?", 1.5), (r"interpret\w*", 1.5), (r"analy[sz]e", 1.0),
+        (r"how many", 1.0), (r"what is", 0.5),
+        ("สหสัมพันธ์", 2.0), ("ความสัมพันธ์", 1.5), ("สมมติฐาน", 2.0), ("ถดถอย", 2.0), ("ทำนาย", 2.0),
+        ("พยากรณ์", 2.0), ("สถิติ", 1.5), ("ค่าเฉลี่ย", 1.0), ("เฉลี่ย", 1.0), ("มัธยฐาน", 1.0),
+        ("ส่วนเบี่ยงเบน", 1.5), ("เปอร์เซ็นต์", 1.0), ("แนวโน้ม", 1.5), ("ทำไม", 1.5), ("อธิบาย", 1.5),
+        ("วิเคราะห์", 1.0), ("กี่", 1.0), ("เท่าไร", 1.0), ("เท่าไหร่", 1.0),
+    ],
+}
+
+
+def _compile(pattern: str) -> re.Pattern:
+    if re.search(r"[฀-๿]", pattern):
+        return re.compile(re.escape(pattern))
+    return re.compile(rf"\b{pattern}\b", re.IGNORECASE)
+
+
+_COMPILED = {target: [(_compile(pattern), pattern, weight) for pattern, weight in keywords]
+             for target, keywords in _KEYWORDS.items()}
+
+
+class RouteDecision(BaseModel):
+    """
+    โมเดลสำหรับเก็บผลการเลือก agent ของ router
+    Attributes:
+        target (Optional[str]): agent ที่ถูกเลือก ("pandas_agent" หรือ "analysis_agent") หรือ None หากไม่มีคำสำคัญ
+        confidence (float): ความมั่นใจของการเลือก (0-1)
+        scores (Dict[str, float]): คะแนนรวมของแต่ละ agent
+        matched (List[str]): คำสำคัญที่พบในคำถาม
+        elapsed_ms (float): เวลาที่ใช้ในการเลือก (มิลลิวินาที)
+    """
+    target: Optional[str] = None
+    confidence: float = 0.0
+    scores: Dict[str, float] = {}
+    matched: List[str] = []
+    elapsed_ms: float = 0.0
+
+    def is_confident(self, threshold: Optional[float] = None) -> bool:
+        """
+        คืนค่า True หากมั่นใจพอที่จะส่งคำถามไปยัง agent โดยตรงโดยไม่ผ่าน supervisor
+        """
+        threshold = ROUTER_CONFIDENCE if threshold is None else threshold
+        return self.target is not None and self.confidence >= threshold
+
+
+def route_query(query: str) -> RouteDecision:
+    """
+    เลือก agent สำหรับคำถามจากคำสำคัญ (ไม่มีการเรียก LLM)
+    ความมั่นใจคำนวณจากส่วนต่างของคะแนนระหว่างสอง agent และลดลงเมื่อหลักฐานมีน้อย
+    (เช่น พบเพียงคำว่า "show") ตามเกณฑ์เดียวกับ prompt ของ supervisor: หากขอกราฟหรือตาราง
+    อย่างชัดเจนให้ใช้ pandas_agent มิฉะนั้นให้ใช้ analysis_agent
+    Parameters:
+        query (str): คำถามของผู้ใช้
+    Returns:
+        instance ของ RouteDecision
+    """
+    started = time.perf_counter()
+    scores: Dict[str, float] = {}
+    matched: List[str] = []
+    for target, keywords in _COMPILED.items():
+        score = 0.0
+        for regex, pattern, weight in keywords:
+            if regex.search(query):
+                score += weight
+                matched.append(pattern)
+        scores[target] = score
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, runner_up) = ranked[0], ranked[1]
+    decision = RouteDecision(scores=scores, matched=matched)
+    if best_score > 0:
+        decision.target = best
+        # ส่วนต่างของคะแนน x ความหนักแน่นของหลักฐาน (คะแนน 2 ขึ้นไปถือว่าเพียงพอ)
+        decision.confidence = round((best_score - runner_up) / (best_score + runner_up) * min(best_score / 2.0, 1.0), 3)
+    decision.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    logging.info(f"Router decision: target={decision.target}, confidence={decision.confidence}, matched={matched}")
+    return decision
+
+
+# -----------------------------------------------------------------------
+# การวัดความแม่นยำของ router กับชุดคำถามที่มี label
+# -----------------------------------------------------------------------
+def _supervisor_hop_seconds(metrics_log_path: Optional[str] = None) -> Optional[float]:
+    # เวลาเฉลี่ยที่ supervisor LLM ใช้ต่อคำถาม (จาก metrics log) ซึ่งเป็นเวลาที่ประหยัดได้เมื่อข้าม supervisor
+    from metrics import METRICS_LOG_PATH
+    path = metrics_log_path or METRICS_LOG_PATH
+    values = []
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                supervisor = (json.loads(line).get("latency") or {}).get("supervisor") or {}
+            except json.JSONDecodeError:
+                continue
+            if supervisor.get("llm_calls"):
+                values.append(supervisor.get("llm_seconds", 0.0))
+    return sum(values) / len(values) if values else None
+
+
+def evaluate_router(path: Optional[str] = None, threshold: Optional[float] = None,
+                    metrics_log_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    วัดความแม่นยำของ router กับชุดคำถามที่มี label (JSON list ของ {"query", "expected"})
+    Parameters:
+        path (str): เส้นทางของไฟล์ชุดคำถาม (ค่าเริ่มต้น router_queries.json)
+        threshold (float): ความมั่นใจขั้นต่ำ (ค่าเริ่มต้น ROUTER_CONFIDENCE)
+        metrics_log_path (str): เส้นทางของ metrics log สำหรับประมาณเวลาที่ประหยัดได้
+    Returns:
+        dict ของ total, routed, coverage, accuracy (ของคำถามที่ถูก route), misrouted,
+        router_ms (เวลาเฉลี่ยของ router) และ estimated_seconds_saved (ถ้ามี metrics log)
+    """
+    with open(path or ROUTER_QUERIES_PATH, "r", encoding="utf-8") as f:
+        samples = json.load(f)
+    routed = correct = 0
+    router_ms = 0.0
+    misrouted = []
+    for sample in samples:
+        decision = route_query(sample["query"])
+        router_ms += decision.elapsed_ms
+        if decision.is_confident(threshold):
+            routed += 1
+            if decision.target == sample["expected"]:
+                correct += 1
+            else:
+                misrouted.append(sample["query"])
+    result = {
+        "total": len(samples),
+        "routed": routed,
+        "coverage": round(routed / len(samples), 3) if samples else 0.0,
+        "accuracy": round(correct / routed, 3) if routed else 0.0,
+        "misrouted": misrouted,
+        "router_ms": round(router_ms / len(samples), 3) if samples else 0.0,
+    }
+    hop_seconds = _supervisor_hop_seconds(metrics_log_path)
+    if hop_seconds is not None:
+        result["estimated_seconds_saved"] = round(hop_seconds * routed, 3)
+    return result
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน: python router.py [path/to/router_queries.json]
+    print(json.dumps(evaluate_router(sys.argv[1] if len(sys.argv) > 1 else None), ensure_ascii=False, indent=2))
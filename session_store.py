@@ -0,0 +1,638 @@
+# -----------------------------------------------------------------------
+# ที่เก็บข้อมูล session ของผู้ใช้
+# SqliteSessionManager (ค่าเริ่มต้น) เก็บข้อมูล session ในฐานข้อมูล SQLite (WAL mode) ไฟล์เดียว
+#   - ตาราง sessions มี index ตาม last_activity จึงแสดงรายการ session ใน sidebar แบบแบ่งหน้าได้โดยไม่ต้องอ่านข้อความ
+#   - ตาราง messages เก็บข้อความแยกแถว ข้อความของ session จะถูกโหลดเมื่อถูกใช้งานครั้งแรกเท่านั้น (lazy)
+# JsonSessionManager เก็บข้อมูลเป็นไฟล์ใน sessions/<id>/ (session.json และ log ของข้อความแบบ append-only)
+# เลือกได้ผ่าน SESSION_BACKEND=json (session.json รูปแบบเดิมจะถูกแปลงเมื่อถูกโหลดครั้งแรก)
+# ย้ายข้อมูลจากรูปแบบเดิมด้วย: python session_store.py migrate [sessions_dir]
+# -----------------------------------------------------------------------
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytz
+
+from blob_store import dataset_fingerprint
+
+# ค่าเริ่มต้นของที่เก็บ session (ปรับได้ผ่าน environment variables)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").lower()     # "sqlite" หรือ "json"
+SESSION_DB_FILENAME = os.getenv("SESSION_DB_FILENAME", "sessions.db")  # ชื่อไฟล์ฐานข้อมูลภายในโฟลเดอร์ sessions
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", 20))          # จำนวน session ต่อหน้าใน sidebar
+SESSION_LOG_FSYNC = os.getenv("SESSION_LOG_FSYNC", "true").lower() == "true"      # fsync หลังเขียนข้อความลง log (backend json)
+SESSION_LOG_COMPACT_RECORDS = int(os.getenv("SESSION_LOG_COMPACT_RECORDS", 200))  # จำนวน record ที่ไม่ใช้แล้วก่อน compact log
+
+THAI_TZ = pytz.timezone('Asia/Bangkok')
+SESSION_FILENAME = "session.json"
+LOG_FILENAME = "messages.jsonl"
+
+
+def _now() -> str:
+    return datetime.now(THAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# =======================================================================
+# คลาส Session สำหรับเก็บข้อมูลการสนทนาและการจัดการ session
+# =======================================================================
+class Session:
+    def __init__(self, session_id=None, message_loader: Optional[Callable[[], List[dict]]] = None):
+        # กำหนด session_id ถ้าไม่ระบุจะสร้างใหม่โดยใช้ uuid
+        self.session_id = session_id or str(uuid.uuid4())
+        # เก็บเวลาที่ session ถูกสร้างในรูปแบบ UTC
+        self.created_at = _now()
+        # รายการข้อความใน session (ทั้งจากผู้ใช้และผู้ช่วย) ซึ่งจะถูกโหลดจาก message_loader เมื่อถูกใช้งานครั้งแรก
+        self._messages: Optional[List[dict]] = None if message_loader else []
+        self._message_loader = message_loader
+        # จำนวนข้อความทั้งหมด (ใช้แสดงผลได้โดยไม่ต้องโหลดข้อความ)
+        self.message_count = 0
+        # เก็บไฟล์ที่ถูกอัปโหลด (ถ้ามี)
+        self.uploaded_file = None
+        # เก็บเส้นทางของไฟล์ที่ถูกอัปโหลด
+        self.file_path = None
+        # sha256 ของไฟล์ที่อัปโหลด (key ของไฟล์ใน BlobStore) และชื่อไฟล์เดิมที่ผู้ใช้อัปโหลด
+        self.file_hash = None
+        self.file_name = None
+        # เก็บเวลาที่มีการใช้งาน session ครั้งสุดท้าย
+        self.last_activity = self.created_at
+
+    @property
+    def messages(self) -> List[dict]:
+        if self._messages is None:
+            self._messages = self._message_loader()
+            self._message_loader = None
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: List[dict]) -> None:
+        self._messages = messages
+        self._message_loader = None
+
+    def messages_loaded(self) -> bool:
+        return self._messages is not None
+
+    def dataset_key(self) -> Optional[str]:
+        """
+        คืนค่า dataset key จากชื่อไฟล์เดิมที่ผู้ใช้อัปโหลด (ไฟล์ใน BlobStore ถูกตั้งชื่อตาม hash)
+        """
+        name = self.file_name or (os.path.basename(self.file_path) if self.file_path else None)
+        return os.path.splitext(name)[0] if name else None
+
+    def data_key(self) -> Optional[str]:
+        """
+        คืนค่า key ของชุดข้อมูลใน DataHandler และ AgentPool: fingerprint ของไฟล์ (sha256 ของไฟล์ใน BlobStore)
+        ไฟล์ที่ชื่อเดียวกันแต่เนื้อหาต่างกันจึงไม่ใช้ DataFrame ร่วมกัน
+        """
+        if not self.file_path:
+            return None
+        return self.file_hash or dataset_fingerprint(self.file_path) or self.file_path
+
+    def to_dict(self):
+        """
+        แปลงข้อมูลของ session เป็น dict สำหรับการบันทึกลงไฟล์ JSON
+        """
+        return {
+            'session_id': self.session_id,
+            'created_at': self.created_at,
+            'messages': self.messages,
+            'file_path': self.file_path,
+            'file_hash': self.file_hash,
+            'file_name': self.file_name,
+            'last_activity': self.last_activity
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        สร้าง instance ของ Session จาก dict ที่ได้บันทึกไว้
+        """
+        session = cls(session_id=data['session_id'])
+        session.created_at = data['created_at']
+        session.messages = data['messages']
+        session.message_count = len(session.messages)
+        session.file_path = data['file_path']
+        session.file_hash = data.get('file_hash')
+        session.file_name = data.get('file_name')
+        session.last_activity = data.get('last_activity', _now())
+        return session
+
+    def update_activity(self):
+        """
+        อัปเดตเวลาที่มีการใช้งาน session
+        """
+        self.last_activity = _now()
+
+
+# =======================================================================
+# ที่เก็บ session แบบไฟล์ (session.json สำหรับข้อมูลของ session และ messages.jsonl สำหรับข้อความ)
+# ข้อความถูกเขียนต่อท้าย log ทีละรายการ (append-only) จึงใช้เวลาเท่าเดิมทุกรอบไม่ว่าประวัติจะยาวเท่าไร
+# session.json มีขนาดเล็กและถูกเขียนแบบ atomic (เขียนไฟล์ชั่วคราวแล้วแทนที่)
+# บรรทัดสุดท้ายของ log ที่เขียนไม่สมบูรณ์ (โปรแกรมหยุดกลางคัน) จะถูกตัดทิ้งเมื่อโหลด session
+# =======================================================================
+class JsonSessionManager:
+    def __init__(self, base_dir: str, on_delete: Optional[Callable[[str], Any]] = None):
+        """
+        ตัวสร้างสำหรับ JsonSessionManager
+        Parameters:
+            base_dir (str): โฟลเดอร์หลักสำหรับเก็บ session
+            on_delete: ฟังก์ชันที่ถูกเรียกพร้อม session_id เมื่อ session ถูกลบ (เช่น ปล่อยการอ้างอิงกราฟ)
+        """
+        # กำหนดโฟลเดอร์หลักสำหรับเก็บ session
+        self.base_dir = base_dir
+        self.on_delete = on_delete
+        # lock สำหรับป้องกันการเขียน log ของ session เดียวกันพร้อมกันจากหลาย thread
+        self._lock = threading.RLock()
+        # ตรวจสอบให้แน่ใจว่าโฟลเดอร์หลักมีอยู่ ถ้าไม่มีให้สร้างใหม่
+        self.ensure_base_dir()
+
+    def ensure_base_dir(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def get_session_dir(self, session_id):
+        # คืนค่าเส้นทางของ session ตาม session_id
+        return os.path.join(self.base_dir, session_id)
+
+    def _log_path(self, session_id: str) -> str:
+        return os.path.join(self.get_session_dir(session_id), LOG_FILENAME)
+
+    def create_session(self):
+        # สร้าง session ใหม่และบันทึกลงในระบบ
+        session = Session()
+        session_dir = self.get_session_dir(session.session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        self.save_session(session)
+        return session
+
+    # -------------------------------------------------------------------
+    # การเขียนไฟล์
+    # -------------------------------------------------------------------
+    def _write_meta(self, session: Session, log_records: int) -> None:
+        # เขียน session.json (ไม่รวมข้อความ) ลงไฟล์ชั่วคราวแล้วแทนที่ เพื่อป้องกันไฟล์เสียหายหากโปรแกรมหยุดกลางคัน
+        session_dir = self.get_session_dir(session.session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        session_file = os.path.join(session_dir, SESSION_FILENAME)
+        tmp_path = f"{session_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'session_id': session.session_id,
+                'created_at': session.created_at,
+                'file_path': session.file_path,
+                'file_hash': session.file_hash,
+                'file_name': session.file_name,
+                'last_activity': session.last_activity,
+                'message_count': session.message_count,
+                'log_records': log_records,
+            }, f)
+        os.replace(tmp_path, session_file)
+
+    def _append_records(self, session_id: str, records: List[dict]) -> None:
+        # เขียน record ต่อท้าย log ในการเขียนครั้งเดียว (แต่ละ record คือหนึ่งบรรทัด JSON)
+        if not records:
+            return
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(self._log_path(session_id), 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            if SESSION_LOG_FSYNC:
+                os.fsync(f.fileno())
+
+    def _read_meta(self, session_id: str) -> Optional[dict]:
+        session_file = os.path.join(self.get_session_dir(session_id), SESSION_FILENAME)
+        if not os.path.exists(session_file):
+            return None
+        with open(session_file, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return None
+
+    def _read_log(self, session_id: str, repair: bool = True) -> Tuple[List[dict], int]:
+        """
+        อ่าน log ของ session และสร้างรายการข้อความจาก record ทั้งหมดตามลำดับ
+        บรรทัดที่เขียนไม่สมบูรณ์ท้ายไฟล์จะถูกตัดทิ้ง (crash recovery)
+        Parameters:
+            repair (bool): ตัดข้อมูลที่ไม่สมบูรณ์ออกจากไฟล์ log (False จะอ่านอย่างเดียวโดยไม่แก้ไขไฟล์)
+        Returns:
+            tuple ของรายการข้อความ และจำนวน record ที่ถูกต้องใน log
+        """
+        path = self._log_path(session_id)
+        if not os.path.exists(path):
+            return [], 0
+        messages: List[dict] = []
+        records = 0
+        valid_bytes = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "truncate":
+                    del messages[record.get("count", 0):]
+                else:
+                    messages.append(record["message"])
+                records += 1
+                valid_bytes += len(line)
+        if repair and valid_bytes < os.path.getsize(path):
+            logging.error(f"Recovering message log of session {session_id}: "
+                          f"dropping {os.path.getsize(path) - valid_bytes} bytes of incomplete data")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return messages, records
+
+    def compact(self, session_id: str) -> None:
+        """
+        เขียน log ของ session ใหม่ให้เหลือเฉพาะข้อความปัจจุบัน (ตัด record ที่ถูกล้างไปแล้วออก)
+        """
+        with self._lock:
+            session = self.load_session(session_id)
+            if session is None:
+                return
+            messages = session.messages
+            path = self._log_path(session_id)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps({"message": message}, ensure_ascii=False) + "\n" for message in messages)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            session.message_count = len(messages)
+            self._write_meta(session, len(messages))
+
+    def save_session(self, session):
+        """
+        บันทึกข้อมูลของ session และเขียนต่อท้ายเฉพาะข้อความที่ยังไม่ถูกบันทึก
+        (ข้อความที่บันทึกแล้วถูกลบผ่าน clear_messages() เท่านั้น)
+        """
+        with self._lock:
+            meta = self._read_meta(session.session_id) or {}
+            stored = session.message_count
+            log_records = meta.get('log_records', 0)
+            records = []
+            if session.messages_loaded() and len(session.messages) > stored:
+                records.extend({"message": message} for message in session.messages[stored:])
+                session.message_count = len(session.messages)
+            self._append_records(session.session_id, records)
+            self._write_meta(session, log_records + len(records))
+            # compact เมื่อ record ที่ไม่ถูกใช้แล้วมีมากกว่าข้อความปัจจุบันหรือเกิน SESSION_LOG_COMPACT_RECORDS
+            dead = log_records + len(records) - session.message_count
+            if dead > 0 and (dead > session.message_count or dead >= SESSION_LOG_COMPACT_RECORDS):
+                self.compact(session.session_id)
+
+    def append_message(self, session, message: dict) -> None:
+        """
+        เพิ่มข้อความลงใน session และบันทึกต่อท้าย log (เวลาที่ใช้คงที่ไม่ขึ้นกับจำนวนข้อความเดิม)
+        """
+        session.messages.append(message)
+        self.save_session(session)
+
+    def clear_messages(self, session_id: str) -> None:
+        """
+        ลบข้อความทั้งหมดของ session (บันทึก record "truncate" แล้ว compact log)
+        """
+        with self._lock:
+            session = self.load_session(session_id)
+            if session is None:
+                return
+            meta = self._read_meta(session_id) or {}
+            self._append_records(session_id, [{"op": "truncate", "count": 0}])
+            session.message_count = 0
+            self._write_meta(session, meta.get('log_records', 0) + 1)
+            self.compact(session_id)
+
+    def load_messages(self, session_id: str, limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        # log ต้องถูกอ่านทั้งไฟล์ (record "truncate" อาจลบข้อความก่อนหน้า) จึงเลือกช่วงหลังจากอ่านแล้ว
+        with self._lock:
+            messages = self._read_log(session_id)[0]
+        return messages[offset:offset + limit] if limit is not None else messages[offset:]
+
+    def load_session(self, session_id):
+        # โหลด session จากไฟล์ session.json ตาม session_id ที่ระบุ (ข้อความจะถูกโหลดจาก log เมื่อถูกใช้งานครั้งแรก)
+        data = self._read_meta(session_id)
+        if data is None:
+            return None
+        if 'messages' in data:
+            # session รูปแบบเดิมที่เก็บข้อความทั้งหมดไว้ใน session.json ให้ย้ายข้อความไปยัง log
+            return self._upgrade_legacy(data)
+        def load_messages() -> List[dict]:
+            # log คือข้อมูลหลัก (session.json อาจยังไม่ถูกอัปเดตหากโปรแกรมหยุดหลังเขียน log)
+            messages = self.load_messages(session_id)
+            session.message_count = len(messages)
+            return messages
+
+        session = Session(session_id=data['session_id'], message_loader=load_messages)
+        session.created_at = data['created_at']
+        session.file_path = data['file_path']
+        session.file_hash = data.get('file_hash')
+        session.file_name = data.get('file_name')
+        session.last_activity = data.get('last_activity', _now())
+        session.message_count = data.get('message_count', 0)
+        return session
+
+    def _upgrade_legacy(self, data: dict) -> Session:
+        with self._lock:
+            session = Session.from_dict(data)
+            session.message_count = 0
+            if os.path.exists(self._log_path(session.session_id)):
+                os.remove(self._log_path(session.session_id))
+            self.save_session(session)
+            return session
+
+    def delete_session(self, session_id):
+        # ลบโฟลเดอร์ของ session ที่ระบุ (ลบไฟล์ทั้งหมดภายใน session นั้น)
+        session_dir = self.get_session_dir(session_id)
+        if os.path.exists(session_dir):
+            shutil.rmtree(session_dir)
+        if self.on_delete:
+            self.on_delete(session_id)
+
+    def _all_sessions(self) -> List[Session]:
+        if not os.path.exists(self.base_dir):
+            return []
+        sessions = []
+        for session_id in os.listdir(self.base_dir):
+            session = self.load_session(session_id)
+            if session:
+                sessions.append(session)
+        return sorted(sessions, key=lambda x: x.last_activity, reverse=True)
+
+    def list_sessions(self, limit: Optional[int] = None, offset: int = 0) -> List[Session]:
+        # คืนค่ารายการ session เรียงลำดับตามเวลาที่มีการใช้งานล่าสุด (ล่าสุดมาก่อน)
+        # รูปแบบนี้ต้องอ่านไฟล์ session.json ทุกไฟล์ จึงช้าเมื่อมี session จำนวนมาก (ใช้ SESSION_BACKEND=sqlite แทน)
+        sessions = self._all_sessions()
+        return sessions[offset:offset + limit] if limit is not None else sessions[offset:]
+
+    def count_sessions(self) -> int:
+        if not os.path.exists(self.base_dir):
+            return 0
+        return sum(os.path.exists(os.path.join(self.base_dir, name, SESSION_FILENAME))
+                   for name in os.listdir(self.base_dir))
+
+
+# =======================================================================
+# ที่เก็บ session แบบ SQLite (WAL mode)
+# =======================================================================
+_SESSION_COLUMNS = "session_id, created_at, last_activity, file_path, file_hash, file_name, message_count"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    last_activity TEXT NOT NULL,
+    file_path TEXT,
+    file_hash TEXT,
+    file_name TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions (last_activity DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    timestamp TEXT,
+    content TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+"""
+
+
+class SqliteSessionManager:
+    """
+    คลาสสำหรับจัดการ session ในฐานข้อมูล SQLite
+    - หนึ่ง connection ต่อ thread (Streamlit รัน script แต่ละรอบใน thread ต่างกัน)
+    - WAL mode ทำให้การอ่านไม่ถูก block ระหว่างการเขียน
+    - append_message() เขียนเฉพาะข้อความใหม่ (ข้อความเดิมไม่ถูกเขียนซ้ำ) และ save_session() เขียนเฉพาะข้อมูลของ session
+    """
+
+    def __init__(self, base_dir: str, db_path: Optional[str] = None,
+                 on_delete: Optional[Callable[[str], Any]] = None):
+        """
+        ตัวสร้างสำหรับ SqliteSessionManager
+        Parameters:
+            base_dir (str): โฟลเดอร์หลักสำหรับเก็บ session (ไฟล์ที่อัปโหลดยังถูกเก็บใน base_dir/<session_id>)
+            db_path (str): เส้นทางของไฟล์ฐานข้อมูล (ค่าเริ่มต้นคือ base_dir/SESSION_DB_FILENAME)
+            on_delete: ฟังก์ชันที่ถูกเรียกพร้อม session_id เมื่อ session ถูกลบ (เช่น ปล่อยการอ้างอิงกราฟ)
+        """
+        self.base_dir = base_dir
+        self.db_path = db_path or os.path.join(base_dir, SESSION_DB_FILENAME)
+        self.on_delete = on_delete
+        self._local = threading.local()
+        self.ensure_base_dir()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            # ฐานข้อมูลที่สร้างก่อนมี BlobStore ยังไม่มีคอลัมน์ file_hash และ file_name
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            for column in ("file_hash", "file_name"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} TEXT")
+
+    def ensure_base_dir(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def get_session_dir(self, session_id):
+        # คืนค่าเส้นทางของโฟลเดอร์สำหรับไฟล์ของ session ตาม session_id
+        return os.path.join(self.base_dir, session_id)
+
+    def create_session(self):
+        # สร้าง session ใหม่และบันทึกลงในระบบ
+        session = Session()
+        os.makedirs(self.get_session_dir(session.session_id), exist_ok=True)
+        self.save_session(session)
+        return session
+
+    def save_session(self, session):
+        """
+        บันทึกข้อมูลของ session (ไม่รวมข้อความ)
+        ข้อความถูกเขียนผ่าน append_message() และล้างผ่าน clear_messages() เท่านั้น
+        object ของ session ที่โหลดไว้ก่อน (ข้อความไม่ครบ) จึงไม่ทำให้ข้อความที่บันทึกแล้วหายไป
+        """
+        conn = self._connect()
+        with conn:
+            self._upsert_session(conn, session)
+            session.message_count = conn.execute("SELECT message_count FROM sessions WHERE session_id = ?",
+                                                 (session.session_id,)).fetchone()[0]
+
+    def _upsert_session(self, conn: sqlite3.Connection, session) -> None:
+        # message_count ของแถวที่มีอยู่แล้วไม่ถูกเขียนทับ (ถูกปรับโดย append_message() และ clear_messages())
+        conn.execute(
+            "INSERT INTO sessions (session_id, created_at, last_activity, file_path, file_hash, file_name, "
+            "message_count) VALUES (?, ?, ?, ?, ?, ?, 0) ON CONFLICT (session_id) DO UPDATE SET "
+            "last_activity = excluded.last_activity, file_path = excluded.file_path, "
+            "file_hash = excluded.file_hash, file_name = excluded.file_name",
+            (session.session_id, session.created_at, session.last_activity, session.file_path,
+             session.file_hash, session.file_name),
+        )
+
+    def _insert_message(self, conn: sqlite3.Connection, session_id: str, message: dict) -> None:
+        # seq ถัดไปถูกคำนวณในคำสั่งเดียวกับการเขียน จึงไม่ชนกับข้อความที่ถูกเพิ่มจาก thread หรือ process อื่น
+        conn.execute(
+            "INSERT INTO messages (session_id, seq, role, timestamp, content) "
+            "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ? FROM messages WHERE session_id = ?",
+            (session_id, message.get("role", ""), message.get("timestamp"),
+             json.dumps(message, ensure_ascii=False), session_id),
+        )
+        conn.execute("UPDATE sessions SET message_count = message_count + 1 WHERE session_id = ?", (session_id,))
+
+    def append_message(self, session, message: dict) -> None:
+        """
+        เพิ่มข้อความลงใน session และบันทึกเฉพาะข้อความนั้นในหนึ่ง transaction
+        (เวลาที่ใช้คงที่ไม่ขึ้นกับจำนวนข้อความเดิม และไม่ต้องโหลดข้อความเดิมของ session)
+        """
+        conn = self._connect()
+        with conn:
+            self._upsert_session(conn, session)
+            self._insert_message(conn, session.session_id, message)
+            session.message_count = conn.execute("SELECT message_count FROM sessions WHERE session_id = ?",
+                                                 (session.session_id,)).fetchone()[0]
+        if session.messages_loaded():
+            session.messages.append(message)
+
+    def clear_messages(self, session_id: str) -> None:
+        """
+        ลบข้อความทั้งหมดของ session (ใช้เมื่อผู้ใช้ล้างประวัติการสนทนา)
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("UPDATE sessions SET message_count = 0 WHERE session_id = ?", (session_id,))
+
+    def _import_session(self, session, messages: List[dict]) -> None:
+        # บันทึก session พร้อมข้อความทั้งหมดในหนึ่ง transaction (ใช้โดย migrate_json_sessions)
+        conn = self._connect()
+        with conn:
+            self._upsert_session(conn, session)
+            for message in messages:
+                self._insert_message(conn, session.session_id, message)
+        session.message_count = len(messages)
+
+    def load_messages(self, session_id: str, limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        """
+        โหลดข้อความของ session ตามลำดับ (เลือกช่วงได้ด้วย limit และ offset)
+        """
+        rows = self._connect().execute(
+            "SELECT content FROM messages WHERE session_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+            (session_id, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return [json.loads(content) for (content,) in rows]
+
+    def _session_from_row(self, row) -> Session:
+        session_id, created_at, last_activity, file_path, file_hash, file_name, message_count = row
+        session = Session(session_id=session_id, message_loader=lambda: self.load_messages(session_id))
+        session.created_at = created_at
+        session.last_activity = last_activity
+        session.file_path = file_path
+        session.file_hash = file_hash
+        session.file_name = file_name
+        session.message_count = message_count
+        return session
+
+    def load_session(self, session_id):
+        # โหลดข้อมูลของ session (ข้อความจะถูกโหลดเมื่อเข้าถึง session.messages ครั้งแรก)
+        row = self._connect().execute(
+            f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        return self._session_from_row(row) if row else None
+
+    def delete_session(self, session_id):
+        # ลบข้อมูลของ session (รวมข้อความ) และโฟลเดอร์ไฟล์ของ session
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        session_dir = self.get_session_dir(session_id)
+        if os.path.exists(session_dir):
+            shutil.rmtree(session_dir)
+        if self.on_delete:
+            self.on_delete(session_id)
+
+    def list_sessions(self, limit: Optional[int] = None, offset: int = 0) -> List[Session]:
+        # คืนค่ารายการ session เรียงตามเวลาที่มีการใช้งานล่าสุด (ล่าสุดมาก่อน) โดยไม่โหลดข้อความ
+        rows = self._connect().execute(
+            f"SELECT {_SESSION_COLUMNS} FROM sessions "
+            "ORDER BY last_activity DESC LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        ).fetchall()
+        return [self._session_from_row(row) for row in rows]
+
+    def count_sessions(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_manager(base_dir: str, backend: str = SESSION_BACKEND,
+                           on_delete: Optional[Callable[[str], Any]] = None):
+    """
+    สร้างที่เก็บ session ตาม backend ที่เลือก
+    Parameters:
+        base_dir (str): โฟลเดอร์หลักสำหรับเก็บ session
+        backend (str): "sqlite" (ค่าเริ่มต้น) หรือ "json"
+        on_delete: ฟังก์ชันที่ถูกเรียกพร้อม session_id เมื่อ session ถูกลบ
+    Returns:
+        instance ของ SqliteSessionManager หรือ JsonSessionManager
+    """
+    if backend == "json":
+        return JsonSessionManager(base_dir, on_delete=on_delete)
+    if backend != "sqlite":
+        logging.error(f"Unknown SESSION_BACKEND '{backend}', using sqlite")
+    return SqliteSessionManager(base_dir, on_delete=on_delete)
+
+
+def migrate_json_sessions(base_dir: str, db_path: Optional[str] = None) -> Dict[str, int]:
+    """
+    ย้าย session จากไฟล์ session.json ไปยังฐานข้อมูล SQLite (ไฟล์ JSON เดิมจะไม่ถูกลบหรือแก้ไข)
+    session ที่มีอยู่ในฐานข้อมูลแล้วจะถูกข้าม จึงรันซ้ำได้อย่างปลอดภัย
+    Parameters:
+        base_dir (str): โฟลเดอร์หลักที่เก็บ session แบบ JSON
+        db_path (str): เส้นทางของไฟล์ฐานข้อมูล (ค่าเริ่มต้นคือ base_dir/SESSION_DB_FILENAME)
+    Returns:
+        dict ของจำนวน session ที่ migrated, skipped (มีอยู่แล้ว) และ failed (ไฟล์เสียหาย)
+    """
+    source = JsonSessionManager(base_dir)
+    target = SqliteSessionManager(base_dir, db_path=db_path)
+    result = {"migrated": 0, "skipped": 0, "failed": 0}
+    for name in sorted(os.listdir(base_dir)):
+        if not os.path.exists(os.path.join(base_dir, name, SESSION_FILENAME)):
+            continue
+        if target.load_session(name) is not None:
+            result["skipped"] += 1
+            continue
+        # อ่านไฟล์โดยตรงแทน source.load_session() ซึ่งจะแปลง session รูปแบบเดิมและเขียนไฟล์ใหม่
+        try:
+            with open(os.path.join(base_dir, name, SESSION_FILENAME), 'r') as f:
+                data = json.load(f)
+            if 'messages' not in data:
+                data['messages'] = source._read_log(name, repair=False)[0]
+            session = Session.from_dict(data)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Could not migrate session {name}: invalid {SESSION_FILENAME} ({e})")
+            result["failed"] += 1
+            continue
+        target._import_session(session, session.messages)
+        result["migrated"] += 1
+    return result
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน: python session_store.py migrate [sessions_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python session_store.py migrate [sessions_dir]")
+        sys.exit(1)
+    print(json.dumps(migrate_json_sessions(sys.argv[2] if len(sys.argv) > 2 else "sessions"), indent=2))
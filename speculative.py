@@ -0,0 +1,168 @@
+# -----------------------------------------------------------------------
+# การเรียก tool ล่วงหน้าแบบขนาน (speculative dispatch)
+# เมื่อ router ไม่มั่นใจว่าคำถามควรไปที่ agent ใด จะเริ่มรัน analysis_agent และ pandas_agent
+# พร้อมกันใน thread pool ตั้งแต่ก่อนที่ supervisor จะตัดสินใจ เมื่อ supervisor เรียก tool ใดด้วยคำถามเดิมของผู้ใช้
+# tool นั้นจะรอผลลัพธ์ที่รันไว้แล้วแทนการเริ่มรันใหม่ ส่วน tool ที่ไม่ถูกใช้ (หรือถูกเรียกด้วย input อื่น) จะถูกยกเลิก
+# (แต่ละ tool รันภายใต้ deadline ย่อยของตัวเอง จึงหยุด tool ที่กำลังรันอยู่ได้โดยไม่กระทบ request หลัก)
+# -----------------------------------------------------------------------
+import contextvars
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+from agent_trace import TraceCallbackHandler
+from deadline import Deadline, current_deadline, deadline_callbacks
+from loop_guard import normalized_input
+from metrics import metrics_callbacks, track_stage
+
+# ค่าเริ่มต้นของ speculative dispatch (ปรับได้ผ่าน environment variables)
+SPECULATIVE_DISPATCH = os.getenv("SPECULATIVE_DISPATCH", "false").lower() == "true"  # เปิดใช้งาน (opt-in)
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 4))                       # จำนวน thread สูงสุดที่ใช้ร่วมกันทั้ง process
+
+_executor: Optional[ThreadPoolExecutor] = None
+_current_dispatch: ContextVar[Optional["SpeculativeDispatch"]] = ContextVar("current_speculative_dispatch", default=None)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+    return _executor
+
+
+class SpeculativeDispatch:
+    """
+    context manager สำหรับเริ่มรัน tool หลายตัวล่วงหน้าแบบขนาน
+    tool ที่ห่อด้วย with_speculation() จะใช้ผลลัพธ์ที่รันไว้แล้วเมื่อถูกเรียกครั้งแรกภายใน context
+    เฉพาะเมื่อ Action Input ตรงกับคำถามเดิมของผู้ใช้ (หลัง normalize) เพราะผลลัพธ์ล่วงหน้าถูกสร้างจากคำถามนั้น
+
+    ตัวอย่าง:
+        with SpeculativeDispatch({"pandas_agent": self.query_dataframe}, user_input, trace) as dispatch:
+            agent_executor.invoke(...)
+        dispatch.outcome  # {"pandas_agent": "used"}
+    """
+
+    def __init__(self, funcs: Dict[str, Callable[..., Any]], user_input: str,
+                 trace: Optional[TraceCallbackHandler] = None):
+        """
+        ตัวสร้างสำหรับ SpeculativeDispatch
+        Parameters:
+            funcs (dict): ชื่อ tool และฟังก์ชันของ tool (รับ user_input และ callbacks)
+            user_input (str): คำถามของผู้ใช้ที่ใช้รัน tool ล่วงหน้า
+            trace (TraceCallbackHandler): trace หลักของ request (event ของ tool ที่ถูกใช้จะถูกเพิ่มเข้าไป)
+        """
+        self.funcs = funcs
+        self.user_input = user_input
+        self.trace = trace
+        self.outcome: Dict[str, str] = {}
+        self._futures: Dict[str, Future] = {}
+        self._traces: Dict[str, TraceCallbackHandler] = {}
+        self._deadlines: Dict[str, Deadline] = {}
+        self._token = None
+
+    def __enter__(self) -> "SpeculativeDispatch":
+        executor = _get_executor()
+        parent = current_deadline()
+        for name, func in self.funcs.items():
+            # แต่ละ tool มี trace ของตัวเอง เพื่อไม่ให้ event ของผลลัพธ์ที่ถูกทิ้งปนอยู่ใน trace หลัก
+            trace = TraceCallbackHandler(started=self.trace.started if self.trace else None)
+            # และมี deadline ย่อยของตัวเอง (หมดเวลาหรือถูกยกเลิกพร้อม request หลัก) สำหรับยกเลิกเมื่อไม่ถูกใช้
+            deadline = parent.child() if parent is not None else Deadline(None)
+            # copy_context() ทำให้ metrics ของ run ปัจจุบันติดตามไปยัง thread ของ pool
+            context = contextvars.copy_context()
+            self._traces[name] = trace
+            self._deadlines[name] = deadline
+            self._futures[name] = executor.submit(context.run, self._run, func, deadline, trace)
+        self._token = _current_dispatch.set(self)
+        logging.info(f"Speculative dispatch started: {list(self.funcs)}")
+        return self
+
+    def _run(self, func: Callable[..., Any], deadline: Deadline, trace: TraceCallbackHandler) -> Any:
+        # รันใน thread ของ pool: deadline ย่อยถูกใช้ทั้งใน callback ของ agent, การรอคิวของ LLM และการรันโค้ด
+        with deadline.activate():
+            callbacks = metrics_callbacks() + deadline_callbacks() + [trace]
+            return func(self.user_input, callbacks=callbacks)
+
+    def take(self, name: str) -> Optional[Future]:
+        """
+        คืนค่า future ของ tool ที่ระบุ (ครั้งแรกที่ถูกเรียกเท่านั้น) หรือ None หากไม่มีการรันล่วงหน้า
+        """
+        future = self._futures.pop(name, None)
+        if future is not None:
+            self._deadlines.pop(name, None)
+            self.outcome[name] = "used"
+        return future
+
+    def matches(self, user_input: str) -> bool:
+        """
+        True เมื่อ input ที่ supervisor ส่งให้ tool ตรงกับคำถามที่ใช้รัน tool ล่วงหน้า (หลัง normalize)
+        """
+        return normalized_input(user_input) == normalized_input(self.user_input)
+
+    def discard(self, name: str) -> None:
+        """
+        ยกเลิกการรันล่วงหน้าของ tool ที่ระบุ (ใช้เมื่อ supervisor เรียก tool ด้วย input อื่น)
+        """
+        future = self._futures.pop(name, None)
+        if future is not None:
+            self._cancel(name, future, self._deadlines.pop(name))
+            self._traces.pop(name, None)
+
+    def _cancel(self, name: str, future: Future, deadline: Deadline) -> None:
+        # tool ที่ยังไม่เริ่มรันจะถูกนำออกจากคิว ส่วนที่กำลังรันอยู่จะถูกหยุดผ่าน deadline ย่อย
+        # (ผลลัพธ์ของ tool ที่รันเสร็จไปแล้วจะถูกทิ้งไป)
+        if future.done():
+            self.outcome[name] = "discarded"
+            return
+        if not future.cancel():
+            deadline.cancel()
+        self.outcome[name] = "cancelled"
+
+    def merge_trace(self, name: str) -> None:
+        """
+        เพิ่ม event ของ tool ที่ถูกใช้ลงใน trace หลัก (เรียกหลังจาก tool รันเสร็จแล้ว)
+        """
+        if self.trace is not None and name in self._traces:
+            self.trace.events.extend(self._traces.pop(name).events)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_dispatch.reset(self._token)
+        # ยกเลิก tool ที่ไม่ถูกใช้
+        for name, future in self._futures.items():
+            self._cancel(name, future, self._deadlines[name])
+        self._futures.clear()
+        self._deadlines.clear()
+        logging.info(f"Speculative dispatch finished: {self.outcome}")
+
+
+def with_speculation(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    ห่อฟังก์ชันของ tool ให้ใช้ผลลัพธ์จาก SpeculativeDispatch ที่ active อยู่ (ถ้ามี)
+    Parameters:
+        name (str): ชื่อ tool
+        func (Callable): ฟังก์ชันของ tool ที่รับ user_input และ callbacks
+    Returns:
+        ฟังก์ชันที่มี signature เดียวกัน (สำหรับใช้เป็น func ของ Tool)
+    """
+    def run_tool(user_input: str, callbacks=None):
+        dispatch = _current_dispatch.get()
+        future = None
+        if dispatch is not None:
+            if dispatch.matches(user_input):
+                future = dispatch.take(name)
+            else:
+                # supervisor เรียก tool ด้วย input อื่น: ผลลัพธ์ล่วงหน้าใช้ไม่ได้ จึงยกเลิกแล้วรัน tool ด้วย input ใหม่
+                dispatch.discard(name)
+        if future is not None:
+            try:
+                with track_stage("speculative_wait"):
+                    result = future.result()
+                dispatch.merge_trace(name)
+                return result
+            except Exception as e:
+                logging.error(f"Speculative call of {name} failed, running it again: {e}")
+        return func(user_input, callbacks=callbacks)
+
+    return run_tool
@@ -0,0 +1,208 @@
+# -----------------------------------------------------------------------
+# การจับ output ที่พิมพ์ออก stdout แบบแยกตาม thread
+# contextlib.redirect_stdout เปลี่ยน sys.stdout ของทั้ง process ทำให้ output ของการรันโค้ด
+# พร้อมกันหลาย session ปนกัน โมดูลนี้ติดตั้งตัวกระจาย stdout ที่ส่งข้อความไปยังปลายทาง
+# ของ thread ที่กำลังพิมพ์อยู่ (หรือ stdout เดิม หาก thread นั้นไม่ได้จับ output)
+# และ BoundedOutput สำหรับจำกัดขนาด output ที่เก็บไว้ในหน่วยความจำ
+# -----------------------------------------------------------------------
+import contextlib
+import io
+import logging
+import os
+import sys
+import threading
+import uuid
+from typing import Optional, TextIO
+
+# ค่าเริ่มต้นของการจำกัดขนาด output (ปรับได้ผ่าน environment variables)
+MAX_OUTPUT_CHARS = int(os.getenv("MAX_OUTPUT_CHARS", 20000))            # จำนวนตัวอักษรสูงสุดที่เก็บในหน่วยความจำ (ส่วนต้น + ส่วนท้าย)
+OUTPUT_TAIL_CHARS = int(os.getenv("OUTPUT_TAIL_CHARS", 4000))           # จำนวนตัวอักษรของส่วนท้ายที่เก็บไว้เมื่อ output เกินขนาด
+MAX_OUTPUT_SPILL_MB = float(os.getenv("MAX_OUTPUT_SPILL_MB", 50))       # ขนาดสูงสุดของไฟล์ที่เก็บ output ฉบับเต็ม
+OUTPUT_SPILL_DIR = os.getenv("OUTPUT_SPILL_DIR", os.path.join("artifacts", "outputs"))  # โฟลเดอร์สำหรับเก็บ output ฉบับเต็ม
+
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """
+    ตัวแทนของ sys.stdout ที่ส่งข้อความไปยังปลายทางของแต่ละ thread
+    """
+
+    def __init__(self, fallback: TextIO):
+        self._fallback = fallback
+        self._local = threading.local()
+
+    @property
+    def target(self) -> TextIO:
+        return getattr(self._local, "target", None) or self._fallback
+
+    def set_target(self, target):
+        previous = getattr(self._local, "target", None)
+        self._local.target = target
+        return previous
+
+    def write(self, text: str) -> int:
+        return self.target.write(text)
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush(self) -> None:
+        self.target.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    @property
+    def encoding(self):
+        return getattr(self._fallback, "encoding", "utf-8")
+
+
+_install_lock = threading.Lock()
+
+
+def _install() -> _ThreadLocalStdout:
+    # ติดตั้งตัวกระจาย stdout หาก sys.stdout ปัจจุบันยังไม่ใช่ (เรียกซ้ำได้อย่างปลอดภัย)
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStdout):
+            sys.stdout = _ThreadLocalStdout(sys.stdout)
+        return sys.stdout
+
+
+@contextlib.contextmanager
+def capture_stdout(target: TextIO):
+    """
+    context manager สำหรับจับข้อความที่ thread ปัจจุบันพิมพ์ออก stdout ไปยัง target
+    โดยไม่กระทบ output ของ thread อื่นที่ทำงานพร้อมกัน
+    Parameters:
+        target: ปลายทางที่รองรับเมธอด write() (เช่น io.StringIO)
+    """
+    router = _install()
+    previous = router.set_target(target)
+    try:
+        yield target
+    finally:
+        router.set_target(previous)
+
+
+class BoundedOutput(io.TextIOBase):
+    """
+    buffer สำหรับจับ output ที่มีขนาดจำกัด
+    - เก็บส่วนต้นของ output ไว้ในหน่วยความจำจนถึง max_chars - tail_chars ตัวอักษร
+    - เมื่อเกินขนาด จะเขียน output ฉบับเต็มต่อลงไฟล์ (spill) และเก็บเฉพาะส่วนท้ายไว้ในหน่วยความจำ
+    - getvalue() คืนค่าสรุปแบบส่วนต้น/ส่วนท้าย พร้อมจำนวนตัวอักษรและจำนวนบรรทัดที่ถูกตัดออก
+    """
+
+    def __init__(self, max_chars: Optional[int] = None, tail_chars: Optional[int] = None,
+                 spill_dir: Optional[str] = None, max_spill_bytes: Optional[int] = None):
+        """
+        ตัวสร้างสำหรับ BoundedOutput
+        Parameters:
+            max_chars (int): จำนวนตัวอักษรสูงสุดที่เก็บในหน่วยความจำ
+            tail_chars (int): จำนวนตัวอักษรของส่วนท้ายที่เก็บไว้เมื่อ output เกินขนาด
+            spill_dir (str): โฟลเดอร์สำหรับเขียน output ฉบับเต็มเมื่อเกินขนาด (None = ไม่เขียนไฟล์)
+            max_spill_bytes (int): ขนาดสูงสุดของไฟล์ output ฉบับเต็ม
+        """
+        self.max_chars = MAX_OUTPUT_CHARS if max_chars is None else max_chars
+        self.tail_chars = min(OUTPUT_TAIL_CHARS if tail_chars is None else tail_chars, self.max_chars // 2)
+        self.head_limit = self.max_chars - self.tail_chars
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = int(MAX_OUTPUT_SPILL_MB * 1024 * 1024) if max_spill_bytes is None else max_spill_bytes
+        self.total_chars = 0
+        self.total_lines = 0
+        self.artifact_path: Optional[str] = None
+        self._head = io.StringIO()
+        self._head_chars = 0
+        self._tail = ""
+        self._truncated = False
+        self._spill = None
+        self._spill_bytes = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self._truncated
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not text:
+            return 0
+        self.total_chars += len(text)
+        self.total_lines += text.count("\n")
+
+        if not self._truncated:
+            room = self.head_limit - self._head_chars
+            if len(text) <= room:
+                self._head.write(text)
+                self._head_chars += len(text)
+                return len(text)
+            # output เกินขนาด: เก็บส่วนต้นเท่าที่เหลือ แล้วเริ่มเขียนฉบับเต็มลงไฟล์
+            self._head.write(text[:room])
+            self._head_chars += room
+            self._truncated = True
+            self._open_spill()
+            self._write_spill(self._head.getvalue())
+            self._append_tail(text[room:])
+            self._write_spill(text[room:])
+            return len(text)
+
+        self._append_tail(text)
+        self._write_spill(text)
+        return len(text)
+
+    def _append_tail(self, text: str) -> None:
+        self._tail = (self._tail + text)[-self.tail_chars:] if self.tail_chars else ""
+
+    def _open_spill(self) -> None:
+        if not self.spill_dir:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.artifact_path = os.path.join(self.spill_dir, f"output_{uuid.uuid4().hex}.txt")
+            self._spill = open(self.artifact_path, "wb")
+        except OSError as e:
+            logging.error(f"Error opening output spill file: {e}")
+            self._spill = None
+            self.artifact_path = None
+
+    def _write_spill(self, text: str) -> None:
+        if self._spill is None or self._spill_bytes >= self.max_spill_bytes:
+            return
+        # ตัดตามจำนวน bytes ที่เหลือ (ตัวอักษรหนึ่งตัวอาจมีหลาย bytes) โดยไม่ตัดกลางตัวอักษร
+        data = text.encode("utf-8")
+        budget = self.max_spill_bytes - self._spill_bytes
+        if len(data) > budget:
+            data = data[:budget].decode("utf-8", "ignore").encode("utf-8")
+            # ไฟล์ครบขนาดแล้ว ไม่เขียนต่อแม้ยังเหลือที่ไม่พอสำหรับตัวอักษรถัดไป
+            self._spill_bytes = self.max_spill_bytes
+        else:
+            self._spill_bytes += len(data)
+        self._spill.write(data)
+
+    def getvalue(self) -> str:
+        """
+        คืนค่า output ทั้งหมดหากไม่เกินขนาด หรือสรุปส่วนต้น/ส่วนท้ายพร้อมจำนวนที่ถูกตัดออก
+        """
+        head = self._head.getvalue()
+        if not self._truncated:
+            return head
+        # ตัดส่วนต้นและส่วนท้ายให้ตรงกับขอบบรรทัด เพื่อไม่ให้แถวของตารางถูกตัดครึ่ง
+        tail = self._tail
+        if "\n" in head:
+            head = head[: head.rfind("\n") + 1]
+        if "\n" in tail[:-1]:
+            tail = tail[tail.find("\n") + 1:]
+        omitted_chars = self.total_chars - len(head) - len(tail)
+        omitted_lines = self.total_lines - head.count("\n") - tail.count("\n")
+        note = ("" if head.endswith("\n") else "\n") + (f"... [output truncated: {omitted_chars:,} characters / ~{omitted_lines:,} lines omitted "
+                f"out of {self.total_chars:,} characters / {self.total_lines:,} lines")
+        if self.artifact_path:
+            note += f"; full output saved to {self.artifact_path}"
+        note += "] ...\n"
+        return head + note + tail
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        super().close()
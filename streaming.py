@@ -0,0 +1,199 @@
+# -----------------------------------------------------------------------
+# การส่ง token ของ LLM และความคืบหน้าของ agent ไปยังหน้าจอแบบ streaming
+# StreamCallbackHandler รับ token จากทุก LLM ของ request (supervisor, agent ย่อย, คำอธิบาย)
+# แล้วใส่ลงใน queue ที่ thread ของ UI ดึงไปแสดงผลเป็นระยะ
+# StreamView รวม event ที่ดึงมาเป็นข้อความที่พร้อมแสดงผล (ไม่ขึ้นกับ Streamlit)
+# -----------------------------------------------------------------------
+import contextlib
+import os
+import queue
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.utils.json import parse_partial_json
+from pydantic import BaseModel
+
+from metrics import current_stage
+
+# ค่าเริ่มต้นของ streaming (ปรับได้ผ่าน environment variables)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"        # เปิด streaming ของ ChatOpenAI
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"  # ขอจำนวน token ใน chunk สุดท้าย (stream_options)
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", 0.1))           # ความถี่ที่ UI ดึง event มาแสดงผล
+
+_current_stream: ContextVar[Optional["StreamCallbackHandler"]] = ContextVar("current_stream", default=None)
+
+
+class StreamEvent(BaseModel):
+    """
+    โมเดลสำหรับเก็บ event หนึ่งรายการที่ถูกส่งไปยังหน้าจอระหว่างการประมวลผล
+    Attributes:
+        type (str): ประเภทของ event ("token", "tool_start", "tool_end", "status")
+        stage (str): stage ที่สร้าง event (เช่น "supervisor", "pandas_agent", "explanation")
+        content (str): token หรือข้อความของ event
+        run_id (Optional[str]): run id ของการเรียก LLM (ใช้แยก token ของการเรียกที่ทำงานพร้อมกัน)
+        elapsed (float): เวลา (วินาที) นับจากเริ่มการประมวลผล
+    """
+    type: str
+    stage: str
+    content: str = ""
+    run_id: Optional[str] = None
+    elapsed: float = 0.0
+
+
+class StreamCallbackHandler(BaseCallbackHandler):
+    """
+    callback สำหรับส่ง token และความคืบหน้าของ tool ลงใน queue (thread-safe)
+    """
+
+    # รันใน task/thread ที่เรียกโดยตรง เพื่อให้อ่าน stage ปัจจุบันได้ถูกต้องและ token ไม่สลับลำดับ
+    run_inline = True
+
+    def __init__(self):
+        self.queue: "queue.Queue[StreamEvent]" = queue.Queue()
+        self.started = time.perf_counter()
+        self._tools: Dict[UUID, str] = {}
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        context manager สำหรับกำหนดให้ handler นี้เป็น stream ของ request ปัจจุบัน (ดู stream_callbacks())
+        """
+        token = _current_stream.set(self)
+        try:
+            yield self
+        finally:
+            _current_stream.reset(token)
+
+    def record(self, type: str, content: str = "", run_id: Optional[UUID] = None, stage: Optional[str] = None) -> None:
+        """
+        เพิ่ม event ลงใน queue (ใช้ได้ทั้งจาก callback และจากโค้ดที่ต้องการแจ้งความคืบหน้า)
+        stage ของ event คือ stage ปัจจุบันของ metrics หากไม่ได้ระบุ
+        """
+        self.queue.put(StreamEvent(
+            type=type,
+            stage=stage or current_stage(),
+            content=content,
+            run_id=str(run_id) if run_id else None,
+            elapsed=round(time.perf_counter() - self.started, 3),
+        ))
+
+    def drain(self) -> List[StreamEvent]:
+        """
+        ดึง event ทั้งหมดที่อยู่ใน queue ออกมา (ไม่ block)
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if token:
+            self.record("token", token, run_id=run_id)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or ""
+        self._tools[run_id] = name
+        self.record("tool_start", name)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.record("tool_end", self._tools.pop(run_id, ""))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.record("tool_end", self._tools.pop(run_id, ""))
+
+
+def current_stream() -> Optional[StreamCallbackHandler]:
+    """
+    คืนค่า StreamCallbackHandler ของ request ที่กำลังประมวลผลใน context ปัจจุบัน (ถ้ามี)
+    """
+    return _current_stream.get()
+
+
+def stream_callbacks() -> List[BaseCallbackHandler]:
+    """
+    คืนค่ารายการ callback สำหรับส่ง token ของ LLM ไปยังหน้าจอ (ว่างหากไม่มี stream ที่ active อยู่)
+    """
+    stream = current_stream()
+    return [stream] if stream else []
+
+
+def stream_status(content: str, stage: Optional[str] = None) -> None:
+    """
+    แจ้งความคืบหน้าของขั้นตอนที่ไม่ใช่ LLM (เช่น การรันโค้ด) ไปยัง stream ปัจจุบัน (ถ้ามี)
+    Parameters:
+        content (str): ข้อความความคืบหน้า
+        stage (str): stage ที่กำลังจะเริ่ม (ค่าเริ่มต้นคือ stage ปัจจุบัน)
+    """
+    stream = current_stream()
+    if stream is not None:
+        stream.record("status", content, stage=stage)
+
+
+class StreamView:
+    """
+    คลาสสำหรับรวม StreamEvent เป็นข้อความที่พร้อมแสดงผล:
+      - thought: ข้อความที่ supervisor กำลังคิด (ReAct log)
+      - progress: รายการความคืบหน้าของ tool และขั้นตอนต่าง ๆ
+      - answer: คำตอบสุดท้ายของ supervisor หรือคำอธิบายผลลัพธ์ที่กำลังถูกสร้าง
+    """
+
+    def __init__(self):
+        self.thought = ""
+        self.progress: List[str] = []
+        self.answer = ""
+        self._buffers: Dict[str, str] = {}
+        self._tokens: Dict[str, int] = {}
+
+    def update(self, events: List[StreamEvent]) -> bool:
+        """
+        เพิ่ม event เข้าไปใน view
+        Returns:
+            True หากมีการเปลี่ยนแปลงที่ต้องแสดงผลใหม่
+        """
+        for event in events:
+            if event.type == "token":
+                self._add_token(event)
+            elif event.type == "tool_start":
+                self.progress.append(f"⏳ `{event.content}` running...")
+            elif event.type == "tool_end":
+                self.progress.append(f"✅ `{event.content}` finished ({event.elapsed:.1f}s)")
+            elif event.type == "status":
+                self.progress.append(f"⚙️ {event.content}")
+        return bool(events)
+
+    def _add_token(self, event: StreamEvent) -> None:
+        key = event.run_id or event.stage
+        self._buffers[key] = self._buffers.get(key, "") + event.content
+        if event.stage == "supervisor":
+            self.thought = self._buffers[key]
+            # ข้อความหลัง "Final Answer:" ของ supervisor คือคำตอบที่จะแสดงให้ผู้ใช้
+            match = re.search(r"Final Answer:\s*(.*)", self.thought, re.DOTALL)
+            if match:
+                self.answer = match.group(1)
+        elif event.stage == "explanation":
+            # คำอธิบายอยู่ในรูปแบบ JSON ที่ยังไม่สมบูรณ์ ให้ parse เฉพาะส่วนที่ได้รับแล้ว
+            parsed = parse_partial_json(self._buffers[key])
+            if isinstance(parsed, dict) and isinstance(parsed.get("explanation"), str):
+                self.answer = parsed["explanation"]
+        else:
+            self._tokens[event.stage] = self._tokens.get(event.stage, 0) + 1
+
+    def progress_lines(self) -> List[str]:
+        """
+        คืนค่ารายการความคืบหน้าทั้งหมด (รวมจำนวน token ที่ agent ย่อยสร้างแล้ว)
+        """
+        lines = list(self.progress)
+        lines.extend(f"✍️ `{stage}`: {count} tokens" for stage, count in self._tokens.items())
+        return lines
+
+    def progress_markdown(self) -> str:
+        """
+        คืนค่าความคืบหน้าทั้งหมดในรูปแบบ markdown
+        """
+        return "  \n".join(self.progress_lines())
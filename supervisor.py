@@ -1,6 +1,7 @@
 # -----------------------------------------------------------------------
 # main script สำหรับ Suopervisor Agent ที่ใช้ในการสร้าง agent และติดต่อกับโมเดลภาษา
 # -----------------------------------------------------------------------
+import asyncio
 import locale
 import traceback
                  
@@ -10,7 +11,6 @@ except locale.Error:
     locale.setlocale(locale.LC_ALL, '')
 
 import logging
-import re                       
 import sys                      
 from typing import Optional     
 
@@ -18,12 +18,10 @@ from typing import Optional
 # sys.stdout.reconfigure(encoding='utf-8')
 
 import contextlib               
-import io                       
 import json                     
 from dotenv import load_dotenv  
 import os                       
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.memory import ConversationBufferMemory
+from langchain.agents import create_react_agent
 from langchain_openai import ChatOpenAI
 from matplotlib import pyplot as plt
 import numpy as np
@@ -40,9 +38,29 @@ from langchain_core.prompts import PromptTemplate
 import seaborn as sns
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 from prompt import get_react_prompt, get_explanation_prompt, get_run_prompt
+from plot_store import PlotStore
+from figure_manager import FigureCapture
+from stdout_capture import BoundedOutput, capture_stdout, OUTPUT_SPILL_DIR
+from metrics import RunMetrics, StageLatency, track_stage, metrics_callbacks, append_metrics_log
+from agent_trace import TraceCallbackHandler, TraceEvent, AGENT_VERBOSE, TRACE_MAX_CHARS
+from memory import TokenBudgetMemory, MEMORY_TOKEN_BUDGET
+from router import route_query, ROUTER_ENABLED
+from speculative import SpeculativeDispatch, with_speculation, SPECULATIVE_DISPATCH
+from streaming import StreamCallbackHandler, stream_callbacks, stream_status
+from llm_factory import create_chat_llm
+from explanation_engine import explain_locally, TEMPLATED_EXPLANATIONS
+from llm_scheduler import session_scope
+from deadline import (Deadline, DeadlineExceeded, deadline_callbacks, exec_watchdog,
+                      run_with_deadline, REQUEST_TIMEOUT_SECONDS)
+from loop_guard import LoopGuard, LoopGuardedAgentExecutor, LOOP_GUARD_ENABLED
+from langchain_core.agents import AgentAction
+from event_loop import run_coroutine
+from matplotlib.figure import Figure
+from profiling import (ExecutionProfiler, ProfileReport, GENERATED_CODE_FILENAME,
+                       PROFILE_EXECUTION, PROFILE_DUMP, PROFILE_DIR)
 
 # โหลด environment variables จากไฟล์ .env
 load_dotenv()
@@ -51,6 +69,8 @@ load_dotenv()
 STATIC_DIR = "static"  # โฟลเดอร์สำหรับไฟล์ static
 PLOT_DIR = os.path.join(STATIC_DIR, "plots")  # โฟลเดอร์สำหรับเก็บไฟล์กราฟ
 PLOT_URL_PREFIX = "/static/plots"  # URL prefix สำหรับเข้าถึงกราฟผ่านส่วน frontend
+# ที่เก็บไฟล์กราฟแบบ content-addressed ที่ใช้ร่วมกันทั้ง process
+PLOT_STORE = PlotStore(PLOT_DIR, PLOT_URL_PREFIX)
 
 # -----------------------------------------------------------------------
 # ส่วนของโมเดลสำหรับเก็บข้อมูลต่างๆ ที่จะใช้ในการส่งและรับผลลัพธ์จาก agent
@@ -60,25 +80,37 @@ class PlotInfo(BaseModel):
     """
     โมเดลสำหรับเก็บข้อมูลของไฟล์กราฟที่ถูกสร้างขึ้น
     Attributes:
-        filename (str): ชื่อไฟล์กราฟ
+        filename (str): ชื่อไฟล์กราฟ (relative จาก PLOT_DIR เช่น "ab/abcdef....png")
         path (str): เส้นทางของไฟล์กราฟสำหรับเข้าถึงผ่านเว็บ
         created_at (str): เวลาที่สร้างไฟล์กราฟ (ในรูปแบบ string)
+        digest (Optional[str]): sha256 ของเนื้อหาไฟล์กราฟใน PLOT_STORE
     """
     filename: str
     path: str
     created_at: str
+    digest: Optional[str] = None
 
 class ExecutionResult(BaseModel):
     """
     โมเดลสำหรับเก็บผลลัพธ์จากการรันโค้ด Python
     Attributes:
-        output (Optional[str]): ข้อความผลลัพธ์ที่ได้จากการรันโค้ด (ถ้ามี)
+        output (Optional[str]): ข้อความผลลัพธ์ที่ได้จากการรันโค้ด (ถ้ามี) หาก output ยาวเกินกำหนดจะเป็นสรุปส่วนต้น/ส่วนท้าย
         error (Optional[str]): ข้อความ error ที่เกิดขึ้นระหว่างการรันโค้ด (ถ้ามี)
         plots (List[PlotInfo]): รายการของกราฟที่ถูกสร้างขึ้นระหว่างการรันโค้ด
+        output_truncated (bool): output ถูกตัดให้สั้นลงหรือไม่
+        output_chars (Optional[int]): จำนวนตัวอักษรทั้งหมดของ output ก่อนตัด
+        output_lines (Optional[int]): จำนวนบรรทัดทั้งหมดของ output ก่อนตัด
+        output_artifact (Optional[str]): เส้นทางของไฟล์ที่เก็บ output ฉบับเต็ม (เมื่อ output ถูกตัด)
+        profile (Optional[ProfileReport]): ผลการ profile การรันโค้ด (เมื่อเปิดโหมด profile)
     """
     output: Optional[str] = None
     error: Optional[str] = None
     plots: List[PlotInfo] = []
+    output_truncated: bool = False
+    output_chars: Optional[int] = None
+    output_lines: Optional[int] = None
+    output_artifact: Optional[str] = None
+    profile: Optional[ProfileReport] = None
 
 class SubResponseContent(BaseModel):
     """
@@ -89,12 +121,14 @@ class SubResponseContent(BaseModel):
         explanation (Optional[Dict[str, Any]]): คำอธิบายหรือผลลัพธ์เพิ่มเติมจากการวิเคราะห์ (ถ้ามี)
         type (str): ประเภทของผลลัพธ์ (ค่าเริ่มต้น "tool_response")
         response (Optional[str]): ข้อความตอบกลับที่ได้จาก tool (ถ้ามี)
+        explanation_source (Optional[str]): ที่มาของคำอธิบาย ("template" หรือ "llm")
     """
     code: Optional[str] = None
     execution_result: Optional[ExecutionResult] = None
     explanation: Optional[Dict[str, Any]] = None
     type: str = "tool_response"
     response: Optional[str] = None
+    explanation_source: Optional[str] = None
 
 class MetaData(BaseModel):
     """
@@ -104,8 +138,22 @@ class MetaData(BaseModel):
         model (str): ชื่อโมเดลที่ใช้ในการประมวลผล
         temperature (float): ค่า temperature ที่ใช้ในโมเดล
         tools_used (List[str]): รายชื่อเครื่องมือ (tools) ที่ถูกเรียกใช้งาน
-        dataset_key (str): คีย์ของชุดข้อมูลที่ใช้งาน
-        status (str): สถานะของการประมวลผล (ค่าเริ่มต้น "success")
+        dataset_key (str): ชื่อของชุดข้อมูลที่ใช้งาน (ชื่อไฟล์ที่ผู้ใช้อัปโหลด)
+        status (str): สถานะของการประมวลผล ("success", "error", "timeout" หรือ "cancelled")
+        cut_off_stage (Optional[str]): stage ที่กำลังทำงานอยู่เมื่อ request หมดเวลาหรือถูกยกเลิก
+        total_seconds (Optional[float]): เวลาที่ใช้ในการประมวลผลทั้งหมด
+        ttft_seconds (Optional[float]): เวลาตั้งแต่เริ่มประมวลผลจนได้รับ token แรกจาก LLM (เมื่อเปิด streaming)
+        latency (Dict[str, StageLatency]): latency แยกตาม stage (supervisor, pandas_agent, analysis_agent,
+            execute_code, plot_saving, explanation, memory_summary) พร้อมเวลา/จำนวน token ของ LLM และจำนวน iteration
+        history_tokens (Optional[int]): จำนวน token โดยประมาณของประวัติการสนทนาที่ถูกส่งให้ supervisor ในรอบนี้
+        routed_by (str): ผู้เลือก agent ("supervisor" หรือ "router" เมื่อข้าม supervisor LLM)
+        route_confidence (Optional[float]): ความมั่นใจของ router สำหรับคำถามนี้
+        queue_seconds (Optional[float]): เวลารวมที่การเรียก LLM รอสิทธิ์ใน scheduler (rate limit ต่อ API key)
+        rate_limited (int): จำนวนครั้งที่ provider ตอบ 429 (และถูกส่งใหม่ตาม Retry-After)
+        connections (Dict[str, int]): จำนวน HTTP request ไปยัง LLM, connection ที่เปิดใหม่ และที่ใช้ connection เดิมซ้ำ
+        speculative (Dict[str, str]): ผลของการรัน tool ล่วงหน้า ("used", "cancelled" หรือ "discarded") เมื่อเปิด SPECULATIVE_DISPATCH
+        iterations_saved (int): จำนวน iteration ที่ loop guard ข้ามไป (tool ที่ถูกเรียกซ้ำและรอบของ supervisor ที่ถูกบังคับจบ)
+        loop_guard (Optional[str]): "forced_final_answer" เมื่อ loop guard บังคับให้ supervisor จบเพราะไม่มีความคืบหน้า
     """
     timestamp: str
     model: str
@@ -113,6 +161,19 @@ class MetaData(BaseModel):
     tools_used: List[str]
     dataset_key: str
     status: str = "success"
+    cut_off_stage: Optional[str] = None
+    total_seconds: Optional[float] = None
+    ttft_seconds: Optional[float] = None
+    latency: Dict[str, StageLatency] = {}
+    history_tokens: Optional[int] = None
+    routed_by: str = "supervisor"
+    route_confidence: Optional[float] = None
+    speculative: Dict[str, str] = {}
+    queue_seconds: Optional[float] = None
+    rate_limited: int = 0
+    connections: Dict[str, int] = {}
+    iterations_saved: int = 0
+    loop_guard: Optional[str] = None
 
 class SupervisorResponse(BaseModel):
     """
@@ -120,7 +181,8 @@ class SupervisorResponse(BaseModel):
     Attributes:
         query (str): คำถามหรือคำสั่งที่ได้รับจากผู้ใช้
         response (str): คำตอบหรือผลลัพธ์หลักที่ได้จาก agent
-        raw_response (Optional[str]): ข้อมูล raw response จาก agent (ถ้ามี)
+        raw_response (Optional[str]): ข้อความ verbose log จาก agent (เฉพาะคำตอบรุ่นเก่าที่บันทึกก่อนมี trace)
+        trace (List[TraceEvent]): ขั้นตอนการทำงานของ agent (thought, action, observation, final answer) ตามลำดับเวลา
         sub_response (Dict[str, SubResponseContent]): ผลลัพธ์ย่อยที่ได้จากการเรียกใช้งานเครื่องมือต่างๆ
         plot_data (Dict[str, List[PlotInfo]]): ข้อมูลของกราฟที่ถูกสร้างขึ้น
         metadata (MetaData): ข้อมูล metadata ของการตอบกลับ
@@ -129,6 +191,7 @@ class SupervisorResponse(BaseModel):
     query: str
     response: str
     raw_response: Optional[str] = None  # ข้อมูล raw response ที่ได้จาก agent
+    trace: List[TraceEvent] = []
     sub_response: Dict[str, SubResponseContent]
     plot_data: Dict[str, List[PlotInfo]]
     metadata: MetaData
@@ -173,7 +236,7 @@ class PlotResponse(BaseModel):
 
 class SupervisorAgent:
     def __init__(self, temperature: float, base_url: str, model_name: str, dataset_paths: dict, dataset_key: str, session_id: str, 
-                 supervisor_api_key: str, agent_api_key: str, explanner_api_key: str):
+                 supervisor_api_key: str, agent_api_key: str, explanner_api_key: str, dataset_name: Optional[str] = None):
         """
         ตัวสร้าง (constructor) สำหรับ SupervisorAgent
         Parameters:
@@ -181,17 +244,19 @@ class SupervisorAgent:
             base_url (str): URL พื้นฐานสำหรับเรียกใช้งาน API
             model_name (str): ชื่อของโมเดลภาษา (LLM)
             dataset_paths (dict): ข้อมูลหรือเส้นทางของชุดข้อมูลที่จะใช้งาน
-            dataset_key (str): คีย์ที่ระบุชุดข้อมูลที่ใช้งาน
+            dataset_key (str): คีย์ที่ระบุชุดข้อมูลที่ใช้งานใน DataHandler (fingerprint ของไฟล์)
             session_id (str): รหัส session สำหรับติดตามการสนทนา
             supervisor_api_key (str): API key สำหรับ supervisor (LLM หลัก)
             agent_api_key (str): API key สำหรับ PandasAgent
             explanner_api_key (str): API key สำหรับ LLM ย่อยที่ใช้ให้คำอธิบาย
+            dataset_name (str): ชื่อของชุดข้อมูลที่แสดงใน prompt และ metadata (ค่าเริ่มต้นคือ dataset_key)
         """
         # กำหนดค่า parameter ที่ได้รับให้กับ attribute ของ instance
         self.temperature = temperature
         self.base_url = base_url
         self.model = model_name
         self.dataset_key = dataset_key
+        self.dataset_name = dataset_name or dataset_key
 
         # เก็บ API keys สำหรับการเรียกใช้งานโมเดลและเครื่องมือต่างๆ
         self.api_key = supervisor_api_key
@@ -224,7 +289,7 @@ class SupervisorAgent:
         Returns:
             instance ของ ChatOpenAI ที่ถูกกำหนดค่าแล้ว
         """
-        return ChatOpenAI(
+        return create_chat_llm(
             base_url=self.base_url,
             model=self.model,
             api_key=self.api_key,
@@ -239,7 +304,7 @@ class SupervisorAgent:
         Returns:
             instance ของ ChatOpenAI ที่ถูกกำหนดค่าแล้วสำหรับงานย่อย
         """
-        return ChatOpenAI(
+        return create_chat_llm(
             base_url=self.base_url,
             model=self.model,
             api_key=self.api_sub_key,
@@ -248,12 +313,36 @@ class SupervisorAgent:
 
     def initialize_memory(self):
         """
-        ฟังก์ชันสำหรับตั้งค่า memory buffer เพื่อเก็บประวัติการสนทนา
+        ฟังก์ชันสำหรับตั้งค่า memory เพื่อเก็บประวัติการสนทนา
+        บทสนทนาล่าสุดจะถูกเก็บแบบเต็มจนถึง MEMORY_TOKEN_BUDGET token ส่วนที่เก่ากว่าจะถูกสรุปโดย LLM ย่อย
         Returns:
-            instance ของ ConversationBufferMemory ที่เก็บ chat_history
+            instance ของ TokenBudgetMemory ที่เก็บ chat_history
         """
-        return ConversationBufferMemory(memory_key="chat_history", return_messages=False)
+        return TokenBudgetMemory(
+            llm=self.llms,
+            memory_key="chat_history",
+            input_key="input",
+            output_key="output",
+            max_token_limit=MEMORY_TOKEN_BUDGET,
+            return_messages=False
+        )
     
+    def bind_session(self, session_id: str, memory: Optional[TokenBudgetMemory] = None) -> TokenBudgetMemory:
+        """
+        ผูก agent (ที่สร้างไว้แล้วใน AgentPool) เข้ากับ session โดยไม่ต้องสร้าง LLM, agent ย่อย และโหลดข้อมูลใหม่
+        Parameters:
+            session_id (str): รหัสของ session ที่จะใช้ agent นี้
+            memory (TokenBudgetMemory): memory ของการสนทนาของ session นั้น (None คือเริ่ม memory ใหม่)
+        Returns:
+            memory ของการสนทนาที่ agent ใช้อยู่
+        """
+        self.session_id = session_id
+        self.pandas_agent.session_id = session_id
+        self.analysis_agent.session_id = session_id
+        self.memory = memory if memory is not None else self.initialize_memory()
+        self.agent_executor.memory = self.memory
+        return self.memory
+
     def clear_memory(self):
         """
         ฟังก์ชันสำหรับล้าง memory ของการสนทนา
@@ -273,7 +362,7 @@ class SupervisorAgent:
 
         analysis_tool = Tool(
             name="analysis_agent",
-            func=self.query_analysis,
+            func=with_speculation("analysis_agent", self.query_analysis),
             description=(
                 "This tool is best suited for in-depth statistical analysis, hypothesis testing, correlation studies, "
                 "and extracting general insights from the dataset. "
@@ -285,7 +374,7 @@ class SupervisorAgent:
         )
         pandas_tool = Tool(
             name="pandas_agent",
-            func=self.query_dataframe,
+            func=with_speculation("pandas_agent", self.query_dataframe),
             description=(
                 "Use this tool **only** if the user explicitly requests: "
                 "- A chart, graph, or plot (e.g., line chart, bar chart, histogram, etc.). "
@@ -301,17 +390,19 @@ class SupervisorAgent:
         # return [analysis_tool]
 #================================================================================================
     
-    def query_dataframe(self, user_input: str) -> dict:
+    def query_dataframe(self, user_input: str, callbacks=None) -> dict:
         """
         ฟังก์ชันสำหรับส่งคำสั่งที่เกี่ยวกับการวิเคราะห์ข้อมูลไปยัง PandasAgent
         Parameters:
             user_input (str): คำสั่งหรือคำถามเกี่ยวกับข้อมูลที่ผู้ใช้ต้องการ
+            callbacks: callback ที่ส่งต่อมาจาก tool (ใช้เก็บ metrics ของ LLM ภายใน PandasAgent)
         Returns:
             dict ที่มีผลลัพธ์จากการประมวลผล (เช่น โค้ด Python ที่สร้างขึ้น หรือ error message)
         """
         try:
             # เรียกใช้ฟังก์ชัน run_and_return_code ของ PandasAgent พร้อมส่งคำสั่งและ dataset key
-            result = self.pandas_agent.run_and_return_code(user_input, self.dataset_key)
+            with track_stage("pandas_agent"):
+                result = self.pandas_agent.run_and_return_code(user_input, self.dataset_key, callbacks=callbacks)
             if 'code' in result:
                 # กำจัดคำสั่ง plt.show() ออกเพราะจะทำให้เกิดปัญหาเมื่อรันในสภาพแวดล้อม backend
                 result['code'] = result['code'].replace('plt.show()', '')
@@ -332,12 +423,13 @@ class SupervisorAgent:
                 "explanation": "Error occurred while processing the query"
             }
         
-    def query_analysis(self, user_input: str) -> dict:
+    def query_analysis(self, user_input: str, callbacks=None) -> dict:
         """
         Function to send analysis-related commands to the analysis_agent.
         
         Parameters:
             user_input (str): The command or question related to the data that the user wants to analyze.
+            callbacks: Callbacks forwarded by the tool (used to collect metrics of the inner agent's LLM calls).
         
         Returns:
             dict: A dictionary containing the results of the analysis. The dictionary includes:
@@ -347,7 +439,8 @@ class SupervisorAgent:
         """
         try:
             # Call the run_and_return_code method of the analysis_agent with the user input and dataset key
-            result = self.analysis_agent.run_and_return_code(user_input, self.dataset_key)
+            with track_stage("analysis_agent"):
+                result = self.analysis_agent.run_and_return_code(user_input, self.dataset_key, callbacks=callbacks)
             
             # Check if the result contains an error
             if 'error' in result:
@@ -387,7 +480,7 @@ class SupervisorAgent:
         df = self.pandas_agent.handler.get_data(self.dataset_key)
         
         # สร้าง prompt สำหรับ agent โดยส่งข้อมูลคีย์และคอลัมน์ของ DataFrame
-        react_prompt = get_react_prompt(dataset_key=self.dataset_key, 
+        react_prompt = get_react_prompt(dataset_key=self.dataset_name, 
                                         df_columns=df.columns)
         
         # สร้าง agent โดยใช้โมเดลภาษาหลัก (LLM) เครื่องมือที่กำหนด และ prompt ที่สร้างขึ้น
@@ -399,14 +492,15 @@ class SupervisorAgent:
     def create_agent_executor(self):
         """
         ฟังก์ชันสำหรับสร้าง executor ที่จะจัดการ query และการดำเนินการของ agent
+        การเรียก tool ซ้ำจะถูกตรวจสอบโดย LoopGuard ของ request ปัจจุบัน (ดู loop_guard.py)
         Returns:
             instance ของ AgentExecutor ที่ถูกกำหนดค่าไว้
         """
-        return AgentExecutor(
+        return LoopGuardedAgentExecutor(
             agent=self.agent,
             tools=self.tools,
             memory=self.memory,
-            verbose=True,  # เปิดการแสดง log รายละเอียดสำหรับการดีบัก
+            verbose=AGENT_VERBOSE,  # แสดง log รายละเอียดบน stdout เมื่อเปิด AGENT_VERBOSE (สำหรับการดีบัก)
             max_iterations=int(os.getenv("MAX_ITERATIONS", 20)),  # จำนวน iteration สูงสุดสำหรับการประมวลผล
             handle_parsing_errors=True,  # จัดการ error ในการ parse output จาก agent
             return_intermediate_steps=True ,
@@ -426,70 +520,105 @@ class SupervisorAgent:
     
 
     # try this code bellow 
-    def execute_code(self, code: str) -> ExecutionResult:
-        # ปิดกราฟที่อาจเปิดอยู่ก่อนหน้าเพื่อให้เริ่มต้นใหม่
-        plt.close('all')
-        
-        # สร้างโฟลเดอร์สำหรับเก็บไฟล์กราฟ หากยังไม่มีอยู่
-        plot_dir = "static/plots"
-        os.makedirs(plot_dir, exist_ok=True)
-        # สร้างตัวแปร current_time สำหรับตั้งชื่อไฟล์กราฟที่ไม่ซ้ำกัน
-        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
+    def execute_code(self, code: str, profile: Optional[bool] = None) -> ExecutionResult:
+        """
+        ฟังก์ชันสำหรับรันโค้ด Python ที่ได้จาก PandasAgent และบันทึกกราฟที่ถูกสร้างขึ้น
+        ปลอดภัยสำหรับการเรียกพร้อมกันจากหลาย thread: figure และ stdout ถูกแยกตาม thread
+        ผ่าน FigureCapture และ capture_stdout
+        Parameters:
+            code (str): โค้ด Python ที่ต้องการรัน
+            profile (Optional[bool]): เปิดการ profile การรันโค้ด (ค่าเริ่มต้นตาม PROFILE_EXECUTION)
+        Returns:
+            instance ของ ExecutionResult ที่มี output, error, รายการกราฟ และผลการ profile (ถ้ามี)
+        """
+        execution_result, figures = self._execute(code, profile)
+        execution_result.plots = self.save_figures(figures)
+        return execution_result
+
+    def _execute(self, code: str, profile: Optional[bool] = None) -> Tuple[ExecutionResult, List[Figure]]:
+        """
+        ฟังก์ชันภายในสำหรับรันโค้ดโดยยังไม่บันทึกกราฟ (แยกออกมาเพื่อให้การบันทึกกราฟทำงานพร้อมกับงานอื่นได้)
+        Returns:
+            tuple ของ ExecutionResult (ยังไม่มีรายการกราฟ) และรายการ figure ที่ถูกสร้างขึ้น
+            (figure ถูกปิดจาก pyplot แล้ว แต่ยังบันทึกลงไฟล์ได้)
+        """
+        profile = PROFILE_EXECUTION if profile is None else profile
+        profiler = ExecutionProfiler(code, dump_dir=PROFILE_DIR if PROFILE_DUMP else None) if profile else None
+
         # สร้าง context สำหรับรันโค้ด ซึ่งประกอบด้วยโมดูลและ DataFrame ที่จำเป็น
+        # (ใช้สำเนาของ DataFrame เพราะโค้ดหลายชุดอาจรันพร้อมกันและแก้ไข df เช่น เพิ่มคอลัมน์หรือ inplace=True)
         context = {
             "pd": pd, 
             "np": np, 
             "sns": sns, 
             "plt": plt, 
             "tabulate": tabulate, 
-            "df": self.pandas_agent.handler.get_data(self.dataset_key)
+            "df": self.pandas_agent.handler.get_data(self.dataset_key).copy()
         }
         
-        # สร้าง StringIO object สำหรับจับ output จากการรันโค้ด
-        output = io.StringIO()
-        # รายการสำหรับเก็บข้อมูลของกราฟที่สร้างขึ้น
-        plot_files = []
+        # สร้าง buffer แบบจำกัดขนาดสำหรับจับ output จากการรันโค้ด
+        # (ส่วนที่เกินจะถูกเขียนลงไฟล์ และเก็บเฉพาะสรุปส่วนต้น/ส่วนท้ายไว้ในหน่วยความจำ)
+        output = BoundedOutput(spill_dir=OUTPUT_SPILL_DIR)
         
-        # Redirect stdout ไปยัง output เพื่อจับข้อความที่พิมพ์ออกมาในระหว่างการรันโค้ด
-        with contextlib.redirect_stdout(output):
+        # จับข้อความที่พิมพ์ออกมาและ figure ที่ถูกสร้างขึ้นเฉพาะของ thread นี้
+        # (figure ทั้งหมดที่ถูกสร้างจะถูกปิดเมื่อออกจาก FigureCapture)
+        with capture_stdout(output), FigureCapture() as figures:
             try:
-                # รันโค้ดที่ได้รับมาใน context ที่กำหนด
-                exec(code, context)
+                # รันโค้ดที่ได้รับมาใน context ที่กำหนด (หากเปิดโหมด profile จะรันภายใต้ profiler)
+                # exec_watchdog หยุดโค้ดที่รันนานเกิน deadline ของ request (หรือเมื่อผู้ใช้กดยกเลิก)
+                with track_stage("execute_code"), exec_watchdog():
+                    if profiler is None:
+                        exec(code, context)
+                    else:
+                        with profiler:
+                            exec(compile(code, GENERATED_CODE_FILENAME, "exec"), context)
                 
-                # ตรวจสอบกราฟทั้งหมดที่ถูกสร้างขึ้น
-                fig_nums = plt.get_fignums()
-                for i, fig_num in enumerate(fig_nums):
-                    fig = plt.figure(fig_num)
-                    # สร้างชื่อไฟล์กราฟที่มีหมายเลข index เพื่อป้องกันชื่อซ้ำ
-                    filename = f"plot_{current_time}_{i+1}.png"
-                    filepath = os.path.join(plot_dir, filename)
-                    
-                    # บันทึกกราฟลงในไฟล์ด้วยคุณภาพสูง
-                    fig.savefig(filepath, bbox_inches='tight', dpi=300, format='png')
-                    
-                    # สร้างข้อมูลของกราฟในรูปแบบ PlotInfo
-                    plot_files.append(PlotInfo(
-                        filename=filename,
-                        path=f"/static/plots/{filename}",
-                        created_at=datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
-                    ))
-                    # ปิดกราฟเพื่อปล่อยหน่วยความจำ
-                    plt.close(fig)
-                    
-                # ส่งกลับผลลัพธ์การรันโค้ดในรูปแบบ ExecutionResult
+                # ส่งกลับผลลัพธ์การรันโค้ดและกราฟทั้งหมดที่การรันครั้งนี้สร้างขึ้น (รวมถึง seaborn figure-level grid)
                 return ExecutionResult(
                     output=output.getvalue(),
-                    plots=plot_files
-                )
+                    output_truncated=output.truncated,
+                    output_chars=output.total_chars,
+                    output_lines=output.total_lines,
+                    output_artifact=output.artifact_path,
+                    profile=profiler.report if profiler else None
+                ), figures.collect(context)
                 
             except Exception as e:
-                # หากเกิดข้อผิดพลาด ให้ปิดกราฟทั้งหมดและส่งกลับ error message
-                plt.close('all')
+                # หากเกิดข้อผิดพลาด ให้ส่งกลับ error message (figure ที่ค้างอยู่จะถูกปิดโดย FigureCapture)
                 return ExecutionResult(
                     error=str(e),
-                    plots=[]
-                )
+                    plots=[],
+                    profile=profiler.report if profiler else None
+                ), []
+            finally:
+                output.close()
+
+    def save_figures(self, figures: List[Figure]) -> List[PlotInfo]:
+        """
+        ฟังก์ชันสำหรับบันทึก figure ลงใน PLOT_STORE
+        Parameters:
+            figures (List[Figure]): รายการ figure ที่ต้องการบันทึก
+        Returns:
+            รายการ PlotInfo ของกราฟที่บันทึกสำเร็จ
+        """
+        plot_files = []
+        with track_stage("plot_saving"):
+            for fig in figures:
+                try:
+                    # บันทึกกราฟลงใน PLOT_STORE ด้วยคุณภาพสูง (ชื่อไฟล์คือ hash ของเนื้อหา จึงไม่ชนกันและไม่เก็บซ้ำ)
+                    digest = PLOT_STORE.save_figure(fig, bbox_inches='tight', dpi=300)
+                except Exception as e:
+                    logging.error(f"Error saving plot: {e}")
+                    continue
+                
+                # สร้างข้อมูลของกราฟในรูปแบบ PlotInfo
+                plot_files.append(PlotInfo(
+                    filename=PLOT_STORE.relative_path(digest),
+                    path=PLOT_STORE.url(digest),
+                    created_at=datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S'),
+                    digest=digest
+                ))
+        return plot_files
 
 
     def get_explanation(self, output, user_input) -> dict:
@@ -506,15 +635,33 @@ class SupervisorAgent:
         try:
             # สร้าง chain การประมวลผลโดยใช้ prompt, LLM ย่อย และ output parser
             chain = prompt | self.llms | self.output_parser
-            response = chain.invoke({
-                "output": output,
-                "user_question": user_input
-            })
-            explanation = response
+            with track_stage("explanation"):
+                explanation = chain.invoke({
+                    "output": output,
+                    "user_question": user_input
+                }, config={"callbacks": metrics_callbacks() + stream_callbacks() + deadline_callbacks()})
         except Exception as e:
             # กรณีเกิดข้อผิดพลาดให้ส่งกลับ error message พร้อมกับ raw output
             explanation = {"error": f"Error getting explanation: {e}", "raw_output": output}
-        
+        return self._normalize_explanation(explanation)
+
+    async def aget_explanation(self, output, user_input) -> dict:
+        """
+        get_explanation() แบบ async (ใช้ async client ของ LLM ย่อย)
+        """
+        prompt = get_explanation_prompt(output_parser=self.output_parser)
+        try:
+            chain = prompt | self.llms | self.output_parser
+            with track_stage("explanation"):
+                explanation = await chain.ainvoke({
+                    "output": output,
+                    "user_question": user_input
+                }, config={"callbacks": metrics_callbacks() + stream_callbacks() + deadline_callbacks()})
+        except Exception as e:
+            explanation = {"error": f"Error getting explanation: {e}", "raw_output": output}
+        return self._normalize_explanation(explanation)
+
+    def _normalize_explanation(self, explanation) -> dict:
         # ตรวจสอบให้แน่ใจว่าคำอธิบายอยู่ในรูปแบบ JSON ที่ถูกต้อง
         if isinstance(explanation, str):
             try:
@@ -564,109 +711,209 @@ class SupervisorAgent:
         
 
 
-    def run(self, user_input: str) -> SupervisorResponse:
+    def _invoke_tool_directly(self, tool_name: str, user_input: str, trace: TraceCallbackHandler) -> dict:
         """
-        ฟังก์ชันหลักสำหรับการรัน agent และประมวลผลคำสั่งของผู้ใช้
-        โดยจะประสานงานระหว่างการเรียกใช้งานโมเดลภาษา, การวิเคราะห์ข้อมูล,
-        การรันโค้ด, และการรวมผลลัพธ์เข้าด้วยกันในรูปแบบที่มีโครงสร้าง
+        ฟังก์ชันสำหรับเรียก tool โดยตรงโดยไม่ผ่าน supervisor LLM (ใช้เมื่อ router มั่นใจในการเลือก agent)
+        Parameters:
+            tool_name (str): ชื่อ tool ที่ต้องการเรียก ("pandas_agent" หรือ "analysis_agent")
+            user_input (str): คำถามของผู้ใช้
+            trace (TraceCallbackHandler): callback สำหรับบันทึก trace ของการประมวลผล
+        Returns:
+            dict ที่มีรูปแบบเดียวกับผลลัพธ์ของ agent_executor.invoke (output และ intermediate_steps)
+        """
+        tool = next(tool for tool in self.tools if tool.name == tool_name)
+        trace.record("action", tool=tool_name, tool_input=user_input)
+        stream_status(f"Routed to `{tool_name}`", stage=tool_name)
+        observation = tool.func(user_input, callbacks=metrics_callbacks() + stream_callbacks() + deadline_callbacks() + [trace])
+        trace.record("observation", str(observation)[:TRACE_MAX_CHARS], tool=tool_name)
+        action = AgentAction(tool=tool_name, tool_input=user_input, log="Routed by rule-based router")
+        return {"output": "", "intermediate_steps": [(action, observation)]}
+
+    def _routed_response_text(self, sub_response: Dict[str, SubResponseContent]) -> str:
+        """
+        ฟังก์ชันสำหรับสร้างข้อความตอบกลับหลักจากผลลัพธ์ของ tool (ใช้แทน Final Answer ของ supervisor
+        เมื่อคำถามถูกส่งไปยัง tool โดยตรง)
+        """
+        for content in sub_response.values():
+            explanation = content.explanation or {}
+            text = explanation.get("explanation") or explanation.get("text")
+            if isinstance(text, str) and text:
+                return text
+            if content.execution_result and content.execution_result.error:
+                return f"Error: {content.execution_result.error}"
+        return ""
+
+    def run(self, user_input: str, stream: Optional[StreamCallbackHandler] = None,
+            deadline: Optional[Deadline] = None) -> SupervisorResponse:
+        """
+        ฟังก์ชันหลักสำหรับการรัน agent และประมวลผลคำสั่งของผู้ใช้ (แบบ synchronous สำหรับ app.py)
+        รัน arun() บน event loop กลางของ process และรอผลลัพธ์
         Parameters:
             user_input (str): คำสั่งหรือคำถามจากผู้ใช้
+            stream (StreamCallbackHandler): handler สำหรับรับ token และความคืบหน้าระหว่างการประมวลผล (ถ้ามี)
+            deadline (Deadline): deadline ของ request (ค่าเริ่มต้นคือ REQUEST_TIMEOUT_SECONDS นับจากตอนนี้)
         Returns:
             instance ของ SupervisorResponse ที่ประกอบด้วยผลลัพธ์, metadata,
             ข้อมูลของกราฟ (ถ้ามี) และรายละเอียดของขั้นตอนการประมวลผล
         """
+        return run_coroutine(self.arun(user_input, stream=stream, deadline=deadline))
+
+    async def arun(self, user_input: str, stream: Optional[StreamCallbackHandler] = None,
+                   deadline: Optional[Deadline] = None) -> SupervisorResponse:
+        """
+        ฟังก์ชันหลักสำหรับการรัน agent แบบ async
+        โดยจะประสานงานระหว่างการเรียกใช้งานโมเดลภาษา, การวิเคราะห์ข้อมูล,
+        การรันโค้ด, และการรวมผลลัพธ์เข้าด้วยกันในรูปแบบที่มีโครงสร้าง
+        งานที่ไม่ขึ้นต่อกันจะทำงานพร้อมกัน (การขอคำอธิบายกับการบันทึกกราฟ และ pandas step หลายขั้น)
+        เวลาที่ใช้ในแต่ละ stage จะถูกบันทึกใน metadata และใน metrics log
+        Parameters:
+            user_input (str): คำสั่งหรือคำถามจากผู้ใช้
+            stream (StreamCallbackHandler): handler สำหรับรับ token ของ LLM ทุกตัวและความคืบหน้าของ tool
+                (thread ของ UI ดึง event จาก stream.drain() ไปแสดงผลระหว่างที่รอ)
+            deadline (Deadline): deadline ของ request ซึ่งถูกส่งต่อไปยัง agent, การเรียก LLM และการรันโค้ด
+                (ค่าเริ่มต้นคือ REQUEST_TIMEOUT_SECONDS นับจากตอนนี้; เรียก deadline.cancel() เพื่อยกเลิก)
+        Returns:
+            instance ของ SupervisorResponse (หากหมดเวลาหรือถูกยกเลิก จะเป็นผลลัพธ์บางส่วนที่มี status
+            "timeout" หรือ "cancelled" และ cut_off_stage ระบุ stage ที่ถูกหยุด)
+        """
+        metrics = RunMetrics()
+        deadline = deadline or Deadline(REQUEST_TIMEOUT_SECONDS)
+        # callback สำหรับบันทึกขั้นตอนการทำงานของ supervisor และ agent ย่อย
+        trace = TraceCallbackHandler()
+        # session_scope ทำให้ scheduler จัดคิวการเรียก LLM ของ request นี้แบบยุติธรรมเทียบกับ session อื่น
+        with metrics.activate(), session_scope(self.session_id), deadline.activate(), \
+                (stream.activate() if stream else contextlib.nullcontext()):
+            try:
+                response = await run_with_deadline(self._arun(user_input, trace), deadline)
+            except DeadlineExceeded as e:
+                response = self._deadline_response(user_input, trace, e)
+
+        # เพิ่ม latency แยกตาม stage ลงใน metadata และบันทึกลง metrics log
+        response.metadata.total_seconds = round(metrics.total_seconds(), 4)
+        response.metadata.latency = metrics.breakdown()
+        ttft = metrics.ttft_seconds()
+        response.metadata.ttft_seconds = round(ttft, 4) if ttft is not None else None
+        response.metadata.connections = metrics.connection_stats()
+        response.metadata.queue_seconds = round(metrics.queue_seconds(), 4)
+        response.metadata.rate_limited = sum(stats.rate_limited for stats in response.metadata.latency.values())
+        append_metrics_log({
+            "timestamp": response.metadata.timestamp,
+            "session_id": self.session_id,
+            "model": self.model,
+            "dataset_key": self.dataset_name,
+            "status": response.metadata.status,
+            "cut_off_stage": response.metadata.cut_off_stage,
+            "tools_used": response.metadata.tools_used,
+            "total_seconds": response.metadata.total_seconds,
+            "ttft_seconds": response.metadata.ttft_seconds,
+            "history_tokens": response.metadata.history_tokens,
+            "routed_by": response.metadata.routed_by,
+            "route_confidence": response.metadata.route_confidence,
+            "speculative": response.metadata.speculative,
+            "iterations_saved": response.metadata.iterations_saved,
+            "loop_guard": response.metadata.loop_guard,
+            "explanation_sources": {name: content.explanation_source
+                                    for name, content in response.sub_response.items() if content.explanation_source},
+            "connections": response.metadata.connections,
+            "queue_seconds": response.metadata.queue_seconds,
+            "rate_limited": response.metadata.rate_limited,
+            "latency": {name: stats.model_dump() for name, stats in response.metadata.latency.items()},
+        })
+        return response
+
+    def _deadline_response(self, user_input: str, trace: TraceCallbackHandler, error: DeadlineExceeded) -> SupervisorResponse:
+        """
+        ฟังก์ชันสำหรับสร้างผลลัพธ์บางส่วนเมื่อ request หมดเวลาหรือถูกยกเลิก
+        (ประกอบด้วย trace ของขั้นตอนที่ทำเสร็จแล้ว และ stage ที่ถูกหยุด)
+        """
+        logging.error(f"SupervisorAgent stopped: {error}")
+        trace.record("error", str(error))
+        if error.reason == "cancelled":
+            message = f"Request was cancelled during '{error.stage}'."
+        else:
+            message = f"Request timed out during '{error.stage}'. Try a simpler question or increase REQUEST_TIMEOUT_SECONDS."
+        return SupervisorResponse(
+            query=user_input,
+            response=message,
+            sub_response={},
+            plot_data={"plots": []},
+            metadata=MetaData(
+                timestamp=datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S'),
+                model=self.model,
+                temperature=self.temperature,
+                tools_used=[],
+                dataset_key=self.dataset_name,
+                status=error.reason,
+                cut_off_stage=error.stage
+            ),
+            trace=trace.events,
+            error=str(error)
+        )
+
+    async def _arun(self, user_input: str, trace: TraceCallbackHandler) -> SupervisorResponse:
+        """
+        ขั้นตอนการประมวลผลของ arun() (ทำงานภายใต้ RunMetrics และ Deadline ที่ active อยู่)
+        """
+        input_query = user_input
         try:
             logging.info(f"Running SupervisorAgent with input: {user_input}")
             
             # ดึงข้อมูล DataFrame จาก PandasAgent ตาม dataset key ที่ระบุ
             df = self.pandas_agent.handler.get_data(self.dataset_key)
             # สร้าง prompt สำหรับรันคำสั่ง โดยรวมคำสั่งของผู้ใช้เข้ากับข้อมูลของ DataFrame
-            input_query = get_run_prompt(dataset_key=self.dataset_key, 
+            input_query = get_run_prompt(dataset_key=self.dataset_name, 
                                          df_columns=df.columns).format(user_input=user_input)
 
-            # ดึง raw response จาก agent โดยเก็บ verbose output เพื่อติดตามขั้นตอนภายใน
-            verbose_output = io.StringIO()
-            with contextlib.redirect_stdout(verbose_output):
-                raw_response = self.agent_executor.invoke({"input": user_input}, verbose=True)
+            # จำนวน token ของประวัติการสนทนาที่จะถูกส่งให้ supervisor ในรอบนี้
+            history_tokens = self.memory.history_tokens()
+
+            # คำถามที่ชัดเจนจะถูกส่งไปยัง tool โดยตรงโดยไม่ต้องเรียก supervisor LLM
+            speculative_outcome = {}
+            loop_guard = None
+            decision = route_query(user_input) if ROUTER_ENABLED else None
+            routed = decision is not None and decision.is_confident()
+            if routed:
+                raw_response = await asyncio.to_thread(self._invoke_tool_directly, decision.target, user_input, trace)
+            else:
+                # เมื่อ router ไม่มั่นใจและเปิด SPECULATIVE_DISPATCH ให้เริ่มรันทั้งสอง tool พร้อมกันล่วงหน้า
+                # ระหว่างที่ supervisor กำลังตัดสินใจ (tool ที่ไม่ถูกใช้จะถูกยกเลิกหรือทิ้งผลลัพธ์)
+                if SPECULATIVE_DISPATCH:
+                    speculation = SpeculativeDispatch({
+                        "analysis_agent": self.query_analysis,
+                        "pandas_agent": self.query_dataframe,
+                    }, user_input, trace)
+                else:
+                    speculation = contextlib.nullcontext()
+                # ดึง raw response จาก agent โดยบันทึกขั้นตอนภายในเป็น trace ผ่าน callback
+                # (tool แบบ synchronous จะถูกรันใน thread pool ของ event loop)
+                # loop guard ใช้ observation เดิมเมื่อ tool ถูกเรียกซ้ำ และบังคับจบเมื่อไม่มีความคืบหน้า
+                loop_guard = LoopGuard(trace) if LOOP_GUARD_ENABLED else None
+                with speculation, (loop_guard.activate() if loop_guard else contextlib.nullcontext()), \
+                        track_stage("supervisor"):
+                    raw_response = await self.agent_executor.ainvoke(
+                        {"input": user_input},
+                        config={"callbacks": metrics_callbacks() + stream_callbacks() + deadline_callbacks() + [trace]}
+                    )
+                if SPECULATIVE_DISPATCH:
+                    speculative_outcome = speculation.outcome
+                if loop_guard:
+                    # ตัด step ที่ใช้ observation เดิมออก เพื่อไม่ให้รันโค้ดหรือขอคำอธิบายซ้ำ
+                    raw_response['intermediate_steps'] = loop_guard.filter_steps(raw_response.get('intermediate_steps', []))
             
             # ดึงผลลัพธ์หลักจาก raw response
             main_response = raw_response.get('output', '')
-            # เก็บ intermediate steps ที่เกิดขึ้นระหว่างการประมวลผล
-            intermediate_steps = raw_response.get('intermediate_steps', [])
-            # เตรียม dict สำหรับเก็บผลลัพธ์ย่อยจากเครื่องมือแต่ละตัว
-            sub_response = {}
-            # เตรียม dict สำหรับเก็บข้อมูลของกราฟ
-            plot_data = {"plots": []}
-            # เก็บ verbose content ทั้งหมดที่ได้จากการรัน agent
-            verbose_content = verbose_output.getvalue()
-            verbose_output.close()
-
-            # ใช้ regular expression ในการดึงข้อมูลที่เป็น "Thought:" จาก verbose content
-            pattern = r"Thought:.*?Finished chain\..*"
-
-            # ค้นหาข้อความที่ตรงกับ pattern
-            match = re.search(pattern, verbose_content, re.DOTALL)
-            if match:
-                extracted_text = match.group(0)
-                # ตัดส่วนที่เกินออกหลังคำว่า "Finished chain."
-                extracted_text = extracted_text.rsplit("Finished chain.", 1)[0].strip()
-                # ลบ escape sequences ที่อาจเกิดจากการแสดงผลในเทอร์มินัลออก
-                extracted_text = re.sub(r"\[\d+[;]?\d*m|> ?", "", extracted_text)
-            else:
-                extracted_text = verbose_content
-
-            # วนลูปผ่าน intermediate steps ที่ได้จาก agent
-            for step in intermediate_steps:
-                if len(step) >= 2:
-                    # ดึงชื่อเครื่องมือที่ถูกเรียกใช้งาน
-                    tool_name = step[0].tool
-                    # ประมวลผล output จากเครื่องมือให้เป็น dict ที่มีรูปแบบมาตรฐาน
-                    tool_output = self._process_tool_output(step[1])
-                    
-                    # หากเครื่องมือที่เรียกใช้คือ pandas_agent และมีการส่งโค้ดกลับมา
-                    if tool_name == "pandas_agent" and "code" in tool_output:
-                        # รันโค้ดที่ได้จาก tool
-                        # execution_result = self.execute_code(tool_output["code"])
-                        code_snippet = tool_output.get("code", "")
-                        if not code_snippet:
-                            return ExecutionResult(error="No code found in tool output", plots=[])
-                        execution_result = self.execute_code(code_snippet)
-                        # ขอคำอธิบายของ output หรือ error จากการรันโค้ด
-                        explanation = self.get_explanation(
-                            execution_result.output if execution_result.output 
-                            else execution_result.error,
-                            user_input
-                        )
-                        
-                        # เก็บผลลัพธ์จากเครื่องมือ pandas_agent ในรูปแบบของ SubResponseContent
-                        sub_response[tool_name] = SubResponseContent(
-                            code=tool_output["code"],
-                            execution_result=execution_result,
-                            explanation=explanation
-                        )
-                        
-                        # หากมีกราฟที่ถูกสร้างขึ้น ให้นำข้อมูลของกราฟมาเก็บใน plot_data
-                        if execution_result.plots:
-                            plot_data["plots"].extend(execution_result.plots)
-
-
-                    elif tool_name == "analysis_agent":
-                        try:
-                            analysis_result = json.loads(tool_output.get("response", ""))
-                        except json.JSONDecodeError as e:
-                            logging.error(f"Error parsing JSON: {e}")
-                            analysis_result = {}
-                        code_val = analysis_result.get("code", "")
-                        explanation_val = analysis_result.get("explanation", "")
-                        # หาก explanation ไม่ใช่ dict ให้ห่อหุ้มเป็น dict ด้วย key "text"
-                        if not isinstance(explanation_val, dict):
-                            explanation_val = {"text": explanation_val} if explanation_val else {}
-                        sub_response[tool_name] = SubResponseContent(
-                            code=code_val,
-                            explanation=explanation_val,
-                            type="tool_response"
-                        )
+            # ประมวลผล intermediate steps ที่เกิดขึ้นระหว่างการประมวลผลให้เป็นผลลัพธ์ย่อยและข้อมูลของกราฟ
+            sub_response, plot_data = await self._aprocess_steps(raw_response.get('intermediate_steps', []), user_input)
+
+            if loop_guard and loop_guard.forced:
+                # ใช้คำอธิบายจากผลลัพธ์ของ tool แทนข้อความที่ loop guard สร้างจาก observation ล่าสุด
+                main_response = self._routed_response_text(sub_response) or main_response
 
+            if routed:
+                # ใช้คำอธิบายจาก tool เป็นคำตอบหลัก และบันทึกบทสนทนาลง memory แทน AgentExecutor
+                main_response = self._routed_response_text(sub_response)
+                trace.record("final_answer", main_response)
+                await self.memory.asave_context({"input": user_input}, {"output": main_response})
 
             # สร้าง metadata สำหรับการตอบกลับ
             metadata = MetaData(
@@ -674,14 +921,20 @@ class SupervisorAgent:
                 model=self.model,
                 temperature=self.temperature,
                 tools_used=list(sub_response.keys()),
-                dataset_key=self.dataset_key
+                dataset_key=self.dataset_name,
+                history_tokens=history_tokens,
+                routed_by="router" if routed else "supervisor",
+                route_confidence=decision.confidence if decision else None,
+                speculative=speculative_outcome,
+                iterations_saved=loop_guard.iterations_saved if loop_guard else 0,
+                loop_guard="forced_final_answer" if loop_guard and loop_guard.forced else None
             )
 
             # สร้างและส่งกลับผลลัพธ์ในรูปแบบ SupervisorResponse
             response = SupervisorResponse(
                 query=input_query,
                 response=main_response,
-                raw_response=extracted_text,
+                trace=trace.events,
                 sub_response=sub_response,
                 plot_data=plot_data,
                 metadata=metadata
@@ -697,7 +950,7 @@ class SupervisorAgent:
                 model=self.model,
                 temperature=self.temperature,
                 tools_used=[],
-                dataset_key=self.dataset_key,
+                dataset_key=self.dataset_name,
                 status="error"
             )
             
@@ -711,5 +964,104 @@ class SupervisorAgent:
                 sub_response={},
                 plot_data={"plots": []},
                 metadata=error_metadata,
+                trace=trace.events,
                 error=str(e)
             )
+
+    async def _aprocess_steps(self, intermediate_steps, user_input: str) -> Tuple[Dict[str, SubResponseContent], Dict[str, List[PlotInfo]]]:
+        """
+        ฟังก์ชันสำหรับแปลง intermediate steps ของ agent เป็นผลลัพธ์ย่อยของแต่ละ tool
+        pandas step หลายขั้นจะถูกรันพร้อมกัน ผลลัพธ์จะถูกรวมตามลำดับเดิมของ step
+        Parameters:
+            intermediate_steps: รายการ (AgentAction, observation) จาก agent
+            user_input (str): คำถามของผู้ใช้ (ใช้ขอคำอธิบาย)
+        Returns:
+            tuple ของ sub_response และ plot_data
+        """
+        entries = []
+        # วนลูปผ่าน intermediate steps ที่ได้จาก agent
+        for step in intermediate_steps:
+            if len(step) >= 2:
+                # ดึงชื่อเครื่องมือที่ถูกเรียกใช้งาน
+                tool_name = step[0].tool
+                # ประมวลผล output จากเครื่องมือให้เป็น dict ที่มีรูปแบบมาตรฐาน
+                tool_output = self._process_tool_output(step[1])
+                
+                # หากเครื่องมือที่เรียกใช้คือ pandas_agent และมีการส่งโค้ดกลับมา ให้รันโค้ด (แบบ async)
+                if tool_name == "pandas_agent" and "code" in tool_output:
+                    entries.append((tool_name, self._apandas_sub_response(tool_output.get("code", ""), user_input)))
+
+                elif tool_name == "analysis_agent":
+                    entries.append((tool_name, self._analysis_sub_response(tool_output)))
+
+        # รัน pandas step ทั้งหมดพร้อมกัน
+        coroutines = [value for _, value in entries if asyncio.iscoroutine(value)]
+        results = iter(await asyncio.gather(*coroutines))
+
+        sub_response = {}
+        plot_data = {"plots": []}
+        for tool_name, value in entries:
+            content = next(results) if asyncio.iscoroutine(value) else value
+            sub_response[tool_name] = content
+            # หากมีกราฟที่ถูกสร้างขึ้น ให้นำข้อมูลของกราฟมาเก็บใน plot_data
+            if content.execution_result and content.execution_result.plots:
+                plot_data["plots"].extend(content.execution_result.plots)
+        return sub_response, plot_data
+
+    async def _apandas_sub_response(self, code_snippet: str, user_input: str) -> SubResponseContent:
+        """
+        ฟังก์ชันสำหรับรันโค้ดจาก pandas_agent แล้วขอคำอธิบายของผลลัพธ์
+        การขอคำอธิบาย (LLM) และการบันทึกกราฟจะทำงานพร้อมกัน
+        """
+        if not code_snippet:
+            return SubResponseContent(code=code_snippet, execution_result=ExecutionResult(error="No code found in tool output", plots=[]))
+        # รันโค้ดที่ได้จาก tool ใน thread แยก
+        stream_status("Running generated code", stage="execute_code")
+        execution_result, figures = await asyncio.to_thread(self._execute, code_snippet)
+        # ผลลัพธ์ที่ไม่ซับซ้อน (ค่าเดียว ตารางขนาดเล็ก กราฟอย่างเดียว หรือ error) จะถูกอธิบายด้วย template โดยไม่เรียก LLM
+        explanation = explain_locally(
+            execution_result.output, execution_result.error, user_input,
+            plot_count=len(figures), truncated=execution_result.output_truncated
+        ) if TEMPLATED_EXPLANATIONS else None
+        explanation_source = "template" if explanation is not None else "llm"
+        if explanation is not None:
+            plots = await asyncio.to_thread(self.save_figures, figures)
+        else:
+            # ขอคำอธิบายของ output หรือ error จากการรันโค้ด พร้อมกับบันทึกกราฟ
+            explanation, plots = await asyncio.gather(
+                self.aget_explanation(
+                    execution_result.output if execution_result.output 
+                    else execution_result.error,
+                    user_input
+                ),
+                asyncio.to_thread(self.save_figures, figures)
+            )
+        execution_result.plots = plots
+        
+        # เก็บผลลัพธ์จากเครื่องมือ pandas_agent ในรูปแบบของ SubResponseContent
+        return SubResponseContent(
+            code=code_snippet,
+            execution_result=execution_result,
+            explanation=explanation,
+            explanation_source=explanation_source
+        )
+
+    def _analysis_sub_response(self, tool_output: Dict[str, Any]) -> SubResponseContent:
+        """
+        ฟังก์ชันสำหรับแปลงผลลัพธ์ของ analysis_agent เป็น SubResponseContent
+        """
+        try:
+            analysis_result = json.loads(tool_output.get("response", ""))
+        except json.JSONDecodeError as e:
+            logging.error(f"Error parsing JSON: {e}")
+            analysis_result = {}
+        code_val = analysis_result.get("code", "")
+        explanation_val = analysis_result.get("explanation", "")
+        # หาก explanation ไม่ใช่ dict ให้ห่อหุ้มเป็น dict ด้วย key "text"
+        if not isinstance(explanation_val, dict):
+            explanation_val = {"text": explanation_val} if explanation_val else {}
+        return SubResponseContent(
+            code=code_val,
+            explanation=explanation_val,
+            type="tool_response"
+        )
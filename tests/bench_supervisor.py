@@ -0,0 +1,83 @@
+# -----------------------------------------------------------------------
+# benchmark ของ SupervisorAgent.run กับ endpoint จำลอง (tests/llm_stub.py) ที่หน่วงเวลาทุก completion
+# วัด median ของเวลาที่ใช้ต่อคำถาม (query แบบ supervisor -> pandas_agent และแบบผสม)
+# และเวลาของ pandas 3 step ใน response เดียวเทียบกับ 1 step
+#
+# ตัวอย่างการใช้งาน:
+#   python tests/bench_supervisor.py                          # tree ปัจจุบัน
+#   git worktree add /tmp/base <commit>
+#   python tests/bench_supervisor.py --repo /tmp/base         # tree อื่น (เช่น ก่อนมี arun)
+# ตั้ง TEMPLATED_EXPLANATIONS=false เพื่อให้คำอธิบายผลลัพธ์ทุกครั้งเรียก LLM
+# -----------------------------------------------------------------------
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = {
+    "plot query (supervisor -> pandas)": "plot x vs y",
+    "mixed query (analysis + pandas)": "mixed question about the data",
+}
+STEP_CODE = "plt.figure()\nplt.plot(df['x'], df['y'])\nprint(df.describe())"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SupervisorAgent.run against a local LLM stub")
+    parser.add_argument("--repo", default=os.path.dirname(TESTS_DIR), help="root of the tree to benchmark")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per completion")
+    parser.add_argument("--runs", type=int, default=4, help="runs per query (median is reported)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ROUTER_ENABLED", "false")
+    sys.path.insert(0, TESTS_DIR)
+    sys.path.insert(0, os.path.abspath(args.repo))
+    # กราฟและ metrics log ถูกเขียนด้วยเส้นทางแบบ relative จึงรันในโฟลเดอร์ชั่วคราว
+    os.chdir(tempfile.mkdtemp(prefix="bench_supervisor_"))
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import pandas as pd
+    from langchain_core.agents import AgentAction
+
+    from datahandle import DataHandler
+    from llm_stub import StubLLM
+    from supervisor import SupervisorAgent
+
+    pd.DataFrame({"x": range(50), "y": [i * 2 for i in range(50)]}).to_csv("data.csv", index=False)
+    handler = DataHandler()
+    handler.dataset_paths["data.csv"] = os.path.abspath("data.csv")
+    handler.load_data()
+
+    with StubLLM(latency=args.latency) as stub:
+        agent = SupervisorAgent(
+            temperature=0, base_url=stub.base_url, model_name="bench-model",
+            dataset_paths=handler.dataset_paths, dataset_key="data.csv", session_id="bench",
+            supervisor_api_key="bench", agent_api_key="bench", explanner_api_key="bench",
+        )
+        print(f"repo: {os.path.abspath(args.repo)}  latency: {args.latency}s  runs: {args.runs}")
+        for label, query in QUERIES.items():
+            times = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                response = agent.run(query)
+                times.append(time.perf_counter() - started)
+                if response.error:
+                    raise SystemExit(f"{label}: {response.error}")
+            print(f"  {label:<38} median {statistics.median(times):.2f}s")
+
+        if hasattr(agent, "_aprocess_steps"):
+            from event_loop import run_coroutine
+            for count in (1, 3):
+                steps = [(AgentAction("pandas_agent", "q", ""), {"code": STEP_CODE}) for _ in range(count)]
+                started = time.perf_counter()
+                run_coroutine(agent._aprocess_steps(steps, "q"))
+                print(f"  pandas steps in one response: {count}  {time.perf_counter() - started:.2f}s")
+        print(f"  completions served by stub: {stub.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# โมดูลของแอปอยู่ที่ root ของ repository (ไม่ได้เป็น package) จึงเพิ่ม path ให้ import ได้จาก tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
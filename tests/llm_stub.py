@@ -0,0 +1,118 @@
+# -----------------------------------------------------------------------
+# endpoint จำลองที่เข้ากันได้กับ OpenAI Chat Completions สำหรับทดสอบและ benchmark SupervisorAgent แบบ offline
+# ตอบตาม prompt ของแต่ละ agent (supervisor, pandas_agent, analysis_agent และ explanation) หลังหน่วงเวลา latency วินาที
+# รองรับทั้งการตอบแบบปกติและแบบ stream (server-sent events)
+# -----------------------------------------------------------------------
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PLOT_CODE = "plt.figure()\nplt.bar(df['x'], df['y'])\nprint(tabulate(df.head(), headers='keys'))"
+
+
+def _reply(text: str) -> str:
+    # เลือกคำตอบตาม prompt ที่ได้รับ
+    if "Do I need to use a tool" in text:
+        tail = text.split("New input:")[-1]
+        steps = tail.count("Observation:")
+        if "mixed" in tail and steps < 2:
+            # คำถามแบบผสม: เรียก analysis_agent แล้วจึงเรียก pandas_agent
+            tool = ["analysis_agent", "pandas_agent"][steps]
+            return f"Thought: Do I need to use a tool? Yes\nAction: {tool}\nAction Input: mixed"
+        if steps:
+            return "Thought: Do I need to use a tool? No\nFinal Answer: Here is the chart."
+        tool = "analysis_agent" if "average" in tail else "pandas_agent"
+        return f"Thought: Do I need to use a tool? Yes\nAction: {tool}\nAction Input: plot x vs y"
+    if "Return the explanation as a JSON" in text:
+        return json.dumps({"explanation": "The chart shows x vs y."})
+    if "ANALYSIS REQUEST" in text:
+        return json.dumps({"query": "avg", "explanation": "Average is 24.5", "code": ""})
+    return json.dumps({"query": "plot", "explanation": "plot", "code": PLOT_CODE})
+
+
+class StubLLM:
+    """
+    endpoint จำลองที่รันใน background thread (ใช้ base_url กับ ChatOpenAI ได้โดยตรง)
+
+    ตัวอย่าง:
+        with StubLLM(latency=0.3) as stub:
+            agent = SupervisorAgent(..., base_url=stub.base_url, ...)
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        ตัวสร้างสำหรับ StubLLM
+        Parameters:
+            latency (float): เวลาที่หน่วงก่อนตอบแต่ละ request (วินาที)
+        """
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llm-stub", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self) -> "StubLLM":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, content_type: str, body: bytes, chunked: bool = False) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                if chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                else:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data: str) -> None:
+                payload = f"data: {data}\n\n".encode()
+                self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                text = "\n".join(str(message.get("content")) for message in body["messages"])
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.latency)
+                out = _reply(text)
+                if body.get("stream"):
+                    self._send("text/event-stream", b"", chunked=True)
+                    for i in range(0, len(out), 8):
+                        self._chunk(json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": 0,
+                                                "model": body["model"], "choices": [
+                                                    {"index": 0, "delta": {"content": out[i:i + 8]}, "finish_reason": None}]}))
+                    self._chunk(json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": 0,
+                                            "model": body["model"], "choices": [
+                                                {"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+                    self._chunk("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+                response = {
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": out}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": len(out) // 4,
+                              "total_tokens": (len(text) + len(out)) // 4},
+                }
+                self._send("application/json", json.dumps(response).encode())
+
+        return Handler
@@ -0,0 +1,81 @@
+# -----------------------------------------------------------------------
+# agent ใน AgentPool ของไฟล์ที่ชื่อเดียวกันแต่เนื้อหาต่างกัน ต้องอ่าน DataFrame ของไฟล์ของตัวเอง
+# (DataHandler เก็บ DataFrame ตาม fingerprint ของไฟล์ ไม่ใช่ตามชื่อไฟล์)
+# -----------------------------------------------------------------------
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+
+from agent_pool import AgentPool
+from blob_store import dataset_fingerprint
+from datahandle import DataHandler
+from supervisor import SupervisorAgent
+
+MODEL = "test-model"
+
+
+def upload(directory, units):
+    # ไฟล์ชื่อ sales.csv เหมือนกันทุกครั้ง แต่เนื้อหาต่างกัน
+    directory.mkdir()
+    path = directory / "sales.csv"
+    pd.DataFrame({"region": ["north", "south"], "units": units}).to_csv(path, index=False)
+    fingerprint = dataset_fingerprint(str(path))
+    handler = DataHandler()
+    handler.dataset_paths[fingerprint] = str(path)
+    handler.load_data()
+    handler.preprocess_data()
+    return fingerprint, str(path)
+
+
+def factory(fingerprint, path, session_id):
+    # ไม่มีการเรียก LLM ในการทดสอบนี้ จึงใช้ URL และ key ที่ไม่มีอยู่จริง
+    return lambda: SupervisorAgent(
+        temperature=0, base_url="http://127.0.0.1:9/v1", model_name=MODEL,
+        dataset_paths={fingerprint: path}, dataset_key=fingerprint, dataset_name="sales", session_id=session_id,
+        supervisor_api_key="test", agent_api_key="test", explanner_api_key="test",
+    )
+
+
+def total_units(agent):
+    execution_result, _ = agent._execute("print(df['units'].sum())")
+    return execution_result.output.strip()
+
+
+def test_same_file_name_with_different_content_keeps_separate_frames(tmp_path):
+    pool = AgentPool(size=1)
+    first, first_path = upload(tmp_path / "a", [1, 2])
+    second, second_path = upload(tmp_path / "b", [10, 20])
+
+    agent_a = pool.acquire((first, MODEL, 0), "session-a", factory(first, first_path, "session-a"))
+    agent_b = pool.acquire((second, MODEL, 0), "session-b", factory(second, second_path, "session-b"))
+    assert (total_units(agent_a), total_units(agent_b)) == ("3", "30")
+    assert agent_a.dataset_name == agent_b.dataset_name == "sales"
+
+    # เมื่อ agent ของไฟล์แรกถูก evict จะ unload เฉพาะ DataFrame ของไฟล์แรก
+    pool.release("session-a")
+    handler = DataHandler()
+    assert handler.get_fingerprint(first) is None
+    assert handler.get_fingerprint(second) == second
+    assert total_units(agent_b) == "30"
+
+
+def test_agent_with_running_job_is_not_lent_to_another_session(tmp_path):
+    pool = AgentPool()
+    fingerprint, path = upload(tmp_path / "a", [1, 2])
+    key = (fingerprint, MODEL, 0)
+
+    agent_a = pool.acquire(key, "session-a", factory(fingerprint, path, "session-a"))
+    pool.pin(agent_a)
+    # session-a เปลี่ยนไปใช้ session อื่นระหว่างที่ job ทำงาน
+    pool.release("session-a")
+
+    agent_b = pool.acquire(key, "session-b", factory(fingerprint, path, "session-b"))
+    assert agent_b is not agent_a
+    assert agent_a.session_id == "session-a"
+    # session เดิมกลับมาได้ agent ที่ job ของตัวเองกำลังใช้อยู่
+    assert pool.acquire(key, "session-a", factory(fingerprint, path, "session-a")) is agent_a
+
+    pool.release("session-a")
+    pool.unpin(agent_a)
+    assert pool.acquire(key, "session-c", factory(fingerprint, path, "session-c")) is agent_a
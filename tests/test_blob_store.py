@@ -0,0 +1,26 @@
+# -----------------------------------------------------------------------
+# การเก็บไฟล์ที่เนื้อหาเหมือนกันเพียงครั้งเดียวของ BlobStore
+# -----------------------------------------------------------------------
+import io
+import os
+
+from blob_store import BlobStore
+
+CONTENT = b"region,units\nnorth,1\nsouth,5\n"
+
+
+def test_same_content_with_other_extension_reuses_existing_file(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest, created = store.put_stream(io.BytesIO(CONTENT), ".csv", session_id="s1")
+    same_digest, created_again = store.put_stream(io.BytesIO(CONTENT), ".TXT", session_id="s2")
+
+    assert (same_digest, created, created_again) == (digest, True, False)
+    assert store.file_path(digest).endswith(".csv")
+    assert os.listdir(tmp_path / digest[:2]) == [f"{digest}.csv"]
+    assert store.refcount(digest) == 2
+
+    # เมื่อไม่มี session อ้างอิงแล้ว ไฟล์ถูกลบหมดโดยไม่มีไฟล์ที่ index ไม่ได้ติดตามค้างอยู่
+    store.release_session("s1")
+    store.release_session("s2")
+    assert store.collect(now=float("inf"))["removed"] == 1
+    assert os.listdir(tmp_path / digest[:2]) == []
@@ -0,0 +1,88 @@
+# -----------------------------------------------------------------------
+# การรันโค้ดหลายชุดพร้อมกัน (execute_code ใน thread ต่าง ๆ)
+# ตรวจว่า stdout และ figure ของแต่ละชุดไม่ปะปนกัน (stdout_capture / figure_manager แยกตาม thread)
+# -----------------------------------------------------------------------
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+import pytest
+
+from datahandle import DataHandler
+from supervisor import SupervisorAgent
+
+SNIPPETS = 8
+LINES = 5
+DATASET_KEY = "sales.csv"
+
+
+def snippet(index: int) -> str:
+    # พิมพ์สลับกับการหน่วงเวลา เพื่อให้ thread อื่นได้พิมพ์แทรกระหว่างบรรทัด
+    # และสร้างกราฟ pyplot (index % 3 + 1 รูป) กับ seaborn FacetGrid อีก 1 รูป
+    return f"""
+import time
+for k in range({LINES}):
+    print("snippet-{index}-line-" + str(k))
+    time.sleep(0.01)
+for k in range({index % 3 + 1}):
+    plt.figure()
+    plt.plot(df["units"])
+    time.sleep(0.01)
+grid = sns.FacetGrid(df, col="region")
+grid.map(plt.hist, "units")
+print("snippet-{index}-done")
+"""
+
+
+@pytest.fixture
+def agent(tmp_path):
+    path = tmp_path / DATASET_KEY
+    pd.DataFrame({
+        "region": ["north", "south"] * 10,
+        "units": range(20),
+    }).to_csv(path, index=False)
+    handler = DataHandler()
+    handler.dataset_paths[DATASET_KEY] = str(path)
+    handler.load_data()
+    # ไม่มีการเรียก LLM ในการทดสอบนี้ จึงใช้ URL และ key ที่ไม่มีอยู่จริง
+    return SupervisorAgent(
+        temperature=0, base_url="http://127.0.0.1:9/v1", model_name="test-model",
+        dataset_paths=handler.dataset_paths, dataset_key=DATASET_KEY, session_id="test",
+        supervisor_api_key="test", agent_api_key="test", explanner_api_key="test",
+    )
+
+
+def test_parallel_snippets_keep_their_own_output_and_plots(agent):
+    with ThreadPoolExecutor(max_workers=SNIPPETS) as pool:
+        results = list(pool.map(lambda i: agent._execute(snippet(i)), range(SNIPPETS)))
+
+    for index, (execution_result, figures) in enumerate(results):
+        assert execution_result.error is None
+        owners = set(re.findall(r"snippet-(\d+)-", execution_result.output))
+        assert owners == {str(index)}
+        assert execution_result.output.count(f"snippet-{index}-line-") == LINES
+        assert f"snippet-{index}-done" in execution_result.output
+        assert len(figures) == index % 3 + 1 + 1
+
+
+def test_parallel_snippets_do_not_share_the_dataframe(agent):
+    # แต่ละชุดเพิ่มคอลัมน์ของตัวเองและแก้ไขค่าแบบ inplace แล้วตรวจว่าไม่เห็นการแก้ไขของชุดอื่น
+    def mutate(index: int):
+        return agent._execute(f"""
+import time
+df["snippet_{index}"] = {index}
+df.drop(columns=["region"], inplace=True)
+time.sleep(0.05)
+print(sorted(c for c in df.columns if c.startswith("snippet_")))
+""")
+
+    with ThreadPoolExecutor(max_workers=SNIPPETS) as pool:
+        results = list(pool.map(mutate, range(SNIPPETS)))
+
+    for index, (execution_result, _) in enumerate(results):
+        assert execution_result.error is None
+        assert execution_result.output.strip() == str([f"snippet_{index}"])
+    assert list(agent.pandas_agent.handler.get_data(DATASET_KEY).columns) == ["region", "units"]
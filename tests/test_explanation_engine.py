@@ -0,0 +1,63 @@
+# -----------------------------------------------------------------------
+# การจัดประเภทและคำอธิบายแบบ template ของ output จาก print(series), print(df) และค่าเดียว
+# -----------------------------------------------------------------------
+import pandas as pd
+
+from explanation_engine import COMPLEX, SCALAR, SMALL_TABLE, classify_output, explain_locally
+
+DF = pd.DataFrame({
+    "region": ["north", "south", "north", "east"],
+    "units": [1, 5, 3, 2],
+    "price": [10.0, 12.5, 9.0, 11.0],
+})
+
+
+def test_groupby_series_is_index_and_value():
+    output = str(DF.groupby("region")["units"].sum())
+
+    assert classify_output(output, None) == SMALL_TABLE
+    explanation = explain_locally(output, None, "units by region")
+    assert "3 rows and columns `region`, `units`" in explanation["explanation_en"]
+    assert "The highest `units` is 5 (region = south)" in explanation["explanation_en"]
+
+
+def test_unnamed_series_is_index_and_value():
+    output = str(pd.Series([1.5, 2.25], index=["a", "b"]))
+
+    explanation = explain_locally(output, None, "values")
+    assert explanation["kind"] == SMALL_TABLE
+    assert "columns `index`, `value`" in explanation["explanation_en"]
+    assert "dtype" not in explanation["explanation_en"]
+
+
+def test_abbreviated_or_multi_index_series_is_complex():
+    long_series = pd.Series(range(100), index=pd.date_range("2024-01-01", periods=100), name="x")
+    multi_index = DF.groupby(["region", "units"]).size()
+
+    assert classify_output(str(long_series), None) == COMPLEX
+    assert classify_output(str(multi_index), None) == COMPLEX
+
+
+def test_dataframe_is_small_table():
+    output = str(DF.groupby("region", as_index=False)[["units", "price"]].sum())
+
+    explanation = explain_locally(output, None, "units and price by region")
+    assert explanation["kind"] == SMALL_TABLE
+    assert "3 rows and columns `region`, `units`, `price`" in explanation["explanation_en"]
+    assert "The highest `price` is 19.0 (region = north)" in explanation["explanation_en"]
+
+
+def test_single_column_header_is_complex():
+    output = "Summary\nnorth    4\nsouth    5\nthe rest could not be grouped"
+
+    assert classify_output(output, None) == COMPLEX
+    assert explain_locally(output, None, "summary") is None
+
+
+def test_scalar():
+    output = f"Total units: {DF['units'].sum()}"
+
+    explanation = explain_locally(output, None, "ยอดรวม")
+    assert classify_output(output, None) == SCALAR
+    assert explanation["explanation"] == explanation["explanation_th"]
+    assert "**11**" in explanation["explanation_th"]
@@ -0,0 +1,68 @@
+# -----------------------------------------------------------------------
+# การลบไฟล์ output ฉบับเต็มและไฟล์ profile ของ janitor (ตามอายุและตามงบพื้นที่รวม)
+# และ quota ของ session ที่นับไฟล์ใน BlobStore ที่ session อ้างอิงอยู่
+# -----------------------------------------------------------------------
+import io
+import os
+import time
+
+from blob_store import BlobStore
+from janitor import Janitor
+from plot_store import PlotStore
+from session_store import SqliteSessionManager
+
+HOUR = 3600
+
+
+class NoSessions:
+    def list_sessions(self, limit, offset):
+        return []
+
+
+def write(path, size, age_hours, now):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (now - age_hours * HOUR, now - age_hours * HOUR))
+
+
+def test_artifacts_are_swept_by_age_and_counted_toward_budget(tmp_path):
+    now = time.time()
+    outputs, profiles = tmp_path / "outputs", tmp_path / "profiles"
+    outputs.mkdir()
+    profiles.mkdir()
+    write(outputs / "output_old.txt", 1000, 100, now)
+    write(outputs / "output_a.txt", 600_000, 5, now)
+    write(outputs / "output_b.txt", 600_000, 1, now)
+    write(profiles / "profile_old.prof", 500, 80, now)
+    write(profiles / "profile_new.prof", 500, 1, now)
+
+    janitor = Janitor(NoSessions(), PlotStore(str(tmp_path / "plots"), "/plots"),
+                      artifact_dirs=[str(outputs), str(profiles)], budget_mb=1, artifact_ttl_hours=72)
+    report = janitor.run_once(now)
+
+    # ไฟล์ที่เก่ากว่า 72 ชั่วโมงถูกลบตามอายุ และ output_a (เก่าที่สุดที่เหลือ) ถูกลบเพราะพื้นที่รวมเกิน 1 MB
+    assert sorted(os.listdir(outputs)) == ["output_b.txt"]
+    assert os.listdir(profiles) == ["profile_new.prof"]
+    assert report.artifact_files_removed == 3
+    assert report.artifact_bytes_freed == 601_500
+    assert report.disk_bytes == 600_500
+
+
+def test_session_quota_counts_referenced_blobs(tmp_path):
+    sessions = SqliteSessionManager(str(tmp_path / "sessions"))
+    blobs = BlobStore(str(tmp_path / "blobs"), orphan_grace=0)
+    session = sessions.create_session()
+    old, _ = blobs.put_stream(io.BytesIO(b"a" * 700_000), ".csv", session_id=session.session_id)
+    current, _ = blobs.put_stream(io.BytesIO(b"b" * 700_000), ".csv", session_id=session.session_id)
+    session.file_path, session.file_hash = blobs.file_path(current), current
+    sessions.save_session(session)
+
+    janitor = Janitor(sessions, PlotStore(str(tmp_path / "plots"), "/plots"), blob_store=blobs,
+                      artifact_dirs=[], quota_mb=1, budget_mb=100)
+    report = janitor.run_once()
+
+    # ไฟล์เก่าที่ไม่ได้ใช้งานถูกปล่อยการอ้างอิงและลบ ส่วนไฟล์ที่ session ใช้งานอยู่ยังอยู่
+    assert [digest for digest, _, _ in blobs.session_blobs(session.session_id)] == [current]
+    assert not os.path.exists(blobs.file_path(old, ".csv"))
+    assert os.path.exists(blobs.file_path(current))
+    assert report.upload_bytes_freed == 700_000
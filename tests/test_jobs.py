@@ -0,0 +1,50 @@
+# -----------------------------------------------------------------------
+# JobManager pin agent ของ job ไว้ใน AgentPool จนกว่า job จะเสร็จ
+# -----------------------------------------------------------------------
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+
+from agent_pool import AgentPool
+from blob_store import dataset_fingerprint
+from datahandle import DataHandler
+from jobs import FAILED, JobManager, JobStore
+from supervisor import SupervisorAgent
+
+MODEL = "test-model"
+
+
+def test_job_pins_agent_until_it_finishes(tmp_path, monkeypatch):
+    # log ของ metrics และไฟล์อื่นที่ใช้เส้นทางแบบ relative ถูกเขียนลงใน tmp_path
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "sales.csv"
+    pd.DataFrame({"region": ["north", "south"], "units": [1, 2]}).to_csv(path, index=False)
+    fingerprint = dataset_fingerprint(str(path))
+    handler = DataHandler()
+    handler.dataset_paths[fingerprint] = str(path)
+    handler.load_data()
+    handler.preprocess_data()
+
+    pool = AgentPool()
+    # LLM ที่ URL นี้ไม่มีอยู่จริง job จึงจบด้วย error หลังการเชื่อมต่อไม่สำเร็จ
+    agent = pool.acquire((fingerprint, MODEL, 0), "session-a", lambda: SupervisorAgent(
+        temperature=0, base_url="http://127.0.0.1:9/v1", model_name=MODEL,
+        dataset_paths={fingerprint: str(path)}, dataset_key=fingerprint, dataset_name="sales", session_id="session-a",
+        supervisor_api_key="test", agent_api_key="test", explanner_api_key="test",
+    ))
+    manager = JobManager(JobStore(str(tmp_path / "jobs.db")), pool=pool)
+    results = []
+
+    job_id = manager.submit("session-a", agent, "total units by region", on_result=lambda *args: results.append(args))
+    pool.release("session-a")
+    assert pool.stats()["leased"] == 1
+
+    deadline = time.monotonic() + 60
+    while manager.get(job_id).active() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert manager.get(job_id).status == FAILED
+    assert results and results[0][0] == "session-a"
+    assert pool.stats()["leased"] == 0
@@ -0,0 +1,116 @@
+# -----------------------------------------------------------------------
+# การจำกัดอัตราการเรียก LLM (llm_scheduler) กับ endpoint จำลองที่บังคับ rate limit จริง
+# endpoint จำลองรับได้ไม่เกิน STUB_LIMIT request ในทุกช่วง STUB_WINDOW วินาที และตอบ 429 พร้อม Retry-After เมื่อเกิน
+# -----------------------------------------------------------------------
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+import llm_scheduler
+from llm_scheduler import AsyncRateLimitedTransport, KeyLimiter, LLMScheduler, RateLimitedTransport, TokenBucket, _request_key
+
+STUB_LIMIT = 5
+STUB_WINDOW = 0.5
+REQUESTS = 10
+URL = "http://llm.test/v1/chat/completions"
+# limiter ที่ช้ากว่า endpoint: burst 1 request + 6 request/วินาที (ไม่เกิน 1 + 6 * STUB_WINDOW = 4 request ในทุกช่วง STUB_WINDOW)
+LIMITED_RPM = 360
+
+
+class RateLimitedEndpoint:
+    """
+    endpoint จำลองแบบ sliding window: request ที่เกิน STUB_LIMIT ในช่วง STUB_WINDOW วินาทีจะได้ 429
+    """
+
+    def __init__(self):
+        self.accepted: deque = deque()
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _handle(self) -> httpx.Response:
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted and now - self.accepted[0] >= STUB_WINDOW:
+                self.accepted.popleft()
+            if len(self.accepted) >= STUB_LIMIT:
+                self.rejected += 1
+                retry_after = STUB_WINDOW - (now - self.accepted[0])
+                return httpx.Response(429, headers={"Retry-After": f"{retry_after:.3f}"})
+            self.accepted.append(now)
+        return httpx.Response(200, json={"ok": True})
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        return self._handle()
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        return self._handle()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = LLMScheduler()
+    monkeypatch.setattr(llm_scheduler, "SCHEDULER", scheduler)
+    return scheduler
+
+
+def limit_key(scheduler: LLMScheduler, api_key: str) -> dict:
+    # กำหนด limiter ของ key ด้วย LIMITED_RPM และ bucket ขนาด 1 request
+    headers = {"Authorization": f"Bearer {api_key}"}
+    name = _request_key(httpx.Request("POST", URL, headers=headers))
+    limiter = KeyLimiter(name, rpm=LIMITED_RPM, tpm=0)
+    limiter.requests = TokenBucket(LIMITED_RPM, burst_seconds=0.1)
+    scheduler._limiters[name] = limiter
+    return headers
+
+
+def send_all(endpoint: RateLimitedEndpoint, headers: dict) -> list:
+    with httpx.Client(transport=RateLimitedTransport(httpx.MockTransport(endpoint))) as client:
+        with ThreadPoolExecutor(max_workers=REQUESTS) as pool:
+            return list(pool.map(lambda _: client.post(URL, headers=headers, json={}).status_code, range(REQUESTS)))
+
+
+def test_limiter_paces_requests_under_endpoint_limit(scheduler):
+    endpoint = RateLimitedEndpoint()
+    headers = limit_key(scheduler, "paced")
+
+    started = time.monotonic()
+    statuses = send_all(endpoint, headers)
+    elapsed = time.monotonic() - started
+
+    assert statuses == [200] * REQUESTS
+    assert endpoint.rejected == 0
+    # request แรกใช้ burst ที่เหลือถูกปล่อยทีละ 60 / LIMITED_RPM วินาที
+    assert elapsed >= (REQUESTS - 1) * 60 / LIMITED_RPM * 0.9
+
+
+def test_async_limiter_paces_requests_under_endpoint_limit(scheduler):
+    endpoint = RateLimitedEndpoint()
+    headers = limit_key(scheduler, "paced-async")
+
+    async def send_all_async():
+        transport = AsyncRateLimitedTransport(httpx.MockTransport(endpoint.handle_async))
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.gather(*(client.post(URL, headers=headers, json={}) for _ in range(REQUESTS)))
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(send_all_async()) == [200] * REQUESTS
+    assert endpoint.rejected == 0
+
+
+def test_unlimited_key_backs_off_on_retry_after(scheduler):
+    endpoint = RateLimitedEndpoint()
+    headers = {"Authorization": "Bearer unlimited"}
+
+    started = time.monotonic()
+    statuses = send_all(endpoint, headers)
+    elapsed = time.monotonic() - started
+
+    # endpoint ปฏิเสธ request ที่เกิน แต่ทุก request สำเร็จหลังรอตาม Retry-After (ไม่ retry ถี่ ๆ จนหมดจำนวนครั้ง)
+    assert statuses == [200] * REQUESTS
+    assert endpoint.rejected > 0
+    assert elapsed >= STUB_WINDOW * 0.9
@@ -0,0 +1,56 @@
+# -----------------------------------------------------------------------
+# การใช้ observation เดิมและการนับ step ที่ไม่คืบหน้าของ LoopGuard
+# -----------------------------------------------------------------------
+from langchain_core.agents import AgentAction
+
+from loop_guard import LoopGuard
+
+
+def action(tool_input: str, tool: str = "pandas_agent") -> AgentAction:
+    return AgentAction(tool=tool, tool_input=tool_input, log="")
+
+
+def test_different_year_is_not_reused():
+    guard = LoopGuard(no_progress_steps=2)
+    guard.record(action("plot revenue for 2023"), {"plots": ["revenue_2023.png"]})
+
+    assert guard.lookup(action("plot revenue for 2024")) is None
+
+
+def test_whitespace_and_punctuation_only_difference_is_reused():
+    guard = LoopGuard(no_progress_steps=2)
+    observation = {"plots": ["revenue_2023.png"]}
+    guard.record(action("plot revenue for 2023"), observation)
+
+    assert guard.lookup(action("  Plot revenue, for 2023!")) is observation
+    assert guard.lookup(action('"plot   revenue for 2023"')) is observation
+    assert guard.lookup(action("plot revenue for 2023", tool="analysis_agent")) is None
+
+
+def test_near_duplicates_with_new_observations_make_progress():
+    guard = LoopGuard(no_progress_steps=2)
+    guard.record(action("plot revenue for 2023"), {"plots": ["revenue_2023.png"]})
+    guard.record(action("plot revenue for 2024"), {"plots": ["revenue_2024.png"]})
+    guard.record(action("plot revenue for 2025"), {"plots": ["revenue_2025.png"]})
+
+    assert not guard.should_stop()
+
+
+def test_repeated_observations_count_toward_no_progress():
+    guard = LoopGuard(no_progress_steps=2)
+    observation = {"output": "no rows match the filter"}
+    guard.record(action("revenue for region north"), observation)
+    guard.record(action("revenue of region north"), observation)
+    assert not guard.should_stop()
+
+    guard.record(action("revenue in region north"), observation)
+    assert guard.should_stop()
+
+
+def test_distinct_requests_make_progress():
+    guard = LoopGuard(no_progress_steps=2)
+    guard.record(action("plot revenue for 2023"), {"plots": ["revenue_2023.png"]})
+    guard.record(action("average order value by region"), {"output": "north 10.5"})
+    guard.record(action("top 5 customers by total spend"), {"output": "alice 900"})
+
+    assert not guard.should_stop()
@@ -0,0 +1,64 @@
+# -----------------------------------------------------------------------
+# การเขียนข้อความของ SqliteSessionManager (object ของ session ที่ล้าสมัยต้องไม่ทำให้ข้อความหาย)
+# และการย้าย session แบบ JSON ไปยัง SQLite
+# -----------------------------------------------------------------------
+import json
+import os
+
+from session_store import SqliteSessionManager, migrate_json_sessions
+
+
+def message(role, content):
+    return {"role": role, "content": content}
+
+
+def test_stale_session_object_does_not_drop_messages(tmp_path):
+    manager = SqliteSessionManager(str(tmp_path))
+    session_id = manager.create_session().session_id
+
+    # UI และ job ถือ object ของ session แยกกัน แต่ละฝั่งเพิ่มข้อความของตัวเอง
+    ui = manager.load_session(session_id)
+    job = manager.load_session(session_id)
+    manager.append_message(ui, message("user", "q1"))
+    manager.append_message(job, message("assistant", "a1"))
+    manager.append_message(ui, message("user", "q2"))
+    # object ที่ล้าสมัยบันทึกข้อมูลของ session อีกครั้ง
+    job.file_name = "data.csv"
+    manager.save_session(job)
+
+    assert [m["content"] for m in manager.load_messages(session_id)] == ["q1", "a1", "q2"]
+    assert manager.load_session(session_id).message_count == 3
+    assert manager.load_session(session_id).file_name == "data.csv"
+
+
+def test_clear_messages_is_explicit(tmp_path):
+    manager = SqliteSessionManager(str(tmp_path))
+    session = manager.create_session()
+    manager.append_message(session, message("user", "q1"))
+    manager.append_message(session, message("assistant", "a1"))
+
+    # รายการข้อความที่สั้นลงใน object ไม่ลบข้อความที่บันทึกแล้ว
+    session.messages = []
+    manager.save_session(session)
+    assert len(manager.load_messages(session.session_id)) == 2
+
+    manager.clear_messages(session.session_id)
+    manager.append_message(session, message("user", "q2"))
+    assert [m["content"] for m in manager.load_messages(session.session_id)] == ["q2"]
+    assert manager.load_session(session.session_id).message_count == 1
+
+
+def test_migration_leaves_legacy_files_untouched(tmp_path):
+    legacy = tmp_path / "legacy"
+    legacy.mkdir()
+    content = json.dumps({"session_id": "legacy", "created_at": "2024-01-01 00:00:00", "file_path": None,
+                          "messages": [message("user", "q1"), message("assistant", "a1")]})
+    (legacy / "session.json").write_text(content)
+
+    result = migrate_json_sessions(str(tmp_path), db_path=str(tmp_path / "sessions.db"))
+
+    assert result == {"migrated": 1, "skipped": 0, "failed": 0}
+    assert sorted(os.listdir(legacy)) == ["session.json"]
+    assert (legacy / "session.json").read_text() == content
+    target = SqliteSessionManager(str(tmp_path), db_path=str(tmp_path / "sessions.db"))
+    assert [m["content"] for m in target.load_messages("legacy")] == ["q1", "a1"]
@@ -0,0 +1,39 @@
+# -----------------------------------------------------------------------
+# การใช้ผลลัพธ์ที่รันไว้ล่วงหน้าของ SpeculativeDispatch เฉพาะเมื่อ Action Input ตรงกับคำถามเดิม
+# -----------------------------------------------------------------------
+import threading
+
+from speculative import SpeculativeDispatch, with_speculation
+
+
+def make_tool():
+    calls = []
+    lock = threading.Lock()
+
+    def tool(user_input, callbacks=None):
+        with lock:
+            calls.append(user_input)
+        return f"result for {user_input}"
+    return tool, calls
+
+
+def test_prefetched_result_is_used_for_same_question():
+    func, calls = make_tool()
+    tool = with_speculation("pandas_agent", func)
+    with SpeculativeDispatch({"pandas_agent": func}, "Plot revenue by month") as dispatch:
+        result = tool("  plot revenue by month!")
+
+    assert result == "result for Plot revenue by month"
+    assert dispatch.outcome == {"pandas_agent": "used"}
+    assert calls == ["Plot revenue by month"]
+
+
+def test_prefetched_result_is_not_used_for_other_input():
+    func, calls = make_tool()
+    tool = with_speculation("pandas_agent", func)
+    with SpeculativeDispatch({"pandas_agent": func}, "Plot revenue by month") as dispatch:
+        result = tool("plot revenue for 2024")
+
+    assert result == "result for plot revenue for 2024"
+    assert dispatch.outcome["pandas_agent"] in ("cancelled", "discarded")
+    assert calls[-1] == "plot revenue for 2024"
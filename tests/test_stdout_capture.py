@@ -0,0 +1,20 @@
+# -----------------------------------------------------------------------
+# ขนาดของไฟล์ output ฉบับเต็ม (spill) ของ BoundedOutput ถูกจำกัดตามจำนวน bytes
+# -----------------------------------------------------------------------
+from stdout_capture import BoundedOutput
+
+MAX_SPILL_BYTES = 100
+
+
+def test_spill_file_is_capped_in_bytes_for_multibyte_text(tmp_path):
+    output = BoundedOutput(max_chars=20, spill_dir=str(tmp_path), max_spill_bytes=MAX_SPILL_BYTES)
+    # ตัวอักษรไทยใช้ 3 bytes ต่อตัวใน utf-8
+    for _ in range(50):
+        output.write("สวัสดี\n")
+    output.close()
+
+    with open(output.artifact_path, "rb") as f:
+        data = f.read()
+    assert MAX_SPILL_BYTES - 3 < len(data) <= MAX_SPILL_BYTES
+    # ไม่ตัดกลางตัวอักษร
+    assert data.decode("utf-8").startswith("สวัสดี\n")
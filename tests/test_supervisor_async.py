@@ -0,0 +1,76 @@
+# -----------------------------------------------------------------------
+# SupervisorAgent.arun กับ endpoint จำลอง (tests/llm_stub.py)
+# ตรวจคำตอบของ query แบบ supervisor -> pandas_agent และแบบผสม และการประมวลผล pandas หลาย step พร้อมกัน
+# (ตัวเลข benchmark ดูได้จาก python tests/bench_supervisor.py)
+# -----------------------------------------------------------------------
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+import pytest
+from langchain_core.agents import AgentAction
+
+from datahandle import DataHandler
+from event_loop import run_coroutine
+from llm_stub import StubLLM
+import supervisor
+from supervisor import SupervisorAgent
+
+DATASET_KEY = "data.csv"
+STEP_SECONDS = 0.5
+
+
+@pytest.fixture
+def stub():
+    with StubLLM(latency=0.05) as stub:
+        yield stub
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch, stub):
+    # กราฟและ metrics log ถูกเขียนด้วยเส้นทางแบบ relative
+    monkeypatch.chdir(tmp_path)
+    # ส่งทุกคำถามผ่าน supervisor (ไม่ใช้ fast path ของ router)
+    monkeypatch.setattr(supervisor, "ROUTER_ENABLED", False)
+    path = tmp_path / DATASET_KEY
+    pd.DataFrame({"x": range(50), "y": [i * 2 for i in range(50)]}).to_csv(path, index=False)
+    handler = DataHandler()
+    handler.dataset_paths[DATASET_KEY] = str(path)
+    handler.load_data()
+    return SupervisorAgent(
+        temperature=0, base_url=stub.base_url, model_name="test-model",
+        dataset_paths=handler.dataset_paths, dataset_key=DATASET_KEY, session_id="test",
+        supervisor_api_key="test", agent_api_key="test", explanner_api_key="test",
+    )
+
+
+def test_plot_query_returns_plot_and_explanation(agent):
+    response = agent.run("plot x vs y")
+
+    assert response.error is None
+    assert response.metadata.tools_used == ["pandas_agent"]
+    assert len(response.plot_data["plots"]) == 1
+    assert response.sub_response["pandas_agent"].explanation
+
+
+def test_mixed_query_uses_both_tools(agent):
+    response = agent.run("mixed question about the data")
+
+    assert response.error is None
+    assert response.metadata.tools_used == ["analysis_agent", "pandas_agent"]
+    assert set(response.sub_response) == {"analysis_agent", "pandas_agent"}
+
+
+def test_pandas_steps_run_concurrently(agent):
+    code = f"import time\ntime.sleep({STEP_SECONDS})\nprint(df['y'].sum())"
+    steps = [(AgentAction("pandas_agent", "q", ""), {"code": code}) for _ in range(3)]
+
+    started = time.perf_counter()
+    sub_response, _ = run_coroutine(agent._aprocess_steps(steps, "q"))
+    elapsed = time.perf_counter() - started
+
+    assert sub_response["pandas_agent"].execution_result.output.strip() == "2450"
+    # หากแต่ละ step รันต่อกันจะใช้เวลาอย่างน้อย 3 * STEP_SECONDS
+    assert elapsed < 2 * STEP_SECONDS